@@ -0,0 +1,703 @@
+"""
+Async versions of the auth and notes views, used with API_ASYNC_VIEWS=1
+(e.g. `manage.py serve --asgi`).
+
+They return the same payloads as the DRF views in views.py. Database access
+goes through the async ORM (which runs queries on Django's thread-sensitive
+executor), while CPU-heavy work (password hashing, QR rendering) and note file
+I/O run on dedicated thread pools, so the event loop is never blocked and
+slow clients do not hold a worker.
+"""
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpResponseBase, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django_otp.plugins.otp_totp.models import TOTPDevice
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication, resolve_user
+from .batch import batch_summary, create_notes, delete_notes, parse_batch
+from .challenge import challenge_devices, create_challenge, read_challenge
+from .conditional import not_modified, notes_etag, set_validators, setup_etag
+from .downloads import (
+    CHUNK_SIZE, CONTENT_TYPE, download_response, open_download, prepare_download, set_download_headers,
+)
+from .export import EXPORTERS, FORMATS as EXPORT_FORMATS, set_export_headers
+from .hashing import HashingUnavailable
+from .models import Note
+from .notes import (
+    create_note, delete_note, find_notes, note_values, notes_page, notes_page_queryset,
+    parse_list_params, parse_preview, parse_search_params, serialize_note,
+)
+from .otp import verify_token
+from .search import is_available as search_available
+from .storage import get_note_storage
+from .throttling import check_login, check_mfa
+from . import hashing, qr
+from .views import get_tokens_for_user
+# Cheap views without I/O stay synchronous
+from .views import auth_rate_limits, logout, lucky_number, metrics_view, quote_of_the_day, welcome  # noqa: F401
+
+
+def async_api_view(http_method_names):
+    """
+    Restrict an async view to the given HTTP methods and exempt it from CSRF
+    checks, like DRF's @api_view does for the sync views. Django 4.2's
+    require_http_methods and csrf_exempt do not support coroutines.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def inner(request, *args, **kwargs):
+            if request.method not in http_method_names:
+                return HttpResponseNotAllowed(http_method_names)
+            return await func(request, *args, **kwargs)
+        inner.csrf_exempt = True
+        return inner
+    return decorator
+
+
+# Separate pools so note file I/O never queues behind CPU-bound work such as
+# password hashing (hashlib releases the GIL, so these threads use all cores).
+cpu_executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4), thread_name_prefix='api-cpu')
+io_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='api-io')
+
+
+def run_cpu_bound(func):
+    """
+    Run a CPU-heavy, non-ORM callable off the event loop.
+    """
+    return sync_to_async(func, thread_sensitive=False, executor=cpu_executor)
+
+
+def run_io_bound(func):
+    """
+    Run a blocking file I/O callable off the event loop.
+    """
+    return sync_to_async(func, thread_sensitive=False, executor=io_executor)
+
+
+def request_data(request):
+    """
+    Parse a JSON (or form-encoded) request body.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+async def aiter_download(download):
+    """
+    Async version of downloads.iter_download, reading on the I/O pool.
+    """
+    f = await run_io_bound(open_download)(download)
+    try:
+        remaining = download.length
+        while remaining > 0:
+            chunk = await run_io_bound(f.read)(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await run_io_bound(f.close)()
+
+
+async def aiter_export(chunks):
+    """
+    Step a sync export generator (export.py) off the event loop. Its
+    database cursor belongs to one connection, so every step runs on the
+    request's thread-sensitive thread, like the async ORM's queries.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await step(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+async def authenticate_jwt(request):
+    """
+    Authenticate the request with the same JWT authentication DRF uses.
+    Returns (user, error_response).
+    """
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return None, JsonResponse(
+            e.detail if isinstance(e.detail, dict) else {'detail': e.detail},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    if result is None:
+        return None, JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    return result[0], None
+
+
+async def check_credentials(username, password, request=None):
+    """
+    Async equivalent of authenticate(). With a single ModelBackend-like
+    backend configured (the default), the user is fetched with the async
+    ORM and the password hash is checked off the event loop (an upgraded
+    hash is saved through the ORM's thread, never the CPU pool); other
+    backend configurations go through hashing.authenticate_credentials()
+    in a thread.
+    """
+    model_backend = hashing.single_model_backend()
+    if model_backend is None:
+        return await sync_to_async(hashing.authenticate_credentials)(username, password, request)
+    path, backend = model_backend
+    # With the hashing process pool the thread only waits for the result
+    run_hash = run_io_bound if hashing.get_pool() else run_cpu_bound
+    try:
+        user = await User._default_manager.aget(**{User.USERNAME_FIELD: username})
+    except User.DoesNotExist:
+        # Run the default password hasher once to reduce the timing
+        # difference between an existing and a nonexistent user.
+        await run_hash(hashing.dummy_hash)(password)
+        user = None
+    else:
+        valid, rehashed = await run_hash(hashing.verify_password)(user, password)
+        if rehashed:
+            # Saved on the thread the ORM runs on, not on the hashing pool
+            await sync_to_async(hashing.save_password)(user, rehashed)
+        if not (valid and backend.user_can_authenticate(user)):
+            user = None
+    if user is None:
+        await sync_to_async(hashing.login_failed)(username, request)
+        return None
+    user.backend = path
+    return user
+
+
+def challenge_from_temp_token(temp_token, user_id, timestamp):
+    """
+    Read the MFA challenge of the temporary token.
+    Returns (challenge, error_response).
+    """
+    if not temp_token:
+        return None, JsonResponse(
+            {'error': 'temp_token is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(temp_token, str):
+        return None, JsonResponse(
+            {'error': 'temp_token must be a string'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        challenge = read_challenge(temp_token, user_id, timestamp)
+    except ValueError as e:
+        return None, JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if challenge is None:
+        return None, JsonResponse(
+            {'error': 'Invalid or expired temporary token. Please login again.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    return challenge, None
+
+
+def too_many_attempts(retry_after):
+    """
+    429 response for attempts rejected by the brute-force limiter.
+    """
+    response = JsonResponse(
+        {'error': 'Too many attempts. Please try again later.', 'retry_after': retry_after},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+@async_api_view(['POST'])
+async def login(request):
+    """
+    Login endpoint that accepts username and password.
+    Returns requires_mfa: true if user has MFA enabled.
+    """
+    data = request_data(request) or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return JsonResponse(
+            {'error': 'Username and password are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Reject excess attempts before paying for the password hash
+    retry_after = await run_io_bound(check_login)(request, username)
+    if retry_after:
+        return too_many_attempts(retry_after)
+
+    try:
+        user = await check_credentials(username, password, request)
+    except HashingUnavailable:
+        response = JsonResponse(
+            {'error': 'Server is busy. Please try again later.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = '1'
+        return response
+    if user is None:
+        return JsonResponse(
+            {'error': 'Invalid credentials'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    device = await TOTPDevice.objects.filter(user=user).order_by('-confirmed').values('id', 'confirmed').afirst()
+    temp_token, timestamp = create_challenge(user.id, device['id'] if device else None)
+    if device is not None and device['confirmed']:
+        payload = {'requires_mfa': True, 'message': 'MFA verification required'}
+    else:
+        payload = {'requires_mfa_setup': True, 'message': 'MFA setup required'}
+    return JsonResponse({
+        **payload,
+        'temp_token': temp_token,
+        'user_id': user.id,
+        'timestamp': timestamp
+    }, status=status.HTTP_200_OK)
+
+
+@async_api_view(['POST'])
+async def verify_mfa(request):
+    """
+    Verify MFA token and complete login.
+    Returns JWT tokens upon successful verification.
+    """
+    data = request_data(request) or {}
+    token = data.get('token')
+    temp_token = data.get('temp_token')
+
+    if not token or not temp_token:
+        return JsonResponse(
+            {'error': 'Token and temp_token are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    challenge, error = challenge_from_temp_token(temp_token, data.get('user_id'), data.get('timestamp'))
+    if error:
+        return error
+
+    retry_after = await run_io_bound(check_mfa)(request, challenge.user_id)
+    if retry_after:
+        return too_many_attempts(retry_after)
+
+    try:
+        device = await challenge_devices(challenge, confirmed=True).aget()
+    except TOTPDevice.DoesNotExist:
+        return JsonResponse(
+            {'error': 'MFA device not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    user = device.user
+
+    if not await sync_to_async(verify_token)(device, token):
+        return JsonResponse(
+            {'error': 'Invalid MFA token'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    tokens = await sync_to_async(get_tokens_for_user)(user)
+    return JsonResponse({
+        'message': 'MFA verified, login successful',
+        **tokens
+    }, status=status.HTTP_200_OK)
+
+
+@async_api_view(['GET'])
+async def mfa_setup(request):
+    """
+    Get or create MFA device and return QR code for setup.
+    Accepts a JWT or the temp_token returned by login for initial setup.
+    """
+    device = None
+    if request.headers.get('Authorization'):
+        user, error = await authenticate_jwt(request)
+        if error:
+            return error
+        user = await sync_to_async(resolve_user)(user)
+    else:
+        challenge, error = challenge_from_temp_token(
+            request.GET.get('temp_token'), request.GET.get('user_id'), request.GET.get('timestamp')
+        )
+        if error:
+            return error
+        if challenge.device_id is not None:
+            device = await challenge_devices(challenge).afirst()
+        if device is not None:
+            user = device.user
+        else:
+            try:
+                user = await User.objects.aget(id=challenge.user_id)
+            except User.DoesNotExist:
+                return JsonResponse(
+                    {'error': 'User not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+    device_name = f"my-mfa-app-{user.username}"
+    if device is None:
+        device, created = await TOTPDevice.objects.aget_or_create(
+            user=user,
+            defaults={'name': device_name, 'confirmed': False}
+        )
+    if device.name != device_name:
+        device.name = device_name
+        await device.asave()
+
+    if device.confirmed:
+        etag = setup_etag(device)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_validators(JsonResponse({
+            'setup_required': False,
+            'message': 'MFA is already set up'
+        }, status=status.HTTP_200_OK), etag)
+
+    qr_format = request.GET.get('qr_format', settings.MFA_QR_DEFAULT_FORMAT)
+    if qr_format not in qr.FORMATS:
+        return JsonResponse(
+            {'error': f'qr_format must be one of: {", ".join(qr.FORMATS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    etag = setup_etag(device, qr.build_config_url(device, user.username), qr_format)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    config_url, qr_code = await run_cpu_bound(qr.get_qr_code)(device, user.username, qr_format)
+    return set_validators(JsonResponse({
+        'qr_code': qr_code,
+        'otpauth_url': config_url,
+        'secret': device.key,
+        'setup_required': True
+    }, status=status.HTTP_200_OK), etag)
+
+
+@async_api_view(['POST'])
+async def mfa_confirm(request):
+    """
+    Confirm MFA setup by verifying the token.
+    Returns JWT tokens upon successful confirmation.
+    """
+    data = request_data(request) or {}
+    if request.headers.get('Authorization'):
+        user, error = await authenticate_jwt(request)
+        if error:
+            return error
+        user = await sync_to_async(resolve_user)(user)
+        devices = TOTPDevice.objects.filter(user=user)
+    else:
+        user = None
+        challenge, error = challenge_from_temp_token(data.get('temp_token'), data.get('user_id'), data.get('timestamp'))
+        if error:
+            return error
+        devices = challenge_devices(challenge)
+
+    token = data.get('token')
+    if not token:
+        return JsonResponse(
+            {'error': 'Token is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    retry_after = await run_io_bound(check_mfa)(request, user.id if user else challenge.user_id)
+    if retry_after:
+        return too_many_attempts(retry_after)
+
+    try:
+        device = await devices.aget(confirmed=False)
+    except TOTPDevice.DoesNotExist:
+        return JsonResponse(
+            {'error': 'No pending MFA device found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    user = user or device.user
+
+    if not await sync_to_async(verify_token)(device, token):
+        return JsonResponse(
+            {'error': 'Invalid token'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    device.confirmed = True
+    await device.asave()
+
+    tokens = await sync_to_async(get_tokens_for_user)(user)
+    return JsonResponse({
+        'message': 'MFA setup confirmed',
+        **tokens
+    }, status=status.HTTP_200_OK)
+
+
+@async_api_view(['GET'])
+async def notes_list(request):
+    """
+    Get the notes of the authenticated user, newest first, one page at a time.
+    See views.notes_list for the query parameters.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    try:
+        version, cursor, limit = parse_list_params(request.GET)
+    except ValueError as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    notes = Note.objects.filter(author_id=user.id)
+    preview = parse_preview(request.GET)
+    if version == '1':
+        rows = [row async for row in note_values(notes, preview)]
+    else:
+        rows = [row async for row in notes_page_queryset(notes, cursor, limit, preview)]
+    etag = notes_etag(user.id, rows, request.META.get('QUERY_STRING', ''))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    if version == '1':
+        notes_data = [serialize_note(row) for row in rows]
+        return set_validators(JsonResponse({'notes': notes_data}, status=status.HTTP_200_OK), etag)
+    return set_validators(JsonResponse(notes_page(rows, limit), status=status.HTTP_200_OK), etag)
+
+
+@async_api_view(['GET'])
+async def notes_search(request):
+    """
+    Full-text search of the authenticated user's notes.
+    See views.notes_search for the query parameters.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    if not search_available():
+        return JsonResponse(
+            {'error': 'Search is not available on this database'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+
+    try:
+        query, limit, offset = parse_search_params(request.GET)
+        results = await sync_to_async(find_notes)(user.id, query, limit, offset)
+    except ValueError as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return JsonResponse(results, status=status.HTTP_200_OK)
+
+
+@async_api_view(['POST'])
+async def notes_create(request):
+    """
+    Create a new note, stored inline or as a txt file depending on its size.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    data = request_data(request) or {}
+    title = (data.get('title') or '').strip()
+    content = (data.get('content') or '').strip()
+
+    if not title:
+        return JsonResponse(
+            {'error': 'Title is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not content:
+        return JsonResponse(
+            {'error': 'Content is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    storage = get_note_storage()
+    try:
+        relative_path = await run_io_bound(storage.store)(content)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Failed to save file: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    note = await sync_to_async(create_note)(user.id, title, relative_path, content)
+    await run_io_bound(storage.ensure)(relative_path, content)
+
+    return JsonResponse({
+        'id': note.id,
+        'title': note.title,
+        'file_url': f'/api/notes/{note.id}/download/',
+        'created_at': note.created_at.isoformat(),
+        'message': 'Note created successfully'
+    }, status=status.HTTP_201_CREATED)
+
+
+@async_api_view(['POST'])
+async def notes_batch_create(request):
+    """
+    Create many notes in one request. See views.notes_batch_create.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    try:
+        items = parse_batch(request_data(request), 'notes')
+    except ValueError as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        results = await sync_to_async(create_notes)(user, items)
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Failed to create notes: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    summary = batch_summary(results, 'created')
+    response_status = status.HTTP_201_CREATED if summary['created'] else status.HTTP_400_BAD_REQUEST
+    return JsonResponse(summary, status=response_status)
+
+
+@async_api_view(['POST'])
+async def notes_batch_delete(request):
+    """
+    Delete many notes in one request. See views.notes_batch_delete.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    try:
+        ids = parse_batch(request_data(request), 'ids')
+        results = await sync_to_async(delete_notes)(user, ids)
+    except ValueError as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return JsonResponse(batch_summary(results, 'deleted'), status=status.HTTP_200_OK)
+
+
+@async_api_view(['GET'])
+async def notes_download(request, note_id):
+    """
+    Download a note file. Only the author can download their own notes.
+    Supports ETag/Last-Modified revalidation and single byte-range requests.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    try:
+        note = await Note.objects.aget(id=note_id, author_id=user.id)
+    except Note.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Note not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    try:
+        download = await run_io_bound(prepare_download)(request, note)
+    except FileNotFoundError:
+        return JsonResponse(
+            {'error': 'File not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return JsonResponse(
+            {'error': f'Failed to read file: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if isinstance(download, HttpResponseBase):
+        return download
+    if download.data is not None:
+        # Stored inline: no file to read
+        return download_response(download)
+    # An async iterator keeps memory flat under ASGI; Django 4.2 would
+    # otherwise buffer a sync FileResponse into a list before sending it.
+    response = StreamingHttpResponse(
+        aiter_download(download),
+        content_type=CONTENT_TYPE
+    )
+    return set_download_headers(response, download)
+
+
+@async_api_view(['GET'])
+async def notes_export(request):
+    """
+    Stream all notes of the authenticated user with their content.
+    See views.notes_export for the query parameters.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    export_format = request.GET.get('type', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse(
+            {'error': f'type must be one of: {", ".join(EXPORT_FORMATS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    response = StreamingHttpResponse(
+        aiter_export(EXPORTERS[export_format](user.id)),
+        content_type=EXPORT_FORMATS[export_format]
+    )
+    return set_export_headers(response, user.username, export_format)
+
+
+@async_api_view(['DELETE'])
+async def notes_delete(request, note_id):
+    """
+    Delete a note and its associated txt file.
+    """
+    user, error = await authenticate_jwt(request)
+    if error:
+        return error
+
+    try:
+        note = await Note.objects.aget(id=note_id, author_id=user.id)
+    except Note.DoesNotExist:
+        return JsonResponse(
+            {'error': 'Note not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    await sync_to_async(delete_note)(note)
+    await sync_to_async(get_note_storage().delete)(note.file_path)
+
+    return JsonResponse({'message': 'Note deleted successfully'}, status=status.HTTP_200_OK)
@@ -1,3 +1,72 @@
-# This file is no longer needed with JWT authentication
-# Keeping it empty for now in case it's imported elsewhere
-# Will be removed if not needed
+"""
+JWT authentication without a User query on every request.
+
+CachedJWTAuthentication resolves the user of an access token through a
+per-process LRU cache with a TTL (JWT_USER_CACHE_SIZE, JWT_USER_CACHE_TTL).
+Entries are dropped when the user is saved or deleted in this process
+(see user_cache.py and signals.py). That invalidation is per process:
+other worker processes keep their entry until it expires, so a user
+deactivated (or deleted, or whose password changed) through one worker
+stays authenticated on the others for up to JWT_USER_CACHE_TTL seconds
+(60 by default).
+
+With JWT_AUTH_STATELESS enabled no lookup is done at all: request.user is
+a simplejwt TokenUser built from the token claims (user id, username,
+is_staff), as issued by views.get_tokens_for_user, by a composed
+JWTStatelessUserAuthentication. Deactivating a user then only takes
+effect when their access token expires.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .user_cache import get_user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication with cached (or, in stateless mode, no) user lookups.
+    The cache is per process; see the module docstring for what that means
+    for deactivated users.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stateless = JWTStatelessUserAuthentication()
+
+    def get_user(self, validated_token):
+        if getattr(settings, 'JWT_AUTH_STATELESS', False):
+            return self.stateless.get_user(validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        cache = get_user_cache()
+        user = cache.get(user_id)
+        if user is not None:
+            if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    "The user's password has been changed.", code='password_changed'
+                )
+            return user
+
+        version = cache.version
+        user = super().get_user(validated_token)
+        cache.set(user_id, user, version)
+        return user
+
+
+def resolve_user(user):
+    """
+    The User instance for request.user, loading it for a stateless TokenUser.
+    """
+    if isinstance(user, TokenUser):
+        return User.objects.get(pk=user.pk)
+    return user
@@ -0,0 +1,130 @@
+"""
+Batch note creation and deletion, shared by the sync and async views.
+
+A batch costs one INSERT (bulk_create) or one DELETE, plus the matching
+search index update, inside a single transaction, and its note files are
+written or unlinked in parallel on the bounded storage thread pool (small
+notes are stored inline and have no file, see storage.py). Each
+item gets its own result, so one invalid note does not fail the rest of
+the batch.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import Note
+from .search import index_notes, unindex_notes
+from .storage import get_note_storage
+
+
+TITLE_MAX_LENGTH = Note._meta.get_field('title').max_length
+
+
+def parse_batch(data, key):
+    """
+    Return the list of items under data[key]. Raises ValueError with a
+    client-facing message if it is missing, empty or too large.
+    """
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'{key} must be a non-empty list')
+    if len(items) > settings.NOTES_BATCH_MAX_ITEMS:
+        raise ValueError(f'At most {settings.NOTES_BATCH_MAX_ITEMS} {key} per request')
+    return items
+
+
+def validate_note(item):
+    """
+    Return (title, content, error) for one note of a create batch.
+    """
+    if not isinstance(item, dict):
+        return None, None, 'Note must be an object'
+    title = item.get('title')
+    content = item.get('content')
+    title = title.strip() if isinstance(title, str) else ''
+    content = content.strip() if isinstance(content, str) else ''
+    if not title:
+        return None, None, 'Title is required'
+    if len(title) > TITLE_MAX_LENGTH:
+        return None, None, f'Title must be at most {TITLE_MAX_LENGTH} characters'
+    if not content:
+        return None, None, 'Content is required'
+    return title, content, None
+
+
+def create_notes(user, items):
+    """
+    Create notes from a list of {'title', 'content'} objects.
+    Returns one result per item, in order.
+    """
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        title, content, error = validate_note(item)
+        if error:
+            results[index] = {'index': index, 'created': False, 'error': error}
+        else:
+            pending.append((index, title, content))
+
+    storage = get_note_storage()
+    saved = storage.store_many([content for _, _, content in pending])
+
+    written = []
+    for (index, title, content), path in zip(pending, saved):
+        if isinstance(path, Exception):
+            results[index] = {'index': index, 'created': False, 'error': f'Failed to save file: {str(path)}'}
+        else:
+            written.append((index, content, Note(
+                author_id=user.id, title=title, file_path=path, content=None if path else content,
+            )))
+
+    notes = [note for _, _, note in written]
+    try:
+        with transaction.atomic():
+            Note.objects.bulk_create(notes)
+            index_notes((note.id, user.id, note.title, content) for _, content, note in written)
+    except Exception:
+        # No row references the files written for this batch
+        storage.delete_many([note.file_path for note in notes])
+        raise
+    storage.ensure_many([note.file_path for note in notes], [content for _, content, _ in written])
+
+    for index, _, note in written:
+        results[index] = {
+            'index': index,
+            'created': True,
+            'id': note.id,
+            'title': note.title,
+            'file_url': f'/api/notes/{note.id}/download/',
+            'created_at': note.created_at.isoformat(),
+        }
+    return results
+
+
+def delete_notes(user, ids):
+    """
+    Delete the user's notes with the given ids and their files.
+    Returns one result per distinct id, in order.
+    """
+    if not all(isinstance(note_id, int) and not isinstance(note_id, bool) for note_id in ids):
+        raise ValueError('ids must be a list of integers')
+    ids = list(dict.fromkeys(ids))
+
+    with transaction.atomic():
+        file_paths = dict(Note.objects.filter(author_id=user.id, id__in=ids).values_list('id', 'file_path'))
+        unindex_notes(file_paths)
+        Note.objects.filter(id__in=file_paths).delete()
+    get_note_storage().delete_many(file_paths.values())
+
+    return [
+        {'id': note_id, 'deleted': True} if note_id in file_paths
+        else {'id': note_id, 'deleted': False, 'error': 'Note not found'}
+        for note_id in ids
+    ]
+
+
+def batch_summary(results, key):
+    """
+    Response payload for a batch: the per-item results plus counts.
+    """
+    succeeded = sum(1 for result in results if result[key])
+    return {'results': results, key: succeeded, 'failed': len(results) - succeeded}
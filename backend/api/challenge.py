@@ -0,0 +1,94 @@
+"""
+Signed MFA challenge tokens.
+
+After a successful password login the client gets a temp_token that
+proves it for the next 5 minutes. The token is signed with
+django.core.signing and carries the user id and the id of the user's TOTP
+device, so mfa/verify, mfa/setup and mfa/confirm load the device and its
+user with a single select_related query.
+
+The previous tokens (a hash of user id + timestamp + SECRET_KEY, sent
+along with user_id and timestamp) are still accepted, so clients that
+logged in before an upgrade can finish their MFA step.
+"""
+import hashlib
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core import signing
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+
+CHALLENGE_SALT = 'api.mfa-challenge'
+CHALLENGE_MAX_AGE = 300  # 5 minutes
+
+
+class Challenge(NamedTuple):
+    user_id: int
+    device_id: Optional[int]
+
+
+def create_challenge(user_id, device_id=None):
+    """
+    Create the temporary token used for the MFA flow.
+    Returns (temp_token, timestamp).
+    """
+    timestamp = int(time.time())
+    value = f'{user_id}.{device_id or 0}'
+    return signing.TimestampSigner(salt=CHALLENGE_SALT).sign(value), timestamp
+
+
+def verify_temp_token(temp_token, user_id, timestamp):
+    """
+    Verify the legacy temporary token used for MFA flow.
+    Token is valid for 5 minutes.
+    """
+    current_time = int(time.time())
+    if current_time - timestamp > CHALLENGE_MAX_AGE:
+        return False
+
+    temp_token_data = f"{user_id}:{timestamp}:{settings.SECRET_KEY}"
+    expected_token = hashlib.sha256(temp_token_data.encode()).hexdigest()[:32]
+    return temp_token == expected_token
+
+
+def read_challenge(temp_token, user_id=None, timestamp=None):
+    """
+    Return the Challenge of a temporary token, or None if it is invalid
+    (including not a string) or expired. Legacy tokens also need user_id
+    and timestamp; ValueError is raised with a client-facing message if
+    those are missing or malformed.
+    """
+    if not isinstance(temp_token, str):
+        return None
+    if ':' not in temp_token:
+        if not user_id or not timestamp:
+            raise ValueError('temp_token, user_id, and timestamp are required')
+        try:
+            user_id_int = int(user_id)
+            timestamp_int = int(timestamp)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid user_id or timestamp format')
+        if not verify_temp_token(temp_token, user_id_int, timestamp_int):
+            return None
+        return Challenge(user_id_int, None)
+
+    try:
+        value = signing.TimestampSigner(salt=CHALLENGE_SALT).unsign(temp_token, max_age=CHALLENGE_MAX_AGE)
+        challenge_user_id, device_id = (int(part) for part in value.split('.'))
+    except (signing.BadSignature, ValueError):
+        return None
+    if user_id and str(user_id) != str(challenge_user_id):
+        return None
+    return Challenge(challenge_user_id, device_id or None)
+
+
+def challenge_devices(challenge, **filters):
+    """
+    The TOTP devices a challenge refers to, with their user joined in.
+    """
+    devices = TOTPDevice.objects.select_related('user').filter(user_id=challenge.user_id, **filters)
+    if challenge.device_id is not None:
+        devices = devices.filter(id=challenge.device_id)
+    return devices
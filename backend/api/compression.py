@@ -0,0 +1,103 @@
+"""
+Compression codecs for stored notes.
+
+A note file whose content is at least NOTES_COMPRESS_MIN_SIZE bytes is
+stored compressed with the NOTES_COMPRESSION codec, and its file name gets
+the codec's suffix (<name>.txt.gz for gzip). The suffix alone tells how a
+stored file is encoded, so files written before compression was enabled,
+or with another codec, keep working.
+
+Codecs whose content_encoding is an HTTP content coding can be served as
+is to clients that accept it; downloads are decompressed in a stream
+otherwise. Other codecs can be added with register_codec().
+"""
+import gzip
+import struct
+
+
+class Codec:
+    """
+    A compression format for note files.
+
+    name is the value of NOTES_COMPRESSION, suffix is appended to the file
+    name, and content_encoding is the HTTP content coding the compressed
+    bytes can be sent with (None if there is none).
+    """
+    name = None
+    suffix = None
+    content_encoding = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def open(self, path):
+        """
+        Open a stored file as a binary stream of the decompressed content.
+        """
+        raise NotImplementedError
+
+    def decompressed_size(self, path):
+        """
+        Size of the decompressed content, ideally without decompressing it.
+        """
+        with self.open(path) as f:
+            return f.seek(0, 2)
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    suffix = '.gz'
+    content_encoding = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        # mtime=0 makes the output, and so ETags and deduplication, depend
+        # on the content only
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def open(self, path):
+        return gzip.open(path, 'rb')
+
+    def decompressed_size(self, path):
+        # The gzip trailer ends with the content size modulo 2**32, exact
+        # for any note below 4 GiB
+        with open(path, 'rb') as f:
+            if f.seek(0, 2) < 4:
+                return super().decompressed_size(path)
+            f.seek(-4, 2)
+            return struct.unpack('<I', f.read(4))[0]
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    """
+    The codec configured as NOTES_COMPRESSION, or None for no compression.
+    Raises ValueError for an unknown name.
+    """
+    if not name:
+        return None
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f'Unknown NOTES_COMPRESSION codec: {name}')
+
+
+def codec_for_path(file_path):
+    """
+    The codec a stored file was written with, or None if it is plain text.
+    """
+    for codec in CODECS.values():
+        if file_path.endswith('.txt' + codec.suffix):
+            return codec
+    return None
+
+
+register_codec(GzipCodec())
@@ -0,0 +1,96 @@
+"""
+Conditional GET for the read endpoints: ETag, Last-Modified and
+Cache-Control, and 304 Not Modified without building the response body.
+
+Each view derives a validator from state that is cheaper to read than
+the payload it describes, checks it against If-None-Match /
+If-Modified-Since before doing the real work, and attaches it to the full
+response otherwise:
+
+* notes_list: the ids and updated_at of the rows of the requested page
+  (fetched with the same keyset query, which costs as much as the page
+  itself) plus the query string, so a 304 only skips serializing and
+  rendering them. Anything that changes a listed field must bump
+  updated_at, as Note.save() does; a QuerySet.update() must set it too,
+  as migrate_note_tiers does when it moves notes between tiers. No
+  Last-Modified is sent, since a deletion does not move it forward;
+* mfa_setup: the device, whether it is confirmed and the otpauth:// URL
+  the QR code is rendered from, so a 304 skips the QR code entirely;
+* quote_of_the_day: the date, with Last-Modified at midnight and max-age
+  until the next one;
+* welcome: a constant.
+
+The responses are per user, so they are marked private (and vary on
+Authorization); all but the quote must be revalidated on every use
+(no-cache). Authentication and permissions still run before a 304.
+"""
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """
+    A strong ETag from the given values.
+    """
+    digest = hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def notes_etag(user_id, rows, query_string):
+    """
+    ETag of a notes list page from its values() rows (including the extra
+    row notes_page_queryset() fetches, which decides next_cursor).
+    """
+    return make_etag('notes', user_id, query_string, *(f"{row['id']}@{row['updated_at'].isoformat()}" for row in rows))
+
+
+def setup_etag(device, config_url=None, qr_format=None):
+    """
+    ETag of an mfa_setup response for the device.
+    """
+    if device.confirmed:
+        return make_etag('mfa_setup', device.pk, 'confirmed')
+    return make_etag('mfa_setup', device.pk, config_url, qr_format)
+
+
+def day_validators(day=None):
+    """
+    (etag, last_modified, max_age) of content that changes once a day, in
+    the current time zone.
+    """
+    day = day or timezone.localdate()
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    max_age = int((start + timedelta(days=1) - timezone.now()).total_seconds())
+    return make_etag('day', day.isoformat()), int(start.timestamp()), max(max_age, 0)
+
+
+def set_validators(response, etag=None, last_modified=None, max_age=None):
+    """
+    Add the validators and caching headers to a response. Without max_age
+    the client must revalidate before reusing it.
+    """
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if max_age is None:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def not_modified(request, etag=None, last_modified=None, max_age=None):
+    """
+    Return a 304 Not Modified response (or 412 for a failed precondition)
+    if the request's conditional headers match these validators, else None.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None and response.status_code == 304:
+        set_validators(response, etag, last_modified, max_age)
+    return response
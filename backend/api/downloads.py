@@ -0,0 +1,241 @@
+"""
+Note download responses: streamed file bodies, conditional GET and
+single byte-range requests.
+
+The note file is never read into memory as a whole. Full downloads are
+served with FileResponse, which lets the WSGI server use sendfile(), and
+ranges are streamed in fixed-size chunks, so memory per download stays
+constant regardless of note size.
+
+Compressed note files (see compression.py) are sent as stored, with
+Content-Encoding, to clients that accept the encoding, so they are never
+recompressed. Other clients, and Range requests, get the plain text,
+decompressed while it is streamed.
+
+Notes stored inline (see storage.py) are sent from Note.content, without
+touching the file system.
+"""
+import io
+import os
+import re
+from dataclasses import dataclass
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from .compression import codec_for_path
+from .notes import content_disposition
+from .storage import get_note_storage
+
+
+CHUNK_SIZE = 64 * 1024
+CONTENT_TYPE = 'text/plain; charset=utf-8'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+@dataclass
+class Download:
+    """
+    A note download after validators and the Range header were evaluated.
+    start/length describe the byte range to send; partial is True for 206.
+    codec is set when the file is stored compressed; encoding is the
+    Content-Encoding it is sent with, or None if it must be decompressed.
+    data is the content of an inline note, which has no path.
+    """
+    note: object
+    path: str
+    size: int
+    etag: str
+    last_modified: int
+    start: int = 0
+    length: int = 0
+    partial: bool = False
+    codec: object = None
+    encoding: str = None
+    data: bytes = None
+
+    @property
+    def decompress(self):
+        return self.codec is not None and self.encoding is None
+
+
+def parse_range(header, size):
+    """
+    Parse a single "bytes=start-end" range. Returns (start, length), or None
+    when the header should be ignored (missing, malformed or multi-range).
+    Raises RangeNotSatisfiable for ranges outside the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable
+        start = max(0, size - suffix)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, end - start + 1
+
+
+def if_range_matches(request, etag, last_modified):
+    """
+    A Range request is only honoured if its If-Range validator (if any)
+    still matches the current representation.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and date >= last_modified
+
+
+def accepts_encoding(request, encoding):
+    """
+    Whether the Accept-Encoding header allows the given content coding.
+    """
+    accepted = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted.get(encoding, accepted.get('*', 0.0)) > 0
+
+
+def prepare_download(request, note):
+    """
+    Stat the note file and evaluate conditional and Range headers.
+
+    Returns either a Download to be sent, or a complete HttpResponse for
+    304 Not Modified, 412 Precondition Failed or 416 Range Not Satisfiable.
+    Raises FileNotFoundError if the note file is missing.
+    """
+    path = data = codec = encoding = None
+    if not note.file_path:
+        data = note.content.encode('utf-8')
+        size = len(data)
+        etag = f'"{note.id:x}-{int(note.updated_at.timestamp() * 1e6):x}-{size:x}-inline"'
+        last_modified = int(note.updated_at.timestamp())
+    else:
+        path = get_note_storage().path(note.file_path)
+        stat = os.stat(path)
+        size = stat.st_size
+        codec = codec_for_path(note.file_path)
+        if codec is not None:
+            # Ranges always refer to the plain text
+            if (codec.content_encoding and not request.META.get('HTTP_RANGE')
+                    and accepts_encoding(request, codec.content_encoding)):
+                encoding = codec.content_encoding
+            else:
+                size = codec.decompressed_size(path)
+        etag = f'"{note.id:x}-{int(note.updated_at.timestamp() * 1e6):x}-{stat.st_size:x}-{stat.st_mtime_ns:x}'
+        etag += f'-{encoding}"' if encoding else '"'
+        last_modified = int(max(note.updated_at.timestamp(), stat.st_mtime))
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        if response.status_code == 304:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            if codec is not None:
+                patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    download = Download(note, path, size, etag, last_modified, length=size, codec=codec, encoding=encoding, data=data)
+    if request.method in ('GET', 'HEAD') and if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            download.start, download.length = byte_range
+            download.partial = True
+    return download
+
+
+def set_download_headers(response, download):
+    response['Content-Disposition'] = content_disposition(download.note.title)
+    response['Content-Length'] = str(download.length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = download.etag
+    response['Last-Modified'] = http_date(download.last_modified)
+    if download.encoding:
+        response['Content-Encoding'] = download.encoding
+    if download.codec is not None:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if download.partial:
+        response.status_code = 206
+        end = download.start + download.length - 1
+        response['Content-Range'] = f'bytes {download.start}-{end}/{download.size}'
+    return response
+
+
+def open_download(download):
+    """
+    Open the file of a Download positioned at its start, decompressing it
+    if it is sent as plain text.
+    """
+    if download.data is not None:
+        return io.BytesIO(download.data[download.start:])
+    f = download.codec.open(download.path) if download.decompress else open(download.path, 'rb')
+    try:
+        f.seek(download.start)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def iter_download(download):
+    """
+    Yield the bytes of a Download in CHUNK_SIZE pieces.
+    """
+    with open_download(download) as f:
+        remaining = download.length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def download_response(download):
+    """
+    Build the streamed response for a prepared Download.
+    """
+    if download.data is not None:
+        response = HttpResponse(download.data[download.start:download.start + download.length], content_type=CONTENT_TYPE)
+    elif download.partial or download.decompress:
+        response = StreamingHttpResponse(iter_download(download), content_type=CONTENT_TYPE)
+    else:
+        response = FileResponse(open(download.path, 'rb'), content_type=CONTENT_TYPE)
+        response.block_size = CHUNK_SIZE
+    return set_download_headers(response, download)
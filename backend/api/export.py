@@ -0,0 +1,236 @@
+"""
+Streamed export of all of a user's notes, as NDJSON or as a zip archive.
+
+The notes are read with QuerySet.iterator(), a server-side cursor on
+PostgreSQL and chunked fetches on SQLite, NOTES_EXPORT_CHUNK_SIZE rows at
+a time, and each note file is read in CHUNK_SIZE pieces. Output is
+yielded in pieces of about CHUNK_SIZE bytes as it is produced, so memory
+does not depend on the size of the notes, and the first bytes go out
+before the last note has been read.
+
+NDJSON: one object per note with its metadata and content, the content
+escaped piece by piece rather than read whole. Zip: one text file per
+note, written by zipfile to an unseekable stream (sizes and CRCs go in
+data descriptors after each file, and ZIP64 records are added for
+archives that need them), then a notes.ndjson manifest with the metadata
+and the file name of each note. Both come from the same single query, so
+the manifest lists exactly the files in the archive even when notes
+change during the export; its lines are collected in a spooled temporary
+file (on disk beyond MANIFEST_SPOOL_SIZE) as the files are written. The
+zip central directory at the end of the archive lists every file, so
+zipfile keeps a ZipInfo per note (about 0.7 KB) until then; NDJSON
+memory does not grow with the note count. Notes whose file is missing,
+including notes deleted after they were read, get an "error" in the
+NDJSON and the manifest and are listed in missing.txt at the end of the
+zip.
+
+A sync gunicorn worker is killed when it does not report to the master
+for SERVE_TIMEOUT seconds, which a long export would otherwise exceed:
+gunicorn.conf.py registers the worker's notify() with set_heartbeat(),
+and exports call it as they progress.
+"""
+import codecs
+import json
+import tempfile
+import time
+import urllib.parse
+import zipfile
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+
+from .models import Note
+from .notes import NOTE_LIST_FIELDS
+from .storage import get_note_storage
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Size of the zip manifest kept in memory before it is spooled to disk
+MANIFEST_SPOOL_SIZE = 1024 * 1024
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'zip': 'application/zip',
+}
+
+_heartbeat = None
+_last_beat = 0.0
+
+
+def set_heartbeat(func):
+    """
+    Register a callable telling the server this process is still alive.
+    """
+    global _heartbeat
+    _heartbeat = func
+
+
+def heartbeat():
+    global _last_beat
+    if _heartbeat is not None and time.monotonic() - _last_beat >= 1:
+        _last_beat = time.monotonic()
+        _heartbeat()
+
+
+def export_rows(user_id):
+    """
+    The user's notes as values() rows, oldest first, from a cursor.
+    """
+    return (
+        Note.objects.filter(author_id=user_id).order_by('id').values(*NOTE_LIST_FIELDS, 'content')
+        .iterator(chunk_size=getattr(settings, 'NOTES_EXPORT_CHUNK_SIZE', 2000))
+    )
+
+
+def note_metadata(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'created_at': row['created_at'].isoformat(),
+        'updated_at': row['updated_at'].isoformat(),
+    }
+
+
+def open_note(row):
+    """
+    Open a note as a binary stream of its content, or None if its file is
+    missing.
+    """
+    try:
+        return get_note_storage().open(row['file_path'], row['content'])
+    except FileNotFoundError:
+        return None
+
+
+def read_chunks(f):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+class Sink:
+    """
+    Write-only stream collecting output until it is taken in pieces.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self, minimum=CHUNK_SIZE):
+        """
+        Return and clear the collected bytes once there are at least
+        minimum of them, else b''.
+        """
+        if len(self.buffer) < minimum:
+            return b''
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def iter_ndjson(user_id):
+    """
+    Yield the user's notes as NDJSON, one object per line.
+    """
+    sink = Sink()
+    for row in export_rows(user_id):
+        heartbeat()
+        metadata = note_metadata(row)
+        f = open_note(row)
+        if f is None:
+            metadata.update(content=None, error='File not found')
+            sink.write(json.dumps(metadata, ensure_ascii=False).encode() + b'\n')
+        else:
+            # The metadata object, left open for the streamed content
+            sink.write(json.dumps(metadata, ensure_ascii=False)[:-1].encode() + b', "content": "')
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            with f:
+                for chunk in read_chunks(f):
+                    sink.write(json.dumps(decoder.decode(chunk), ensure_ascii=False)[1:-1].encode())
+                    data = sink.take()
+                    if data:
+                        yield data
+            sink.write(json.dumps(decoder.decode(b'', final=True), ensure_ascii=False)[1:-1].encode() + b'"}\n')
+        data = sink.take()
+        if data:
+            yield data
+    data = sink.take(minimum=1)
+    if data:
+        yield data
+
+
+def archive_name(row):
+    """
+    Name of a note's file in the zip archive: unique, and readable.
+    """
+    title = row['title'].replace('/', '_').replace('\\', '_').strip() or 'untitled'
+    return f'notes/{row["id"]}-{title[:100]}.txt'
+
+
+def iter_zip(user_id):
+    """
+    Yield a zip archive of the user's notes.
+    """
+    sink = Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive, \
+            tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL_SIZE) as manifest:
+        missing = []
+        for row in export_rows(user_id):
+            heartbeat()
+            metadata = note_metadata(row)
+            f = open_note(row)
+            if f is None:
+                missing.append(row['id'])
+                metadata.update(file=None, error='File not found')
+            else:
+                metadata['file'] = archive_name(row)
+                info = zipfile.ZipInfo(metadata['file'], row['updated_at'].astimezone(dt_timezone.utc).timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with f, archive.open(info, 'w') as entry:
+                    for chunk in read_chunks(f):
+                        entry.write(chunk)
+                        data = sink.take()
+                        if data:
+                            yield data
+            manifest.write(json.dumps(metadata, ensure_ascii=False).encode() + b'\n')
+            data = sink.take()
+            if data:
+                yield data
+
+        manifest.seek(0)
+        with archive.open('notes.ndjson', 'w') as entry:
+            for chunk in read_chunks(manifest):
+                entry.write(chunk)
+                data = sink.take()
+                if data:
+                    yield data
+        if missing:
+            archive.writestr('missing.txt', ''.join(f'{note_id}\n' for note_id in missing))
+    data = sink.take(minimum=1)
+    if data:
+        yield data
+
+
+EXPORTERS = {'ndjson': iter_ndjson, 'zip': iter_zip}
+
+
+def export_filename(username, fmt):
+    return f'notes-{urllib.parse.quote(username)}-{time.strftime("%Y%m%d")}.{fmt}'
+
+
+def set_export_headers(response, username, fmt):
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(username, fmt)}"'
+    response['Cache-Control'] = 'no-store'
+    # Send each piece as it is produced through nginx as well
+    response['X-Accel-Buffering'] = 'no'
+    return response
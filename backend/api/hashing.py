@@ -0,0 +1,262 @@
+"""
+Password verification in a bounded process pool.
+
+PBKDF2 keeps a CPU busy for the whole hash, so a burst of logins running
+in the request threads starves every other request of the same worker.
+With PASSWORD_HASH_POOL_SIZE > 0, password checks are sent to that many
+separate processes instead: at most PASSWORD_HASH_POOL_SIZE hashes run at
+once, up to PASSWORD_HASH_POOL_QUEUE more wait for a process, and a login
+that cannot get a queue slot within PASSWORD_HASH_POOL_TIMEOUT seconds is
+rejected with HashingUnavailable (503 in the views) instead of piling up.
+
+With the pool disabled (the default), authenticate_credentials() is
+Django's authenticate(). With the pool enabled it goes through the same
+AUTHENTICATION_BACKENDS in the same way: backends that authenticate like
+ModelBackend (ModelBackend and subclasses keeping its authenticate()) have
+their password hash checked in the pool, and still apply their
+user_can_authenticate() (is_active); any other backend is called as
+authenticate() would call it. A failed login sends user_login_failed
+either way.
+
+create_executor() builds the same kind of process pool for batch work
+outside requests, such as hashing the passwords of provisioned users
+(`manage.py provision_users`).
+"""
+import inspect
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model, load_backend
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import PermissionDenied
+
+from . import metrics
+
+
+class HashingUnavailable(Exception):
+    """
+    Raised when every hashing process is busy and the queue is full.
+    """
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def _verify(password, encoded):
+    """
+    Runs in a pool process (or in the caller without the pool). Returns
+    (valid, new_encoded), where new_encoded is the password rehashed with
+    the preferred hasher if it needs upgrading.
+    """
+    from django.contrib.auth.hashers import check_password, make_password
+    rehashed = []
+    valid = check_password(password, encoded, setter=lambda raw: rehashed.append(make_password(raw)))
+    return valid, rehashed[0] if rehashed else None
+
+
+def _dummy_hash(password):
+    from django.contrib.auth.hashers import make_password
+    make_password(password)
+
+
+def _make_passwords(passwords):
+    """
+    Runs in a pool process. Hash each password with the preferred hasher;
+    None gives an unusable password.
+    """
+    from django.contrib.auth.hashers import make_password
+    return [make_password(password) for password in passwords]
+
+
+def create_executor(max_workers):
+    """
+    A ProcessPoolExecutor of max_workers processes running Django with the
+    current settings. Processes are spawned rather than forked, so they do
+    not inherit database connections or threads.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'),),
+    )
+
+
+class HasherPool:
+    """
+    Process pool with a bounded number of pending password checks.
+    """
+
+    def __init__(self, size, queue_size, timeout):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size + queue_size)
+        self._executor = create_executor(size)
+
+    def run(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingUnavailable
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    The process-wide HasherPool, or None if PASSWORD_HASH_POOL_SIZE is 0.
+    """
+    global _pool
+    if not getattr(settings, 'PASSWORD_HASH_POOL_SIZE', 0):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HasherPool(
+                    settings.PASSWORD_HASH_POOL_SIZE,
+                    settings.PASSWORD_HASH_POOL_QUEUE,
+                    settings.PASSWORD_HASH_POOL_TIMEOUT,
+                )
+    return _pool
+
+
+def verify_password(user, password):
+    """
+    Check a password against user.password, in the pool if enabled,
+    without touching the database. Returns (valid, rehashed), where
+    rehashed is the password hashed with the preferred hasher if the
+    stored hash needs upgrading (see save_password()).
+    """
+    pool = get_pool()
+    with metrics.timer('api_password_hash_duration_seconds') as timer:
+        if pool is None:
+            valid, rehashed = _verify(password, user.password)
+        else:
+            valid, rehashed = pool.run(_verify, password, user.password)
+        timer.labels = ('valid' if valid else 'invalid',)
+    return valid, rehashed
+
+
+def save_password(user, encoded):
+    """
+    Store a password hash upgraded by verify_password().
+    """
+    user.password = encoded
+    user.save(update_fields=['password'])
+
+
+def check_password(user, password):
+    """
+    user.check_password(), with the hash computed in the pool if enabled.
+    """
+    valid, rehashed = verify_password(user, password)
+    if rehashed:
+        save_password(user, rehashed)
+    return valid
+
+
+def dummy_hash(password):
+    """
+    Hash a password and discard the result, so that a login for a
+    nonexistent user takes as long as one for an existing user.
+    """
+    pool = get_pool()
+    with metrics.timer('api_password_hash_duration_seconds', ('unknown_user',)):
+        if pool is None:
+            get_user_model()().set_password(password)
+        else:
+            pool.run(_dummy_hash, password)
+
+
+def is_model_backend(backend):
+    """
+    Whether an authentication backend authenticates like ModelBackend: a
+    user lookup and a password hash check, then user_can_authenticate().
+    """
+    # Imported here: pool processes import this module before django.setup()
+    from django.contrib.auth.backends import ModelBackend
+    return isinstance(backend, ModelBackend) and type(backend).authenticate is ModelBackend.authenticate
+
+
+def single_model_backend():
+    """
+    (path, backend) of the only configured authentication backend if it
+    authenticates like ModelBackend, else None.
+    """
+    if len(settings.AUTHENTICATION_BACKENDS) != 1:
+        return None
+    path = settings.AUTHENTICATION_BACKENDS[0]
+    backend = load_backend(path)
+    return (path, backend) if is_model_backend(backend) else None
+
+
+def login_failed(username, request=None):
+    """
+    Send user_login_failed the way authenticate() does, password masked.
+    """
+    user_login_failed.send(
+        sender='django.contrib.auth',
+        credentials={'username': username, 'password': '********************'},
+        request=request,
+    )
+
+
+def _model_backend_user(backend, username, password):
+    """
+    ModelBackend.authenticate(), with the hash computed in the pool.
+    """
+    user_model = get_user_model()
+    try:
+        user = user_model._default_manager.get_by_natural_key(username)
+    except user_model.DoesNotExist:
+        dummy_hash(password)
+        return None
+    if check_password(user, password) and backend.user_can_authenticate(user):
+        return user
+    return None
+
+
+def authenticate_credentials(username, password, request=None):
+    """
+    Return the active user with these credentials, or None.
+    Raises HashingUnavailable if the hashing pool is saturated.
+    """
+    pool = get_pool()
+    if pool is None:
+        # The hash runs inside authenticate(), timed with its user lookup
+        with metrics.timer('api_password_hash_duration_seconds') as timer:
+            user = authenticate(request, username=username, password=password)
+            timer.labels = ('valid' if user is not None else 'invalid',)
+        return user
+    # authenticate(), with ModelBackend's hash check sent to the pool
+    for path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(path)
+        try:
+            if is_model_backend(backend):
+                user = _model_backend_user(backend, username, password)
+            else:
+                try:
+                    inspect.signature(backend.authenticate).bind(request, username=username, password=password)
+                except TypeError:
+                    # This backend does not accept these credentials
+                    continue
+                user = backend.authenticate(request, username=username, password=password)
+        except PermissionDenied:
+            break
+        if user is not None:
+            user.backend = path
+            return user
+    login_failed(username, request)
+    return None
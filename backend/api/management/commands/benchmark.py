@@ -0,0 +1,498 @@
+"""
+Load benchmark for the authentication flow.
+
+Drives login -> mfa/verify -> welcome -> notes_* -> token/refresh (and the
+mfa/setup -> mfa/confirm enrollment flow) at a configurable concurrency,
+either in-process through the Django test client or against a running
+server, and reports throughput, latency percentiles and DB query counts
+per endpoint.
+
+Examples:
+    python manage.py benchmark --concurrency 8 --iterations 20
+    python manage.py benchmark --url http://localhost:8000 --output bench.json
+    python manage.py benchmark --compare baseline.json
+    python manage.py benchmark --url http://localhost:8000 --slow-clients 50
+"""
+import json
+import platform
+import socket
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_otp.oath import totp
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from api import otp
+from api.models import Note
+from api.storage import get_note_storage
+
+
+USER_PREFIX = 'bench_user_'
+PASSWORD = 'bench-password-1234'
+FLOWS = ('login', 'setup', 'notes', 'refresh')
+
+
+class ClientTransport:
+    """
+    Sends requests in-process through the Django test client.
+    One instance per worker thread.
+    """
+    counts_queries = True
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None, params=None, token=None):
+        headers = {}
+        if token:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        if method == 'GET':
+            response = self.client.get(path, params or {}, **headers)
+        else:
+            response = getattr(self.client, method.lower())(
+                path,
+                json.dumps(data or {}),
+                content_type='application/json',
+                **headers
+            )
+        content = b''.join(response) if response.streaming else response.content
+        return response.status_code, content
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """
+    Sends requests to a running server over HTTP.
+    DB query counts are not available in this mode.
+    """
+    counts_queries = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, params=None, token=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(url, data=body, method=method)
+        req.add_header('Content-Type', 'application/json')
+        if token:
+            req.add_header('Authorization', f'Bearer {token}')
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def close(self):
+        # The seeding helpers still use the ORM from this thread
+        connections.close_all()
+
+
+class SlowClient(threading.Thread):
+    """
+    Keeps a connection busy by trickling a request body to the server a few
+    bytes at a time, like a client on a very slow network. Used to compare
+    how WSGI and ASGI deployments cope with slow clients. The body carries no
+    credentials, so the slow requests themselves never reach password hashing.
+    """
+
+    def __init__(self, base_url, delay, stop):
+        super().__init__(daemon=True)
+        parsed = urllib.parse.urlsplit(base_url)
+        self.address = (parsed.hostname, parsed.port or 80)
+        self.body = json.dumps({'padding': 'x' * 64}).encode()
+        self.delay = delay
+        self.stop = stop
+        self.completed = 0
+
+    def run(self):
+        head = (
+            f'POST /api/login/ HTTP/1.1\r\nHost: {self.address[0]}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(self.body)}\r\n'
+            'Connection: close\r\n\r\n'
+        ).encode()
+        while not self.stop.is_set():
+            try:
+                with socket.create_connection(self.address, timeout=60) as sock:
+                    sock.sendall(head)
+                    for i in range(0, len(self.body), 8):
+                        if self.stop.wait(self.delay):
+                            return
+                        sock.sendall(self.body[i:i + 8])
+                    while sock.recv(65536):
+                        pass
+                self.completed += 1
+            except OSError:
+                self.stop.wait(self.delay)
+
+
+class Recorder:
+    """
+    Thread-safe collector of per-endpoint samples.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, endpoint, elapsed, status_code, ok, query_count):
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            self.statuses[endpoint][status_code] += 1
+            if query_count is not None:
+                self.queries[endpoint].append(query_count)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class FlowRunner:
+    """
+    Runs the benchmark flows for one worker, timing every API call.
+    """
+
+    def __init__(self, transport, recorder, user):
+        self.transport = transport
+        self.recorder = recorder
+        self.user = user
+
+    def call(self, endpoint, method, path, expected, data=None, params=None, token=None):
+        if self.transport.counts_queries:
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                status_code, content = self.transport.request(method, path, data, params, token)
+                elapsed = time.perf_counter() - start
+            query_count = len(ctx.captured_queries)
+        else:
+            start = time.perf_counter()
+            status_code, content = self.transport.request(method, path, data, params, token)
+            elapsed = time.perf_counter() - start
+            query_count = None
+
+        ok = status_code == expected
+        self.recorder.add(endpoint, elapsed, status_code, ok, query_count)
+        if not ok:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content
+
+    def current_code(self, device):
+        # Clear replay protection outside the timed section so every
+        # iteration can verify a code, even within the same time step.
+        TOTPDevice.objects.filter(pk=device.pk).update(
+            last_t=-1, throttling_failure_count=0, throttling_failure_timestamp=None
+        )
+        otp.forget(device)
+        code = totp(device.bin_key, device.step, device.t0, device.digits, device.drift)
+        return f'{code:0{device.digits}d}'
+
+    def login(self):
+        return self.call('login', 'POST', '/api/login/', 200, data={
+            'username': self.user.username,
+            'password': PASSWORD,
+        })
+
+    def run_login(self):
+        """
+        login -> mfa/verify -> welcome. Returns JWT tokens or None.
+        """
+        device = ensure_confirmed_device(self.user)
+        challenge = self.login()
+        if not challenge or not challenge.get('requires_mfa'):
+            return None
+        tokens = self.call('verify_mfa', 'POST', '/api/mfa/verify/', 200, data={
+            'token': self.current_code(device),
+            'temp_token': challenge['temp_token'],
+            'user_id': challenge['user_id'],
+            'timestamp': challenge['timestamp'],
+        })
+        if not tokens:
+            return None
+        self.call('welcome', 'GET', '/api/welcome/', 200, token=tokens['access'])
+        return tokens
+
+    def run_setup(self):
+        """
+        login -> mfa/setup -> mfa/confirm for a user without MFA.
+        """
+        TOTPDevice.objects.filter(user=self.user).delete()
+        challenge = self.login()
+        if not challenge or not challenge.get('requires_mfa_setup'):
+            return None
+        params = {
+            'temp_token': challenge['temp_token'],
+            'user_id': challenge['user_id'],
+            'timestamp': challenge['timestamp'],
+        }
+        setup = self.call('mfa_setup', 'GET', '/api/mfa/setup/', 200, params=params)
+        if not setup:
+            return None
+        device = TOTPDevice.objects.get(user=self.user, confirmed=False)
+        return self.call('mfa_confirm', 'POST', '/api/mfa/confirm/', 200, data={
+            'token': self.current_code(device),
+            **params,
+        })
+
+    def run_notes(self, tokens):
+        access = tokens['access']
+        created = self.call('notes_create', 'POST', '/api/notes/create/', 201, token=access, data={
+            'title': 'Benchmark note',
+            'content': 'Lorem ipsum dolor sit amet. ' * 20,
+        })
+        self.call('notes_list', 'GET', '/api/notes/', 200, token=access)
+        if created:
+            note_id = created['id']
+            self.call('notes_download', 'GET', f'/api/notes/{note_id}/download/', 200, token=access)
+            self.call('notes_delete', 'DELETE', f'/api/notes/{note_id}/delete/', 200, token=access)
+
+    def run_refresh(self, tokens):
+        return self.call('token_refresh', 'POST', '/api/token/refresh/', 200, data={
+            'refresh': tokens['refresh'],
+        })
+
+    def run(self, flows, iterations):
+        for _ in range(iterations):
+            if 'setup' in flows:
+                self.run_setup()
+            tokens = None
+            if flows & {'login', 'notes', 'refresh'}:
+                tokens = self.run_login()
+            if tokens and 'notes' in flows:
+                self.run_notes(tokens)
+            if tokens and 'refresh' in flows:
+                self.run_refresh(tokens)
+
+
+def ensure_confirmed_device(user):
+    device = TOTPDevice.objects.filter(user=user, confirmed=True).first()
+    if device is None:
+        TOTPDevice.objects.filter(user=user).delete()
+        device = TOTPDevice.objects.create(user=user, name=f'bench-{user.username}', confirmed=True)
+    return device
+
+
+def seed_users(count):
+    """
+    Create (or reuse) benchmark users. The password is hashed once and
+    shared, so seeding thousands of users does not take minutes.
+    """
+    usernames = [f'{USER_PREFIX}{i}' for i in range(count)]
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    missing = [name for name in usernames if name not in existing]
+    if missing:
+        encoded = make_password(PASSWORD)
+        User.objects.bulk_create([User(username=name, password=encoded) for name in missing])
+    return list(User.objects.filter(username__in=usernames).order_by('id'))
+
+
+def cleanup_users():
+    users = User.objects.filter(username__startswith=USER_PREFIX)
+    file_paths = list(Note.objects.filter(author__in=users).values_list('file_path', flat=True))
+    users.delete()
+    storage = get_note_storage()
+    for file_path in file_paths:
+        storage.delete(file_path)
+
+
+def summarize(recorder, wall_time):
+    endpoints = {}
+    total = 0
+    total_errors = 0
+    for endpoint, samples in sorted(recorder.latencies.items()):
+        ordered = sorted(samples)
+        queries = recorder.queries.get(endpoint)
+        endpoints[endpoint] = {
+            'requests': len(ordered),
+            'errors': recorder.errors.get(endpoint, 0),
+            'statuses': {str(k): v for k, v in recorder.statuses[endpoint].items()},
+            'throughput_rps': round(len(ordered) / wall_time, 2),
+            'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+            'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+            'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+            'max_ms': round(ordered[-1] * 1000, 3),
+            'queries_mean': round(statistics.fmean(queries), 2) if queries else None,
+            'queries_max': max(queries) if queries else None,
+        }
+        total += len(ordered)
+        total_errors += endpoints[endpoint]['errors']
+    return {
+        'wall_time_s': round(wall_time, 3),
+        'requests': total,
+        'errors': total_errors,
+        'throughput_rps': round(total / wall_time, 2) if wall_time else None,
+        'endpoints': endpoints,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the login/MFA/notes API flow and report per-endpoint latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Base URL of a running server. Defaults to the in-process test client.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent workers.')
+        parser.add_argument('--iterations', type=int, default=10, help='Flow iterations per worker.')
+        parser.add_argument('--users', type=int, default=0, help='Benchmark users to seed (default: one per worker).')
+        parser.add_argument(
+            '--flows', default=','.join(FLOWS),
+            help=f'Comma-separated flows to run: {", ".join(FLOWS)}.'
+        )
+        parser.add_argument(
+            '--slow-clients', type=int, default=0,
+            help='Background clients that trickle requests slowly (requires --url).'
+        )
+        parser.add_argument('--slow-delay', type=float, default=0.5, help='Seconds between slow client writes.')
+        parser.add_argument('--warmup', type=int, default=1, help='Untimed iterations per worker before measuring.')
+        parser.add_argument('--output', help='Write results as JSON to this path.')
+        parser.add_argument('--compare', help='Previous results JSON to compare p95 latency against.')
+        parser.add_argument('--label', default='', help='Free-form label stored in the results.')
+        parser.add_argument('--keep-users', action='store_true', help='Do not delete benchmark users afterwards.')
+        parser.add_argument(
+            '--rate-limit', action='store_true',
+            help='Keep the login/MFA rate limiter enabled for in-process runs. For --url runs, '
+                 'start the server with AUTH_RATE_LIMIT_ENABLED=0 to benchmark without it.'
+        )
+
+    def handle(self, *args, **options):
+        if options['url'] or options['rate_limit']:
+            return self.run_benchmark(options)
+        # Every worker logs in from the same address far more often than
+        # the brute-force limiter allows.
+        with override_settings(AUTH_RATE_LIMIT_ENABLED=False):
+            return self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        flows = {flow.strip() for flow in options['flows'].split(',') if flow.strip()}
+        unknown = flows - set(FLOWS)
+        if unknown:
+            raise CommandError(f'Unknown flows: {", ".join(sorted(unknown))}')
+
+        concurrency = max(1, options['concurrency'])
+        users = seed_users(max(options['users'], concurrency))
+        base_url = options['url']
+        if options['slow_clients'] and not base_url:
+            raise CommandError('--slow-clients requires --url')
+
+        def make_transport():
+            return HTTPTransport(base_url) if base_url else ClientTransport()
+
+        def worker(index, iterations, recorder):
+            transport = make_transport()
+            try:
+                # Each worker owns a disjoint slice of users so flows never
+                # race each other on the same TOTP device.
+                for user in users[index::concurrency]:
+                    FlowRunner(transport, recorder, user).run(flows, iterations)
+            finally:
+                transport.close()
+
+        def run_phase(iterations):
+            recorder = Recorder()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                futures = [pool.submit(worker, i, iterations, recorder) for i in range(concurrency)]
+                for future in futures:
+                    future.result()
+            return recorder, time.perf_counter() - start
+
+        stop = threading.Event()
+        slow_clients = [
+            SlowClient(base_url, options['slow_delay'], stop)
+            for _ in range(options['slow_clients'])
+        ]
+        try:
+            for client in slow_clients:
+                client.start()
+            if options['warmup']:
+                run_phase(options['warmup'])
+            recorder, wall_time = run_phase(options['iterations'])
+        finally:
+            stop.set()
+            if not options['keep_users']:
+                cleanup_users()
+
+        results = {
+            'meta': {
+                'label': options['label'],
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'target': base_url or 'django-test-client',
+                'concurrency': concurrency,
+                'iterations': options['iterations'],
+                'users': len(users),
+                'flows': sorted(flows),
+                'slow_clients': options['slow_clients'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': settings.DATABASES['default']['ENGINE'],
+                'debug': settings.DEBUG,
+            },
+            **summarize(recorder, wall_time),
+        }
+
+        self.print_report(results)
+        if options['compare']:
+            self.print_comparison(results, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def print_report(self, results):
+        header = f'{"endpoint":<16}{"reqs":>7}{"err":>6}{"rps":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, stats in results['endpoints'].items():
+            queries = '-' if stats['queries_mean'] is None else f'{stats["queries_mean"]:.1f}'
+            self.stdout.write(
+                f'{name:<16}{stats["requests"]:>7}{stats["errors"]:>6}{stats["throughput_rps"]:>9.1f}'
+                f'{stats["p50_ms"]:>10.2f}{stats["p95_ms"]:>10.2f}{stats["p99_ms"]:>10.2f}{queries:>9}'
+            )
+        self.stdout.write(
+            f'\n{results["requests"]} requests, {results["errors"]} errors in {results["wall_time_s"]}s '
+            f'({results["throughput_rps"]} req/s)'
+        )
+
+    def print_comparison(self, results, path):
+        with open(path) as f:
+            baseline = json.load(f)
+        self.stdout.write(f'\np95 latency vs {path}:')
+        for name, stats in results['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if not before:
+                continue
+            change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            line = f'  {name:<16}{before["p95_ms"]:>10.2f} -> {stats["p95_ms"]:>10.2f} ms ({change:+.1f}%)'
+            self.stdout.write(self.style.WARNING(line) if change > 10 else line)
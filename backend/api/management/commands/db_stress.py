@@ -0,0 +1,178 @@
+"""
+Concurrent database write stress test.
+
+Runs, for a fixed duration and against the configured database (see
+DB_PROFILE in settings), threads doing the writes of the API that contend
+with each other:
+
+* note writers: notes.create_note (note row + search index entry) and
+  notes.delete_note, as notes/create and notes/delete do;
+* MFA writers: TOTPDevice.verify_token() with a wrong code, which saves
+  the device's throttling state on every attempt;
+* readers: a notes list page, as GET /api/notes/ does.
+
+Each thread has its own connection. It reports throughput, latency
+percentiles and the number of "database is locked" errors per operation.
+
+Examples:
+    python manage.py db_stress
+    DB_PROFILE=sqlite-wal python manage.py db_stress --writers 8 --duration 20
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from api.models import Note
+from api.notes import create_note, delete_note, notes_page_queryset
+from api.storage import get_note_storage
+
+
+USER_PREFIX = 'stress_user_'
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.locked = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def run(self, operation, func):
+        started = time.perf_counter()
+        try:
+            func()
+        except OperationalError as e:
+            with self.lock:
+                if 'locked' in str(e) or 'busy' in str(e):
+                    self.locked[operation] += 1
+                else:
+                    self.errors[operation] += 1
+            return
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[operation].append(elapsed)
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Stress concurrent note and MFA writes and report lock errors and throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Threads creating and deleting notes.')
+        parser.add_argument('--mfa-writers', type=int, default=4, help='Threads saving TOTP device state.')
+        parser.add_argument('--readers', type=int, default=4, help='Threads listing notes.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run.')
+        parser.add_argument('--content-size', type=int, default=2000, help='Bytes of content per note.')
+
+    def handle(self, *args, **options):
+        workers = options['writers'] + options['mfa_writers'] + options['readers']
+        users = self.seed_users(max(1, workers))
+        devices = {device.user_id: device for device in TOTPDevice.objects.filter(user__in=users)}
+        content = ('lorem ipsum dolor sit amet ' * (options['content_size'] // 27 + 1))[:options['content_size']]
+        storage = get_note_storage()
+        recorder = Recorder()
+        deadline = time.monotonic() + options['duration']
+
+        def note_writer(user):
+            while time.monotonic() < deadline:
+                def write():
+                    file_path = storage.save(content)
+                    note = create_note(user.id, 'Stress note', file_path, content)
+                    delete_note(note)
+                    storage.delete(file_path)
+                recorder.run('note_create_delete', write)
+
+        def mfa_writer(user):
+            device = TOTPDevice.objects.get(pk=devices[user.id].pk)
+            while time.monotonic() < deadline:
+                recorder.run('mfa_verify', lambda: device.verify_token('000000'))
+
+        def reader(user):
+            notes = Note.objects.filter(author_id=user.id)
+            while time.monotonic() < deadline:
+                recorder.run('notes_list', lambda: list(notes_page_queryset(notes, None, 50)))
+
+        def run(target, user):
+            try:
+                target(user)
+            finally:
+                connections.close_all()
+
+        roles = (
+            [note_writer] * options['writers']
+            + [mfa_writer] * options['mfa_writers']
+            + [reader] * options['readers']
+        )
+        threads = [threading.Thread(target=run, args=(role, user)) for role, user in zip(roles, users)]
+        started = time.perf_counter()
+        # Failed codes must keep writing, not get throttled
+        with override_settings(OTP_TOTP_THROTTLE_FACTOR=0):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        wall_time = time.perf_counter() - started
+
+        try:
+            self.report(recorder, wall_time)
+        finally:
+            self.cleanup_users()
+
+    def seed_users(self, count):
+        usernames = [f'{USER_PREFIX}{i}' for i in range(count)]
+        User.objects.filter(username__in=usernames).delete()
+        User.objects.bulk_create([User(username=name) for name in usernames])
+        users = list(User.objects.filter(username__in=usernames).order_by('id'))
+        TOTPDevice.objects.bulk_create([
+            TOTPDevice(user=user, name=f'stress-{user.username}', confirmed=True) for user in users
+        ])
+        for user in users:
+            Note.objects.bulk_create([
+                Note(author=user, title=f'Seed {i}', file_path='/media/notes/missing.txt') for i in range(50)
+            ])
+        return users
+
+    def cleanup_users(self):
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def report(self, recorder, wall_time):
+        settings_dict = connection.settings_dict
+        profile = connection.vendor
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+                cursor.execute('PRAGMA synchronous')
+                synchronous = cursor.fetchone()[0]
+            profile += f' (journal_mode={journal_mode}, synchronous={synchronous})'
+        self.stdout.write(f'Database: {profile}, CONN_MAX_AGE={settings_dict["CONN_MAX_AGE"]}')
+
+        header = f'{"operation":<20} {"ops":>7} {"ops/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"locked":>7} {"errors":>7}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        total_ops = total_locked = 0
+        for operation in sorted(set(recorder.latencies) | set(recorder.locked) | set(recorder.errors)):
+            ordered = sorted(recorder.latencies[operation])
+            locked = recorder.locked[operation]
+            total_ops += len(ordered)
+            total_locked += locked
+            self.stdout.write(
+                f'{operation:<20} {len(ordered):>7} {len(ordered) / wall_time:>8.1f} '
+                f'{percentile(ordered, 50) * 1000:>9.2f} {percentile(ordered, 95) * 1000:>9.2f} '
+                f'{locked:>7} {recorder.errors[operation]:>7}'
+            )
+        self.stdout.write(
+            f'\n{total_ops} operations, {total_locked} "database is locked" errors in {wall_time:.1f}s '
+            f'({total_ops / wall_time:.1f} ops/s)'
+        )
@@ -0,0 +1,153 @@
+"""
+Move existing notes between the inline and file tiers (see storage.py).
+
+New notes are stored in the tier NOTES_INLINE_MAX_SIZE calls for; this
+command applies a (changed) threshold to the notes created before. Notes
+are walked by id in batches of --batch-size in two passes:
+
+* file notes whose content is at most --max-size bytes are read in
+  parallel on the storage thread pool, copied into their row and their
+  files deleted once the batch is committed;
+* inline notes larger than --max-size are written to files in parallel
+  and their rows updated to point to them.
+
+Each row is only updated if it is still in the tier it was read from, so
+notes edited or deleted during the run are left alone (and a file written
+for a deleted note is removed again). The content does not change, so
+neither does the search index; updated_at is bumped, since file_path (and
+the ?preview= of the notes list) does. Missing files are reported and
+their notes left as they are.
+
+Examples:
+    python manage.py migrate_note_tiers
+    python manage.py migrate_note_tiers --max-size 4096 --dry-run
+    python manage.py migrate_note_tiers --max-size 0
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from api.models import Note
+from api.storage import get_batch_executor, get_note_storage
+
+
+MISSING = object()
+
+
+def keyset_batches(queryset, fields, batch_size):
+    """
+    Yield lists of values_list() rows of queryset, walking it by id.
+    fields must start with 'id'.
+    """
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id').values_list(*fields)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+class Command(BaseCommand):
+    help = 'Move existing notes between inline storage in the database and note files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-size', type=int, default=None,
+            help='Store notes of at most this many bytes inline (default: NOTES_INLINE_MAX_SIZE; 0 moves all to files).',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Notes moved per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be moved without moving anything.')
+
+    def handle(self, *args, **options):
+        max_size = options['max_size']
+        if max_size is None:
+            max_size = getattr(settings, 'NOTES_INLINE_MAX_SIZE', 0)
+        if max_size < 0:
+            raise CommandError('--max-size must not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        self.max_size = max_size
+        self.dry_run = options['dry_run']
+        self.storage = get_note_storage()
+        self.stats = dict.fromkeys(('inlined', 'to_files', 'missing', 'skipped'), 0)
+
+        started = time.perf_counter()
+        if max_size:
+            files = Note.objects.exclude(file_path='')
+            for batch in keyset_batches(files, ('id', 'file_path'), options['batch_size']):
+                self.inline_batch(batch)
+                self.stderr.write(f'[files -> inline] {self.stats["inlined"]} moved, up to note {batch[-1][0]}')
+        # A character is at most 4 bytes in UTF-8: shorter contents fit
+        inline = Note.objects.filter(file_path='', content__isnull=False).alias(
+            length=Length('content')).filter(length__gt=max_size // 4)
+        for batch in keyset_batches(inline, ('id', 'content'), options['batch_size']):
+            self.file_batch([(note_id, content) for note_id, content in batch
+                             if len(content.encode('utf-8')) > max_size])
+            self.stderr.write(f'[inline -> files] {self.stats["to_files"]} moved, up to note {batch[-1][0]}')
+
+        stats = self.stats
+        summary = (
+            f'{"Would move" if self.dry_run else "Moved"} {stats["inlined"]} notes inline and '
+            f'{stats["to_files"]} to files (threshold {max_size} bytes) in {time.perf_counter() - started:.1f}s'
+            + (f'; {stats["missing"]} notes have a missing file' if stats['missing'] else '')
+            + (f'; {stats["skipped"]} changed during the run and were left alone' if stats['skipped'] else '')
+        )
+        self.stdout.write(summary if self.dry_run else self.style.SUCCESS(summary))
+
+    def inline_batch(self, batch):
+        contents = list(get_batch_executor().map(self.read_small, [file_path for _, file_path in batch]))
+        self.stats['missing'] += sum(content is MISSING for content in contents)
+        moved = [
+            (note_id, file_path, content) for (note_id, file_path), content in zip(batch, contents)
+            if isinstance(content, str)
+        ]
+        if self.dry_run:
+            self.stats['inlined'] += len(moved)
+            return
+        updated, now = [], timezone.now()
+        with transaction.atomic():
+            for note_id, file_path, content in moved:
+                if Note.objects.filter(id=note_id, file_path=file_path).update(
+                        file_path='', content=content, updated_at=now):
+                    updated.append(file_path)
+        self.stats['inlined'] += len(updated)
+        self.stats['skipped'] += len(moved) - len(updated)
+        self.storage.delete_many(updated)
+
+    def read_small(self, file_path):
+        """
+        The content of a note file if it fits inline ('' in a dry run), None
+        if it does not, or MISSING.
+        """
+        try:
+            if self.storage.size(file_path) > self.max_size:
+                return None
+            return '' if self.dry_run else self.storage.read(file_path)
+        except FileNotFoundError:
+            return MISSING
+        except Exception as e:
+            self.stderr.write(f'Warning: Failed to read {file_path}: {e}')
+            return None
+
+    def file_batch(self, batch):
+        if self.dry_run:
+            self.stats['to_files'] += len(batch)
+            return
+        paths = list(get_batch_executor().map(self.storage.save, [content for _, content in batch]))
+        written, orphans, now = [], [], timezone.now()
+        with transaction.atomic():
+            for (note_id, content), path in zip(batch, paths):
+                if Note.objects.filter(id=note_id, file_path='').update(
+                        file_path=path, content=None, updated_at=now):
+                    written.append((path, content))
+                else:
+                    orphans.append(path)
+        self.stats['to_files'] += len(written)
+        self.stats['skipped'] += len(orphans)
+        self.storage.delete_many(orphans)
+        self.storage.ensure_many([path for path, _ in written], [content for _, content in written])
@@ -0,0 +1,177 @@
+"""
+Import-time breakdown and time to first request of a fresh process.
+
+Starts new Python processes with the current settings and times how long
+a worker takes to serve: django.setup() (what every management command
+and script such as reset_mfa.py pays), loading WSGI_APPLICATION (which
+runs the APP_PRELOAD hook, see api/startup.py), and the first and second
+GET of --path through the WSGI handler. Phase timings are the best of
+--runs processes; the import breakdown comes from one more process run
+with `python -X importtime`, grouped by top-level package and phase.
+
+Examples:
+    python manage.py profile_startup
+    python manage.py profile_startup --no-preload --path /api/quote-of-the-day/
+    python manage.py profile_startup --runs 5 --top 30
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+PHASES = ('setup', 'application', 'first_request')
+
+PHASE_LABELS = {
+    'interpreter': 'interpreter start',
+    'setup': 'django.setup()',
+    'application': 'load WSGI application',
+    'first_request': 'first request',
+    'second_request': 'second request',
+}
+
+COLUMN_LABELS = {'interpreter': 'interpreter', 'setup': 'setup', 'application': 'application', 'first_request': 'request'}
+
+# Runs in the profiled process. Phase markers go to stderr, in line with
+# the -X importtime output, so imports can be attributed to a phase.
+CHILD = r'''
+import json, sys, time
+spawned = time.time()
+started = time.perf_counter()
+
+def phase(name):
+    sys.stderr.write(f'PHASE {name}\n')
+    sys.stderr.flush()
+
+phase('setup')
+import django
+django.setup()
+setup_done = time.perf_counter()
+
+phase('application')
+from django.conf import settings
+from django.utils.module_loading import import_string
+application = import_string(settings.WSGI_APPLICATION)
+application_done = time.perf_counter()
+
+from wsgiref.util import setup_testing_defaults
+
+def request(path):
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+    setup_testing_defaults(environ)
+    statuses = []
+    t = time.perf_counter()
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        getattr(response, 'close', lambda: None)()
+    return time.perf_counter() - t, statuses[0]
+
+phase('first_request')
+first, status = request(sys.argv[1])
+phase('done')
+second, _ = request(sys.argv[1])
+print(json.dumps({
+    'spawned': spawned,
+    'setup': setup_done - started,
+    'application': application_done - setup_done,
+    'first_request': first,
+    'second_request': second,
+    'status': status,
+    'modules': len(sys.modules),
+    'preload': getattr(settings, 'APP_PRELOAD', False),
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """
+    Yield (phase, depth, module, self_us, cumulative_us) for each line of
+    -X importtime output, tagged with the phase it was imported in.
+    """
+    phase = 'interpreter'
+    for line in stderr.splitlines():
+        if line.startswith('PHASE '):
+            phase = line[6:].strip()
+            continue
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        yield phase, depth, name.strip(), int(self_us), int(cumulative_us)
+
+
+class Command(BaseCommand):
+    help = 'Report the import-time breakdown and time to first request of a new worker process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/login/', help='Path of the first request (GET).')
+        parser.add_argument('--runs', type=int, default=3, help='Processes timed; the best time of each phase is shown.')
+        parser.add_argument('--top', type=int, default=15, help='Packages and modules listed in the breakdown.')
+        parser.add_argument('--no-preload', action='store_true', help='Run with APP_PRELOAD=0.')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be positive')
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+        if options['no_preload']:
+            env['APP_PRELOAD'] = '0'
+
+        timings = [self.run_child(env, options['path']) for _ in range(options['runs'])]
+        imports = list(parse_importtime(self.run_child(env, options['path'], importtime=True)['stderr']))
+
+        best = {name: min(t[name] for t in timings) for name in ('interpreter', *PHASES, 'second_request')}
+        self.stdout.write(
+            f'Startup of a worker process (best of {len(timings)}, GET {options["path"]} -> '
+            f'{timings[0]["status"]}, {timings[0]["modules"]} modules loaded, '
+            f'APP_PRELOAD={"on" if timings[0]["preload"] else "off"})'
+        )
+        for name in ('interpreter', *PHASES, 'second_request'):
+            self.stdout.write(f'  {PHASE_LABELS[name]:<24} {best[name] * 1000:>8.1f} ms')
+        total = sum(best[name] for name in ('interpreter', *PHASES))
+        self.stdout.write(f'  {"time to first response":<24} {total * 1000:>8.1f} ms')
+
+        self.report_packages(imports, options['top'])
+        self.report_modules(imports, options['top'])
+
+    def run_child(self, env, path, importtime=False):
+        command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', CHILD, path]
+        spawned = time.time()
+        result = subprocess.run(command, env=env, capture_output=True, text=True, cwd=os.getcwd())
+        if result.returncode != 0:
+            raise CommandError(f'Profiled process failed:\n{result.stderr[-2000:]}')
+        timing = json.loads(result.stdout.strip().splitlines()[-1])
+        timing['interpreter'] = max(0.0, timing['spawned'] - spawned)
+        timing['stderr'] = result.stderr
+        return timing
+
+    def report_packages(self, imports, top):
+        totals = defaultdict(lambda: defaultdict(int))
+        for phase, _, module, self_us, _ in imports:
+            totals[module.split('.')[0]][phase] += self_us
+        columns = ('interpreter', *PHASES)
+        self.stdout.write('\nImport time by package (self time, ms; -X importtime adds overhead)')
+        self.stdout.write(f'  {"package":<28}' + ''.join(f'{COLUMN_LABELS[c]:>14}' for c in columns) + f'{"total":>9}')
+        ranked = sorted(totals.items(), key=lambda item: -sum(item[1].values()))
+        for package, phases in ranked[:top]:
+            cells = ''.join(f'{phases[c] / 1000:>14.1f}' for c in columns)
+            self.stdout.write(f'  {package:<28}{cells}{sum(phases.values()) / 1000:>9.1f}')
+        total_cells = ''.join(
+            f'{sum(phases[c] for phases in totals.values()) / 1000:>14.1f}' for c in columns
+        )
+        grand_total = sum(sum(phases.values()) for phases in totals.values())
+        self.stdout.write(f'  {"all":<28}{total_cells}{grand_total / 1000:>9.1f}')
+
+    def report_modules(self, imports, top):
+        # Imports made directly by the phase code or by a function call, not
+        # by another module: these are what lazy loading can move or remove
+        roots = [entry for entry in imports if entry[1] == 0 and entry[0] in PHASES]
+        self.stdout.write('\nSlowest top-level imports (cumulative ms)')
+        for phase, _, module, _, cumulative_us in sorted(roots, key=lambda entry: -entry[4])[:top]:
+            self.stdout.write(f'  {module:<52} {PHASE_LABELS[phase]:<24} {cumulative_us / 1000:>8.1f}')
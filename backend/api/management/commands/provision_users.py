@@ -0,0 +1,278 @@
+"""
+Create users in bulk from a CSV or JSON Lines file.
+
+Each row is an object with a username and optionally password, email,
+first_name, last_name, is_staff and is_active (CSV: a header row naming
+the columns). A row without a password gets an unusable one. The file is
+read as a stream in batches of --batch-size rows; passwords are hashed in
+--workers spawned processes (see hashing.create_executor) while earlier
+batches are inserted, each batch with a few bulk INSERTs in one
+transaction. Users that already exist, repeated usernames and invalid
+rows are skipped and reported, so re-running an interrupted import
+creates only the users that are still missing.
+
+With --mfa every new user gets an unconfirmed TOTP device, named as
+mfa_setup names it, which mfa_setup then serves instead of creating one.
+--qr-output writes one JSON line per device with its otpauth:// URL and,
+with --qr-format png or svg, the rendered QR code as a data URI. These
+contain the TOTP secrets: deliver them to the users and delete the file.
+
+Examples:
+    python manage.py provision_users users.csv
+    python manage.py provision_users users.jsonl --group acme --mfa --qr-output acme-qr.jsonl
+    cat users.jsonl | python manage.py provision_users - --format jsonl --workers 8
+    python manage.py provision_users users.csv --dry-run
+"""
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from api import hashing, qr
+
+
+FIELDS = ('username', 'password', 'email', 'first_name', 'last_name', 'is_staff', 'is_active')
+
+BOOLEANS = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False, '': None}
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line number, row dict) for each row of a CSV or JSON Lines
+    stream. A JSON line that cannot be parsed is yielded as its error
+    message instead of a dict.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f'invalid JSON: {e}'
+            continue
+        yield number, row if isinstance(row, dict) else 'expected a JSON object'
+
+
+def clean_row(row):
+    """
+    Validate a row and return the User field values (plus 'password', raw
+    or None). Raises ValueError with the reason for an invalid row.
+    """
+    if not isinstance(row, dict):
+        raise ValueError(row)
+    unknown = sorted(set(row) - set(FIELDS) - {None})
+    if unknown:
+        raise ValueError(f'unknown field(s): {", ".join(unknown)}')
+    values = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if field in ('is_staff', 'is_active'):
+            if isinstance(value, str):
+                if value.strip().lower() not in BOOLEANS:
+                    raise ValueError(f'{field} must be true or false')
+                value = BOOLEANS[value.strip().lower()]
+            if value is not None:
+                values[field] = bool(value)
+            continue
+        value = '' if value is None else str(value)
+        if field != 'password':
+            value = value.strip()
+        values[field] = value
+
+    values['username'] = User.normalize_username(values['username'])
+    values['email'] = User.objects.normalize_email(values['email'])
+    values['password'] = values['password'] or None
+    try:
+        if not values['username']:
+            raise ValidationError('username is required')
+        User._meta.get_field('username').run_validators(values['username'])
+        if values['email']:
+            validate_email(values['email'])
+    except ValidationError as e:
+        raise ValueError(' '.join(e.messages))
+    for field in ('username', 'email', 'first_name', 'last_name'):
+        max_length = User._meta.get_field(field).max_length
+        if len(values[field]) > max_length:
+            raise ValueError(f'{field} is longer than {max_length} characters')
+    return values
+
+
+def prepare_batch(passwords, config_urls, qr_format):
+    """
+    Runs in a pool process (or inline with --workers 0). Returns the
+    password hashes and, for png or svg, the rendered QR codes.
+    """
+    hashes = hashing._make_passwords(passwords)
+    if qr_format == 'uri':
+        return hashes, [None] * len(config_urls)
+    return hashes, [qr.render_qr_code(url, qr_format) for url in config_urls]
+
+
+class Command(BaseCommand):
+    help = 'Create users in bulk from a CSV or JSON Lines file, hashing passwords in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON Lines file ('-' for stdin).")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows hashed and inserted together.')
+        parser.add_argument(
+            '--workers', type=int, default=available_cpus(),
+            help='Password hashing processes (default: one per CPU; 0 hashes in this process).',
+        )
+        parser.add_argument('--group', action='append', default=[], help='Add the new users to this group (repeatable).')
+        parser.add_argument('--mfa', action='store_true', help='Create an unconfirmed TOTP device for each new user.')
+        parser.add_argument('--qr-output', help='With --mfa: write the otpauth:// URL of each device to this JSON Lines file.')
+        parser.add_argument('--qr-format', choices=qr.FORMATS, default='uri',
+                            help='With --qr-output: also render the QR code as png or svg.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the input without creating anything.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['workers'] < 0:
+            raise CommandError('--workers must not be negative')
+        if options['qr_output'] and not options['mfa']:
+            raise CommandError('--qr-output requires --mfa')
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.ndjson', '.json')) else 'csv')
+        self.options = options
+        self.stats = dict.fromkeys(('rows', 'created', 'existing', 'duplicates', 'invalid', 'devices'), 0)
+        self.groups = [] if options['dry_run'] else [Group.objects.get_or_create(name=name)[0] for name in options['group']]
+
+        try:
+            stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["path"]}: {e}')
+        qr_output = None
+        executor = None
+        self.started = time.perf_counter()
+        try:
+            if options['qr_output']:
+                qr_output = open(options['qr_output'], 'w', encoding='utf-8')
+            if options['workers'] and not options['dry_run']:
+                executor = hashing.create_executor(options['workers'])
+            # Up to one batch per process is hashed while the oldest is inserted
+            pending = deque()
+            for batch in self.batches(read_rows(stream, fmt)):
+                if options['dry_run'] or not batch:
+                    self.stats['created'] += len(batch)
+                    continue
+                passwords = [values.pop('password') for values in batch]
+                users = [User(**values) for values in batch]
+                devices = [
+                    TOTPDevice(name=f'my-mfa-app-{user.username}', confirmed=False) for user in users
+                ] if options['mfa'] else []
+                config_urls = [qr.build_config_url(device, user.username) for device, user in zip(devices, users)]
+                job = (passwords, config_urls if qr_output else [], options['qr_format'])
+                result = executor.submit(prepare_batch, *job) if executor else prepare_batch(*job)
+                pending.append((users, devices, config_urls, result))
+                while len(pending) > options['workers']:
+                    self.insert(*pending.popleft(), qr_output)
+            while pending:
+                self.insert(*pending.popleft(), qr_output)
+        except OSError as e:
+            raise CommandError(str(e))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if qr_output is not None:
+                qr_output.close()
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - self.started
+        stats = self.stats
+        summary = (
+            f'{"Would create" if options["dry_run"] else "Created"} {stats["created"]} users'
+            + (f' with {stats["devices"]} MFA devices' if options['mfa'] and not options['dry_run'] else '')
+            + f' from {stats["rows"]} rows in {elapsed:.2f}s ({stats["created"] / elapsed if elapsed else 0:,.1f} users/s); '
+            f'skipped {stats["existing"]} existing, {stats["duplicates"]} repeated, {stats["invalid"]} invalid.'
+        )
+        self.stdout.write(summary if options['dry_run'] else self.style.SUCCESS(summary))
+
+    def batches(self, rows):
+        """
+        Yield lists of cleaned rows for users that do not exist yet.
+        """
+        seen = set()
+        batch = []
+        for line, row in rows:
+            self.stats['rows'] += 1
+            try:
+                values = clean_row(row)
+            except ValueError as e:
+                self.stats['invalid'] += 1
+                self.stderr.write(self.style.WARNING(f'line {line}: {e}'))
+                continue
+            if values['username'] in seen:
+                self.stats['duplicates'] += 1
+                continue
+            seen.add(values['username'])
+            batch.append(values)
+            if len(batch) >= self.options['batch_size']:
+                yield self.new_users(batch)
+                batch = []
+        if batch:
+            yield self.new_users(batch)
+
+    def new_users(self, batch):
+        existing = set(
+            User.objects.filter(username__in=[values['username'] for values in batch]).values_list('username', flat=True)
+        )
+        self.stats['existing'] += len(existing)
+        return [values for values in batch if values['username'] not in existing]
+
+    def insert(self, users, devices, config_urls, result, qr_output):
+        hashes, qr_codes = result if isinstance(result, tuple) else result.result()
+        for user, encoded in zip(users, hashes):
+            user.password = encoded
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                if users and users[0].pk is None:
+                    # Backends that cannot return ids from a bulk INSERT
+                    ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+                    for user in users:
+                        user.pk = ids[user.username]
+                for device, user in zip(devices, users):
+                    device.user_id = user.pk
+                TOTPDevice.objects.bulk_create(devices)
+                User.groups.through.objects.bulk_create([
+                    User.groups.through(user_id=user.pk, group_id=group.pk) for group in self.groups for user in users
+                ])
+        except IntegrityError as e:
+            raise CommandError(f'{e}. Another process created some of these users; run the import again to skip them.')
+
+        if qr_output is not None:
+            for user, config_url, qr_code in zip(users, config_urls, qr_codes):
+                entry = {'username': user.username, 'otpauth_url': config_url}
+                if qr_code is not None:
+                    entry['qr_code'] = qr_code
+                qr_output.write(json.dumps(entry) + '\n')
+        self.stats['created'] += len(users)
+        self.stats['devices'] += len(devices)
+        elapsed = time.perf_counter() - self.started
+        self.stderr.write(
+            f'[{self.stats["created"]} created, {self.stats["rows"]} rows read] '
+            f'{self.stats["created"] / elapsed if elapsed else 0:,.1f} users/s'
+        )
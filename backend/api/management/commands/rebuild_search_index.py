@@ -0,0 +1,74 @@
+"""
+Rebuild the note search index from the note files and inline notes.
+
+Notes are streamed in id order in batches: each batch's files are read in
+parallel on the storage thread pool (inline notes come with their row)
+and indexed in one transaction, so
+memory stays flat and the site keeps serving (and indexing new notes)
+during the rebuild. Entries of notes deleted meanwhile never show up in
+results, which only include existing notes.
+
+Examples:
+    python manage.py rebuild_search_index
+    python manage.py rebuild_search_index --batch-size 2000
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import search
+from api.models import Note
+from api.storage import get_batch_executor, get_note_storage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of notes from NOTES_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Notes read and indexed per transaction.')
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Search needs SQLite with FTS5; the configured database does not support it.')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        started = time.perf_counter()
+        search.clear_index()
+        indexed = missing = 0
+        notes = Note.objects.order_by('id').values_list('id', 'author_id', 'title', 'file_path', 'content')
+        batch = []
+        for note in notes.iterator(chunk_size=batch_size):
+            batch.append(note)
+            if len(batch) == batch_size:
+                done, skipped = self.index_batch(batch)
+                indexed, missing, batch = indexed + done, missing + skipped, []
+                self.stdout.write(f'Indexed {indexed} notes...')
+        if batch:
+            done, skipped = self.index_batch(batch)
+            indexed, missing = indexed + done, missing + skipped
+        search.optimize_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} notes in {time.perf_counter() - started:.1f}s'
+            + (f' ({missing} without a readable file, indexed by title only)' if missing else '')
+        ))
+
+    def index_batch(self, batch):
+        contents = list(get_batch_executor().map(self.read_content, [note[3:] for note in batch]))
+        with transaction.atomic():
+            search.index_notes(
+                (note_id, author_id, title, content or '')
+                for (note_id, author_id, title, *_), content in zip(batch, contents)
+            )
+        return len(batch), sum(content is None for content in contents)
+
+    def read_content(self, note):
+        file_path, content = note
+        try:
+            return get_note_storage().read(file_path, content)
+        except Exception as e:
+            self.stderr.write(f'Warning: Failed to read {file_path}: {e}')
+            return None
@@ -0,0 +1,67 @@
+"""
+Serve the application with gunicorn, a pre-forking multi-process server,
+configured by gunicorn.conf.py and the SERVE_* settings. Unlike runserver
+it runs a worker pool sized to the CPUs, loads the application once before
+forking, recycles workers and reloads them gracefully on SIGHUP.
+
+Examples:
+    python manage.py serve
+    python manage.py serve --bind 127.0.0.1:8000 --workers 4
+    python manage.py serve --asgi
+    python manage.py serve --reload   # development: restart workers on code changes
+"""
+import importlib.util
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+CONFIG_FILE = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+
+
+class Command(BaseCommand):
+    help = 'Serve the application with a pre-forked gunicorn worker pool (see gunicorn.conf.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', help='Address to listen on (default: SERVE_BIND).')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: SERVE_WORKERS, or 2 per CPU + 1).')
+        parser.add_argument('--threads', type=int, help='Request threads per worker (default: SERVE_THREADS).')
+        parser.add_argument('--max-requests', type=int, help='Requests before a worker is recycled (default: SERVE_MAX_REQUESTS).')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Serve config.asgi with uvicorn workers and the async views (API_ASYNC_VIEWS=1).')
+        parser.add_argument('--reload', action='store_true', help='Restart workers when code changes (disables preloading).')
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('gunicorn') is None:
+            raise CommandError('serve needs gunicorn: pip install -r requirements.txt')
+
+        argv = [sys.executable, '-m', 'gunicorn', '--config', CONFIG_FILE]
+        if options['bind']:
+            argv += ['--bind', options['bind']]
+        if options['workers']:
+            argv += ['--workers', str(options['workers'])]
+        if options['threads']:
+            argv += ['--threads', str(options['threads'])]
+        if options['max_requests'] is not None:
+            argv += [
+                '--max-requests', str(options['max_requests']),
+                '--max-requests-jitter', str(options['max_requests'] // 10),
+            ]
+        if options['reload']:
+            # Workers must import the code themselves to pick up changes
+            os.environ['SERVE_PRELOAD'] = '0'
+            argv += ['--reload']
+        if options['asgi']:
+            # Inherited by gunicorn, whose config loads the settings before
+            # config.asgi is imported
+            os.environ.setdefault('API_ASYNC_VIEWS', '1')
+            argv += ['--worker-class', 'uvicorn.workers.UvicornWorker', 'config.asgi:application']
+        else:
+            argv += ['config.wsgi:application']
+
+        self.stdout.write(f'Starting gunicorn: {" ".join(argv[1:])}')
+        self.stdout.flush()
+        os.chdir(settings.BASE_DIR)
+        os.execv(sys.executable, argv)
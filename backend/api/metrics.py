@@ -0,0 +1,438 @@
+"""
+Prometheus metrics, aggregated across worker processes.
+
+Every process records its metrics in memory: a counter increment or a
+histogram observation is a dictionary update under a lock, a few
+microseconds. MetricsMiddleware records request counts and latencies per
+route (the URL name, so the number of series stays bounded), and the
+database queries each request runs, counted by an execute wrapper that
+signals.py installs on every connection. hashing, otp and qr record
+password hash time, TOTP verification results and QR render time.
+
+To aggregate the metrics of several worker processes, each process writes
+a snapshot of its cumulative values to METRICS_DIR/<pid>-<id>.json, at
+most every METRICS_FLUSH_INTERVAL seconds (from the request that records
+after the interval) and at exit. The metrics endpoint writes the snapshot
+of its own process and sums all the snapshots. Snapshots of processes that
+exited are kept, so totals never go down while the deployment runs; clear
+METRICS_DIR when it is restarted. A forked child starts from empty values
+with its own snapshot file, so nothing is counted twice. Under `manage.py
+serve` the gunicorn master clears METRICS_DIR when it starts and folds
+the snapshots of exited workers into one file (see gunicorn.conf.py).
+"""
+import atexit
+import bisect
+import hmac
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .throttling import client_ip
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QR_RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    'api_requests_total': (
+        'counter', 'Requests served, by route, method and status.', ('route', 'method', 'status'), None,
+    ),
+    'api_request_duration_seconds': (
+        'histogram', 'Time until the response is returned, by route and method.', ('route', 'method'),
+        LATENCY_BUCKETS,
+    ),
+    'api_db_queries_total': (
+        'counter', 'Database queries run by requests, by route.', ('route',), None,
+    ),
+    'api_db_query_duration_seconds_total': (
+        'counter', 'Time spent in database queries by requests, by route.', ('route',), None,
+    ),
+    'api_password_hash_duration_seconds': (
+        'histogram', 'Password verification time, by result.', ('result',), LATENCY_BUCKETS,
+    ),
+    'api_totp_verifications_total': (
+        'counter', 'TOTP code verifications, by result.', ('result',), None,
+    ),
+    'api_qr_render_duration_seconds': (
+        'histogram', 'QR code render time, by format.', ('format',), QR_RENDER_BUCKETS,
+    ),
+    'api_qr_cache_requests_total': (
+        'counter', 'QR code cache lookups, by result.', ('result',), None,
+    ),
+}
+
+# Snapshot holding the totals of exited processes (see FileStore.retire)
+RETIRED_FILE = 'retired.json'
+
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class Registry:
+    """
+    Cumulative metric values of this process.
+
+    Counters map a label tuple to a value; histograms map it to
+    [bucket counts..., sum, count], bucket counts not cumulative.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+
+    def inc(self, name, labels, amount=1):
+        series = self.values[name]
+        with self.lock:
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        series = self.values[name]
+        with self.lock:
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [0] * (len(buckets) + 3)
+            state[bisect.bisect_left(buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(labels), list(value) if isinstance(value, list) else value]
+                       for labels, value in series.items()]
+                for name, series in self.values.items()
+            }
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+
+
+class FileStore:
+    """
+    Snapshots of the registries of all processes, one file per process.
+    """
+
+    def __init__(self, directory, flush_interval):
+        self.directory = os.fspath(directory)
+        self.flush_interval = flush_interval
+        self.new_file()
+
+    def new_file(self):
+        self._lock = threading.Lock()
+        self.path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self, registry):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush(registry)
+
+    def flush(self, registry):
+        if not self._lock.acquire(blocking=False):
+            # Another thread is writing the snapshot
+            return
+        try:
+            self._last_flush = time.monotonic()
+            snapshot = registry.snapshot()
+            if any(snapshot.values()):
+                self._write(self.path, snapshot)
+        except Exception as e:
+            # Metrics must never fail a request; the next flush retries
+            print(f"Warning: Failed to write metrics snapshot {self.path}: {e}")
+        finally:
+            self._lock.release()
+
+    def collect(self):
+        """
+        Sum the snapshots of all processes.
+        """
+        totals = {name: {} for name in METRICS}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return totals
+        for file_name in names:
+            if file_name.endswith('.json'):
+                self._merge(totals, self._read(os.path.join(self.directory, file_name)))
+        return totals
+
+    def retire(self, pid):
+        """
+        Fold the snapshots of an exited process into RETIRED_FILE, so that
+        recycled workers do not each leave a file behind. Only one process
+        (the server's master) may call it.
+        """
+        prefix = f'{pid}-'
+        try:
+            paths = [
+                os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.startswith(prefix) and name.endswith('.json')
+            ]
+        except FileNotFoundError:
+            return
+        if not paths:
+            return
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        totals = {name: {} for name in METRICS}
+        for path in [retired_path, *paths]:
+            self._merge(totals, self._read(path))
+        self._write(retired_path, {
+            name: [[list(labels), value] for labels, value in series.items()]
+            for name, series in totals.items()
+        })
+        for path in paths:
+            os.remove(path)
+
+    def clear(self):
+        """
+        Delete all snapshots, e.g. when the deployment restarts.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith('.json') or name.startswith('.tmp-'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Removed or unreadable: skip it rather than fail the scrape
+            return {}
+
+    @staticmethod
+    def _merge(totals, snapshot):
+        for name, series in snapshot.items():
+            if name not in totals:
+                continue
+            merged = totals[name]
+            for labels, value in series:
+                labels = tuple(labels)
+                if isinstance(value, list):
+                    current = merged.get(labels)
+                    if current is None or len(current) != len(value):
+                        merged[labels] = list(value)
+                    else:
+                        merged[labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[labels] = merged.get(labels, 0) + value
+
+    def _write(self, path, snapshot):
+        data = json.dumps(snapshot).encode()
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render(totals):
+    """
+    The Prometheus text exposition format (version 0.0.4) of the totals.
+    """
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(totals.get(name, {}).items()):
+            if kind == 'counter':
+                lines.append(f'{name}{format_labels(label_names, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), value):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{format_labels(label_names, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(label_names, labels)} {value[-2]}')
+            lines.append(f'{name}_count{format_labels(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+# Stats of the request being served, visible to the query wrapper in the
+# same thread or task, and in the threads of sync_to_async
+_request_stats = ContextVar('metrics_request_stats', default=None)
+
+_registry = Registry()
+_store = None
+_store_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def get_registry():
+    return _registry
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = FileStore(
+                    getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'simple-mfa-metrics')),
+                    getattr(settings, 'METRICS_FLUSH_INTERVAL', 5),
+                )
+                atexit.register(lambda: _store.flush(_registry))
+    return _store
+
+
+def _after_fork_in_child():
+    # Values inherited from the parent are already in its snapshot
+    _registry.reset()
+    if _store is not None:
+        _store.new_file()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def inc(name, labels=(), amount=1):
+    if is_enabled():
+        _registry.inc(name, labels, amount)
+
+
+def observe(name, value, labels=()):
+    if is_enabled():
+        _registry.observe(name, labels, value)
+
+
+class timer:
+    """
+    Context manager observing the duration of its block in a histogram.
+    The labels can be set on the instance inside the block.
+    """
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, self.labels)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """
+    connection.execute_wrappers entry counting the queries of the request.
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def finish_request(request, response, stats, token, started):
+    """
+    Record a request served in time.perf_counter() - started seconds.
+    """
+    elapsed = time.perf_counter() - started
+    _request_stats.reset(token)
+    match = getattr(request, 'resolver_match', None)
+    route = match.view_name if match is not None and match.view_name else '<unmatched>'
+    method = request.method if request.method in KNOWN_METHODS else 'other'
+    _registry.inc('api_requests_total', (route, method, str(response.status_code)))
+    _registry.observe('api_request_duration_seconds', (route, method), elapsed)
+    if stats.queries:
+        _registry.inc('api_db_queries_total', (route,), stats.queries)
+        _registry.inc('api_db_query_duration_seconds_total', (route,), stats.query_time)
+    get_store().maybe_flush(_registry)
+
+
+def retire_process(pid):
+    """
+    Fold the snapshots of an exited worker into the retired totals.
+    """
+    if is_enabled():
+        get_store().retire(pid)
+
+
+def clear_snapshots():
+    if is_enabled():
+        get_store().clear()
+
+
+def collect():
+    """
+    The metrics of all processes, with the current values of this one.
+    """
+    store = get_store()
+    store.flush(_registry)
+    return store.collect()
+
+
+def is_allowed(request):
+    """
+    Whether the request may read the metrics: it carries 'Authorization:
+    Bearer <METRICS_TOKEN>', or its client address (client_ip(), so behind
+    proxies only with AUTH_RATE_LIMIT_TRUSTED_PROXIES set) is in
+    METRICS_ALLOWED_NETWORKS. No network is allowed by default: a reverse
+    proxy on the same host makes every request look local.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode()):
+            return True
+    networks = getattr(settings, 'METRICS_ALLOWED_NETWORKS', [])
+    if not networks:
+        return False
+    try:
+        address = ipaddress.ip_address(client_ip(request))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in networks)
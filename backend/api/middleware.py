@@ -0,0 +1,177 @@
+import functools
+import time
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from django_otp.middleware import OTPMiddleware as BaseOTPMiddleware
+
+from . import metrics
+
+
+class OTPMiddleware(BaseOTPMiddleware):
+    """
+    django_otp's OTPMiddleware, made async-capable so requests served
+    through ASGI do not hop to a worker thread just to pass through it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None:
+            request.user = SimpleLazyObject(
+                functools.partial(self._verify_user, request, user)
+            )
+
+        return await self.get_response(request)
+
+
+class SiteMiddleware:
+    """
+    Runs the SITE_MIDDLEWARE stack for every request outside
+    API_PATH_PREFIX, and nothing for API requests.
+
+    The API authenticates each request with a JWT and its views are CSRF
+    exempt, so sessions, CSRF, session authentication, OTP verification
+    and messages only serve the admin. API requests skip them, including
+    the session and device lookups of OTPMiddleware.
+
+    The stack is built like Django builds MIDDLEWARE, and the
+    process_view and process_exception hooks of its middleware run, in
+    Django's order, for the requests that go through it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = getattr(settings, 'API_PATH_PREFIX', '/api/')
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+        self.view_hooks = []
+        self.exception_hooks = []
+        handler = get_response
+        for middleware_path in reversed(getattr(settings, 'SITE_MIDDLEWARE', [])):
+            middleware = import_string(middleware_path)
+            if self.is_async and not getattr(middleware, 'async_capable', False):
+                # A sync-only middleware in an async stack, adapted as Django does
+                instance = middleware(async_to_sync(handler))
+                handler = sync_to_async(instance, thread_sensitive=True)
+            else:
+                instance = middleware(handler)
+                handler = instance
+            if hasattr(instance, 'process_view'):
+                self.view_hooks.insert(0, self.adapt(instance.process_view))
+            if hasattr(instance, 'process_exception'):
+                self.exception_hooks.append(self.adapt(instance.process_exception))
+        self.site_handler = handler
+
+        if self.is_async:
+            self.process_view = self.aprocess_view
+            self.process_exception = self.aprocess_exception
+
+    def adapt(self, hook):
+        if self.is_async and not iscoroutinefunction(hook):
+            return sync_to_async(hook, thread_sensitive=True)
+        return hook
+
+    def is_api(self, request):
+        return request.path_info.startswith(self.prefix)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if self.is_api(request):
+            return self.get_response(request)
+        return self.site_handler(request)
+
+    async def __acall__(self, request):
+        if self.is_api(request):
+            return await self.get_response(request)
+        return await self.site_handler(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_api(request):
+            return None
+        for hook in self.view_hooks:
+            response = hook(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_api(request):
+            return None
+        for hook in self.view_hooks:
+            response = await hook(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_exception(self, request, exception):
+        if self.is_api(request):
+            return None
+        for hook in self.exception_hooks:
+            response = hook(request, exception)
+            if response is not None:
+                return response
+        return None
+
+    async def aprocess_exception(self, request, exception):
+        if self.is_api(request):
+            return None
+        for hook in self.exception_hooks:
+            response = await hook(request, exception)
+            if response is not None:
+                return response
+        return None
+
+
+class MetricsMiddleware:
+    """
+    Records the count, latency and database queries of every request by
+    route (see api.metrics). Listed first in MIDDLEWARE so the latency
+    covers the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics.is_enabled()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        response = self.get_response(request)
+        metrics.finish_request(request, response, stats, token, started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        stats, token = metrics.start_request()
+        response = await self.get_response(request)
+        metrics.finish_request(request, response, stats, token, started)
+        return response
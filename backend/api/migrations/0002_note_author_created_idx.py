@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='api_note_author_created_idx'),
+        ),
+    ]
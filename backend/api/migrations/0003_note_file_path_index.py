@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_note_author_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='note',
+            name='file_path',
+            field=models.CharField(db_index=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; search is unavailable on other databases
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Words are normalized and prefixed with the author id by api.search
+    schema_editor.execute("CREATE VIRTUAL TABLE api_note_fts USING fts5(title, content)")
+    # Rank by bm25, a title match weighing ten times a content match
+    schema_editor.execute("INSERT INTO api_note_fts (api_note_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE api_note_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_note_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='file_path',
+            field=models.CharField(blank=True, db_index=True, max_length=500),
+        ),
+    ]
@@ -8,12 +8,29 @@ class Note(models.Model):
     """
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notes')
     title = models.CharField(max_length=200)
-    file_path = models.CharField(max_length=500)  # Path to the txt file
+    file_path = models.CharField(max_length=500, blank=True, db_index=True)  # Path to the txt file, '' if inline
+    content = models.TextField(null=True, blank=True)  # Content of small notes, stored inline (see storage.py)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a user's notes on (-created_at, -id)
+            models.Index(fields=['author', 'created_at', 'id'], name='api_note_author_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.author.username}"
+
+
+class RevokedToken(models.Model):
+    """
+    A refresh token revoked by logout or rotation, kept until it expires.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.jti} (expires {self.expires_at:%Y-%m-%d %H:%M})"
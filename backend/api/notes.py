@@ -0,0 +1,189 @@
+"""
+Note helpers shared by the sync and async views.
+"""
+import base64
+import binascii
+import urllib.parse
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Substr
+
+from .models import Note
+from .search import index_notes, search_notes, unindex_notes
+
+
+# Columns fetched for the notes list, so full Note objects are never built
+NOTE_LIST_FIELDS = ('id', 'title', 'file_path', 'created_at', 'updated_at')
+
+
+def serialize_note(row):
+    """
+    Note representation used by the notes list, built from a values() row.
+    """
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'file_url': f'/api/notes/{row["id"]}/download/',  # Use API endpoint instead of direct file URL
+        'file_path': row['file_path'],
+        'created_at': row['created_at'].isoformat(),
+        'updated_at': row['updated_at'].isoformat(),
+        **({'preview': row['preview']} if 'preview' in row else {}),
+    }
+
+
+def note_values(queryset, preview=0):
+    """
+    values() rows for the notes list. With preview > 0 each row also has
+    the first `preview` characters of the content as 'preview', for notes
+    stored inline; it is None for notes stored in a file, which are not
+    read.
+    """
+    if preview:
+        return queryset.annotate(preview=Substr('content', 1, preview)).values(*NOTE_LIST_FIELDS, 'preview')
+    return queryset.values(*NOTE_LIST_FIELDS)
+
+
+def create_note(author_id, title, file_path, content):
+    """
+    Insert a note row and its search index entry in one transaction.
+    An empty file_path (see NoteStorage.store) stores the content inline.
+    """
+    with transaction.atomic():
+        note = Note.objects.create(
+            author_id=author_id, title=title, file_path=file_path, content=None if file_path else content
+        )
+        index_notes([(note.id, author_id, title, content)])
+    return note
+
+
+def delete_note(note):
+    """
+    Delete a note row and its search index entry in one transaction.
+    """
+    with transaction.atomic():
+        unindex_notes([note.id])
+        note.delete()
+
+
+def parse_search_params(params):
+    """
+    Parse the notes search query parameters. Returns (query, limit, offset).
+    Raises ValueError with a client-facing message.
+    """
+    query = params.get('q', '').strip()
+    if not query:
+        raise ValueError('q is required')
+    try:
+        limit = int(params.get('limit', settings.NOTES_PAGE_SIZE))
+        offset = int(params.get('offset', 0))
+    except ValueError:
+        raise ValueError('limit and offset must be integers')
+    if limit < 1 or offset < 0:
+        raise ValueError('limit must be positive and offset not negative')
+    return query, min(limit, settings.NOTES_MAX_PAGE_SIZE), offset
+
+
+def find_notes(author_id, query, limit, offset):
+    """
+    Response payload for a notes search: the matching notes, best first.
+    Raises ValueError with a client-facing message.
+    """
+    notes = search_notes(author_id, query, NOTE_LIST_FIELDS, limit, offset)
+    return {
+        'notes': [
+            serialize_note({field: getattr(note, field) for field in NOTE_LIST_FIELDS})
+            for note in notes
+        ],
+        'next_offset': offset + limit if len(notes) == limit else None,
+    }
+
+
+def encode_cursor(row):
+    """
+    Opaque cursor pointing just after the given row in (-created_at, -id) order.
+    """
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into (created_at, id). Raises ValueError if invalid.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, note_id = raw.split('|')
+        created_at = datetime.fromisoformat(created_at)
+        note_id = int(note_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if created_at.tzinfo is None and settings.USE_TZ:
+        raise ValueError('Invalid cursor')
+    return created_at, note_id
+
+
+def parse_list_params(params):
+    """
+    Parse the notes list query parameters. Returns (version, cursor, limit)
+    where cursor is None or a decoded (created_at, id) pair.
+    Raises ValueError with a client-facing message.
+    """
+    version = params.get('version', '2')
+    if version not in ('1', '2'):
+        raise ValueError('version must be 1 or 2')
+    try:
+        limit = int(params.get('limit', settings.NOTES_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    limit = min(limit, settings.NOTES_MAX_PAGE_SIZE)
+    cursor = params.get('cursor')
+    return version, decode_cursor(cursor) if cursor else None, limit
+
+
+def parse_preview(params):
+    """
+    Length of the content previews requested with ?preview=1 (0 for none).
+    """
+    if params.get('preview', '0') in ('0', 'false', ''):
+        return 0
+    return settings.NOTES_PREVIEW_LENGTH
+
+
+def notes_page_queryset(queryset, cursor, limit, preview=0):
+    """
+    Keyset pagination on (-created_at, -id), served by the
+    (author, created_at, id) index. Fetches one extra row to detect
+    whether there is a next page.
+    """
+    queryset = note_values(queryset.order_by('-created_at', '-id'), preview)
+    if cursor:
+        created_at, note_id = cursor
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=note_id)
+        )
+    return queryset[:limit + 1]
+
+
+def notes_page(rows, limit):
+    """
+    Response payload for a page fetched with notes_page_queryset().
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return {'notes': [serialize_note(row) for row in rows], 'next_cursor': next_cursor}
+
+
+def content_disposition(title):
+    """
+    Content-Disposition header for downloading a note as a txt file.
+    """
+    # Sanitize filename for Content-Disposition header
+    safe_filename = urllib.parse.quote(title.replace('/', '_').replace('\\', '_'))
+    return f'attachment; filename="{safe_filename}.txt"'
@@ -0,0 +1,215 @@
+"""
+Write-coalescing TOTP verification.
+
+TOTPDevice.verify_token() saves the device on every attempt: last_t and
+drift on success, the throttling fields on failure. Every MFA login is
+then a synchronous write, and writes serialize on SQLite.
+
+With OTP_COALESCE_WRITES enabled, verify_token() keeps that state in the
+cache instead and writes it to the database in batches:
+
+* Replay protection: an accepted code claims its time step with an atomic
+  cache.add() on (device, step). A second verification of the same step
+  fails, even when it runs concurrently in another process, as long as the
+  processes share the cache (set REDIS_URL when running several).
+* Codes older than the last accepted step are still rejected, using the
+  larger of the device's last_t and the cached one.
+* Throttling follows django-otp: after n successive failures, attempts
+  are refused for OTP_TOTP_THROTTLE_FACTOR * 2^(n-1) seconds.
+* last_t, drift and the throttling fields are written back with a single
+  UPDATE every OTP_FLUSH_INTERVAL seconds or OTP_FLUSH_BATCH devices, and
+  at process exit. last_t never moves backwards in the database.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django_otp.oath import TOTP
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from . import metrics
+
+
+# Fields written back by flush(), in the order they are updated
+STATE_FIELDS = ('last_t', 'drift', 'throttling_failure_count', 'throttling_failure_timestamp')
+
+
+class CoalescingVerifier:
+    """
+    Verifies TOTP codes against cached state and batches the device writes.
+    """
+
+    def __init__(self, cache, flush_interval, flush_batch):
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def _keys(device_id):
+        return f'otp:last_t:{device_id}', f'otp:fails:{device_id}', f'otp:failed_at:{device_id}'
+
+    @staticmethod
+    def _used_key(device_id, t):
+        return f'otp:used:{device_id}:{t}'
+
+    @staticmethod
+    def _window(device):
+        # Seconds during which a code of one time step can still verify
+        return (2 * device.tolerance + abs(device.drift) + 2) * device.step
+
+    def verify(self, device, token):
+        now = time.time()
+        last_t_key, fails_key, failed_at_key = self._keys(device.pk)
+        state = self.cache.get_many([last_t_key, fails_key, failed_at_key])
+
+        failures = state.get(fails_key)
+        if failures is None:
+            failures = device.throttling_failure_count
+            failed_at = device.throttling_failure_timestamp
+            failed_at = failed_at.timestamp() if failed_at else None
+        else:
+            failed_at = state.get(failed_at_key)
+        if failures and failed_at is not None:
+            factor = getattr(settings, 'OTP_TOTP_THROTTLE_FACTOR', 1)
+            if now - failed_at < factor * 2 ** (failures - 1):
+                return False
+
+        verified = False
+        try:
+            token = int(token)
+        except Exception:
+            pass
+        else:
+            totp = TOTP(device.bin_key, device.step, device.t0, device.digits, device.drift)
+            totp.time = now
+            min_t = max(device.last_t, state.get(last_t_key, -1)) + 1
+            if totp.verify(token, device.tolerance, min_t):
+                # Only the first verification of a time step may succeed
+                verified = self.cache.add(self._used_key(device.pk, totp.t()), 1, timeout=self._window(device))
+
+        if verified:
+            device.last_t = totp.t()
+            if getattr(settings, 'OTP_TOTP_SYNC', True):
+                device.drift = totp.drift
+            device.throttle_reset(commit=False)
+            self.cache.set(last_t_key, device.last_t, timeout=self._window(device))
+            # Not deleted: the database row may still hold older failures
+            self.cache.set(fails_key, 0, timeout=None)
+            self.cache.delete(failed_at_key)
+            self._record(device, STATE_FIELDS)
+        else:
+            self.cache.add(fails_key, failures, timeout=None)
+            try:
+                failures = self.cache.incr(fails_key)
+            except ValueError:
+                failures += 1
+                self.cache.set(fails_key, failures, timeout=None)
+            self.cache.set(failed_at_key, now, timeout=None)
+            device.throttling_failure_count = failures
+            device.throttling_failure_timestamp = datetime.fromtimestamp(now, timezone.utc)
+            self._record(device, ('throttling_failure_count', 'throttling_failure_timestamp'))
+
+        self._maybe_flush()
+        return verified
+
+    def forget(self, device):
+        """
+        Drop the cached and pending state of a device, e.g. after its
+        database row was reset.
+        """
+        with self._lock:
+            self._pending.pop(device.pk, None)
+        t = TOTP(device.bin_key, device.step, device.t0, device.digits, device.drift).t()
+        radius = device.tolerance + abs(device.drift) + 1
+        self.cache.delete_many(
+            list(self._keys(device.pk)) + [self._used_key(device.pk, step) for step in range(t - radius, t + radius + 1)]
+        )
+
+    def _record(self, device, fields):
+        with self._lock:
+            self._pending.setdefault(device.pk, {}).update(
+                (field, getattr(device, field)) for field in fields
+            )
+
+    def _maybe_flush(self):
+        if len(self._pending) >= self.flush_batch or time.monotonic() - self._last_flush >= self.flush_interval:
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep serving from the cache; the state is retried on the next flush
+                print(f"Warning: Failed to flush TOTP device state: {e}")
+
+    def flush(self):
+        """
+        Write the pending device state with one UPDATE.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        updates = {}
+        for name in STATE_FIELDS:
+            field = TOTPDevice._meta.get_field(name)
+            whens = [
+                When(pk=pk, then=Value(values[name], output_field=field))
+                for pk, values in pending.items() if name in values
+            ]
+            if not whens:
+                continue
+            value = Case(*whens, default=F(name), output_field=field)
+            updates[name] = Greatest(F(name), value) if name == 'last_t' else value
+        try:
+            with transaction.atomic():
+                TOTPDevice.objects.filter(pk__in=pending).update(**updates)
+        except Exception:
+            with self._lock:
+                for pk, values in pending.items():
+                    self._pending[pk] = {**values, **self._pending.get(pk, {})}
+            raise
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                _verifier = CoalescingVerifier(
+                    caches[getattr(settings, 'OTP_STATE_CACHE', 'default')],
+                    getattr(settings, 'OTP_FLUSH_INTERVAL', 5),
+                    getattr(settings, 'OTP_FLUSH_BATCH', 100),
+                )
+                atexit.register(_verifier.flush)
+    return _verifier
+
+
+def verify_token(device, token):
+    """
+    device.verify_token(token), with the state writes coalesced if
+    OTP_COALESCE_WRITES is enabled.
+    """
+    if not getattr(settings, 'OTP_COALESCE_WRITES', False):
+        verified = device.verify_token(token)
+    else:
+        verified = get_verifier().verify(device, token)
+    metrics.inc('api_totp_verifications_total', ('accepted' if verified else 'rejected',))
+    return verified
+
+
+def forget(device):
+    if _verifier is not None:
+        _verifier.forget(device)
@@ -0,0 +1,158 @@
+"""
+QR code rendering for MFA enrollment.
+
+Rendering a QR code (building the matrix, rasterizing and encoding it) is
+the most CPU-expensive part of mfa_setup, and the setup page polls the
+endpoint for the same unconfirmed device. Rendered codes are therefore kept
+in a bounded, per-process LRU cache keyed on the device and output format.
+"""
+import base64
+import threading
+from base64 import b32encode
+from collections import OrderedDict
+from io import BytesIO
+
+from django.conf import settings
+
+from . import metrics
+
+
+ISSUER = 'my-mfa-app'
+FORMATS = ('png', 'svg', 'uri')
+
+
+def build_config_url(device, username):
+    """
+    Build the otpauth:// URL with "my-mfa-app" as issuer and the username
+    as account name.
+    """
+    secret = b32encode(device.bin_key).decode()
+    return f"otpauth://totp/{ISSUER}:{username}?secret={secret}&issuer={ISSUER}"
+
+
+def _svg_from_matrix(matrix):
+    """
+    Build a compact SVG from the QR module matrix, drawing each horizontal
+    run of dark modules as a single rectangle.
+    """
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f'M{start} {y}h{x - start}v1H{start}z')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<path fill="#fff" d="M0 0h{size}v{size}H0z"/><path d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+
+def load_renderer():
+    """
+    Import qrcode, and Pillow with its image plugins, on first use rather
+    than with this module, which signals.py loads in every management
+    command and script. startup.preload() calls it before workers fork.
+    """
+    import qrcode
+    from PIL import Image
+
+    Image.preinit()
+    return qrcode
+
+
+def render_qr_code(config_url, fmt):
+    """
+    Render config_url as a data URI in the given format ('png' or 'svg').
+    SVG output skips rasterization entirely and scales to any size.
+    """
+    qrcode = load_renderer()
+    with metrics.timer('api_qr_render_duration_seconds', (fmt,)):
+        qr = qrcode.QRCode(version=1, box_size=10, border=5)
+        qr.add_data(config_url)
+        qr.make(fit=True)
+
+        if fmt == 'svg':
+            data = _svg_from_matrix(qr.get_matrix())
+            mime_type = 'image/svg+xml'
+        else:
+            img = qr.make_image(fill_color="black", back_color="white")
+            buffer = BytesIO()
+            img.save(buffer, format='PNG')
+            data = buffer.getvalue()
+            mime_type = 'image/png'
+    return f'data:{mime_type};base64,{base64.b64encode(data).decode()}'
+
+
+class QRCodeCache:
+    """
+    Thread-safe LRU cache of rendered QR codes.
+
+    Entries are keyed on (device id, format) and store the config URL they
+    were rendered from, so a device whose key or username changed is never
+    served a stale image.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, device_id, fmt, config_url):
+        with self._lock:
+            entry = self._entries.get((device_id, fmt))
+            if entry is None or entry[0] != config_url:
+                return None
+            self._entries.move_to_end((device_id, fmt))
+            return entry[1]
+
+    def set(self, device_id, fmt, config_url, data):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[(device_id, fmt)] = (config_url, data)
+            self._entries.move_to_end((device_id, fmt))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, device_id):
+        with self._lock:
+            for fmt in FORMATS:
+                self._entries.pop((device_id, fmt), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = QRCodeCache(getattr(settings, 'MFA_QR_CACHE_SIZE', 512))
+    return _cache
+
+
+def get_qr_code(device, username, fmt='png'):
+    """
+    Return (config_url, qr_code) for the device. qr_code is a data URI, or
+    None for the 'uri' format where the client renders the code itself.
+    """
+    config_url = build_config_url(device, username)
+    if fmt == 'uri':
+        return config_url, None
+
+    cache = get_cache()
+    qr_code = cache.get(device.pk, fmt, config_url)
+    metrics.inc('api_qr_cache_requests_total', ('miss' if qr_code is None else 'hit',))
+    if qr_code is None:
+        qr_code = render_qr_code(config_url, fmt)
+        cache.set(device.pk, fmt, config_url, qr_code)
+    return config_url, qr_code
@@ -0,0 +1,199 @@
+"""
+Refresh-token revocation.
+
+Revoked refresh tokens (on logout, and the old token on every rotation)
+are stored by JTI in the RevokedToken table until they expire. Each
+process keeps a Bloom filter of the revoked JTIs in front of that table,
+so checking a token that was never revoked, the common case, costs a few
+hash computations and no query. Only a filter hit (a revoked token or a
+rare false positive) is confirmed in the database.
+
+Tokens revoked by other processes are picked up by an incremental sync
+every TOKEN_REVOCATION_SYNC_INTERVAL seconds: rows with an id above the
+highest one loaded so far, plus every row revoked within
+TOKEN_REVOCATION_SYNC_OVERLAP seconds before the previous sync. Ids are
+allocated at INSERT but become visible at COMMIT, so on PostgreSQL a row
+with a lower id can appear after a higher one was already synced; the
+overlap re-reads such rows. A revocation whose transaction commits more
+than TOKEN_REVOCATION_SYNC_OVERLAP seconds after its revoked_at (the
+writing server's clock) is only seen at the next full rebuild. Expired
+rows are pruned and the filter rebuilt every
+TOKEN_REVOCATION_PRUNE_INTERVAL seconds, which bounds how long any
+revocation can go unseen.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone as django_timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import RevokedToken
+
+
+class BloomFilter:
+    """
+    Bloom filter over strings, sized for capacity items at the given
+    false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """
+    Revoked JTIs: a Bloom filter synced from the RevokedToken table.
+    """
+
+    def __init__(self, capacity, error_rate, sync_interval, prune_interval, sync_overlap=60):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.prune_interval = prune_interval
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._synced_at = 0
+        self._pruned_at = 0
+        # Wall-clock time the previous sync started, compared with revoked_at
+        self._synced_since = None
+
+    def is_revoked(self, jti):
+        self._refresh()
+        if jti not in self._filter:
+            return False
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+    def revoke(self, jti, expires_at):
+        """
+        Revoke a token. Returns False if it was already revoked, which
+        makes rotating a refresh token single-use even under concurrency.
+        """
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        self._refresh()
+        with self._lock:
+            self._filter.add(jti)
+        return True
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._filter is not None and now - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            if self._filter is not None and now - self._synced_at < self.sync_interval:
+                return
+            started = django_timezone.now()
+            if self._filter is None or now - self._pruned_at >= self.prune_interval:
+                self._rebuild()
+                self._pruned_at = now
+            else:
+                # Rows committed late, with an id below _last_id, are in the overlap
+                self._load(RevokedToken.objects.filter(
+                    Q(id__gt=self._last_id) | Q(revoked_at__gte=self._synced_since - self.sync_overlap)
+                ))
+            self._synced_at = now
+            self._synced_since = started
+
+    def _rebuild(self):
+        RevokedToken.objects.filter(expires_at__lt=django_timezone.now()).delete()
+        rows = RevokedToken.objects.all()
+        self._filter = BloomFilter(max(self.capacity, 2 * rows.count()), self.error_rate)
+        self._last_id = 0
+        self._load(rows)
+
+    def _load(self, rows):
+        for row_id, jti in rows.order_by('id').values_list('id', 'jti').iterator():
+            # Rows re-read by the overlap are usually in already
+            if jti not in self._filter:
+                self._filter.add(jti)
+            self._last_id = max(self._last_id, row_id)
+        if self._filter.count > self._filter.capacity:
+            # Too full for the target error rate: size it up on the next sync
+            self._pruned_at = 0
+
+    def clear(self):
+        with self._lock:
+            self._filter = None
+
+
+_revocations = None
+_revocations_lock = threading.Lock()
+
+
+def get_revocations():
+    global _revocations
+    if _revocations is None:
+        with _revocations_lock:
+            if _revocations is None:
+                _revocations = RevocationList(
+                    getattr(settings, 'TOKEN_REVOCATION_BLOOM_CAPACITY', 100000),
+                    getattr(settings, 'TOKEN_REVOCATION_BLOOM_ERROR_RATE', 0.001),
+                    getattr(settings, 'TOKEN_REVOCATION_SYNC_INTERVAL', 5),
+                    getattr(settings, 'TOKEN_REVOCATION_PRUNE_INTERVAL', 3600),
+                    getattr(settings, 'TOKEN_REVOCATION_SYNC_OVERLAP', 60),
+                )
+    return _revocations
+
+
+def token_expiry(token):
+    return datetime.fromtimestamp(token['exp'], timezone.utc)
+
+
+class RevokingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that rejects revoked refresh tokens and, when tokens are
+    rotated, revokes the token it was given.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        jti = refresh[api_settings.JTI_CLAIM]
+        revocations = get_revocations()
+        if revocations.is_revoked(jti):
+            raise TokenError('Token is blacklisted')
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if getattr(settings, 'TOKEN_REVOKE_AFTER_ROTATION', True):
+                if not revocations.revoke(jti, token_expiry(refresh)):
+                    raise TokenError('Token is blacklisted')
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data['refresh'] = str(refresh)
+
+        return data
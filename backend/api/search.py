@@ -0,0 +1,138 @@
+"""
+Full-text search over note titles and contents.
+
+Notes are indexed in an SQLite FTS5 table, api_note_fts, whose rowid is
+the note id (created by migration 0005). The index is updated in the same
+transaction as the note rows it describes: notes.create_note,
+notes.delete_note and the batch helpers call index_notes and
+unindex_notes. `manage.py rebuild_search_index` rebuilds it from the note
+files.
+
+The index is partitioned by user: every word is stored as
+'<author id>x<word>', and queries are rewritten the same way. A query only
+reads the postings of its user's notes, and a prefix query only scans that
+user's words, so its cost does not grow with the total number of notes.
+Words are case and accent insensitive. Results are ranked with bm25, a
+title match weighing more than a content match.
+
+On databases without FTS5 (anything but SQLite) search is unavailable and
+the index functions do nothing.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+
+from .models import Note
+
+
+INDEX_TABLE = 'api_note_fts'
+MAX_QUERY_TERMS = 16
+
+# Letters and digits only, so that every indexed word stays a single token
+# for the FTS5 unicode61 tokenizer
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def words(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return WORD_RE.findall(''.join(c for c in text if not unicodedata.combining(c)))
+
+
+def index_terms(author_id, text):
+    """
+    The words of text as indexed for the given author.
+    """
+    return ' '.join(f'{int(author_id)}x{word}' for word in words(text))
+
+
+def build_match(author_id, query):
+    """
+    FTS5 MATCH expression for a user query: all terms must match, a
+    trailing '*' makes a term a prefix query. User input never reaches the
+    FTS5 query syntax unquoted. Raises ValueError if there is nothing to
+    search for.
+    """
+    phrases = []
+    for term in query.split():
+        terms = index_terms(author_id, term)
+        if not terms:
+            continue
+        phrases.append(f'"{terms}"*' if term.endswith('*') else f'"{terms}"')
+    if not phrases:
+        raise ValueError('q must contain at least one word')
+    if len(phrases) > MAX_QUERY_TERMS:
+        raise ValueError(f'q must have at most {MAX_QUERY_TERMS} terms')
+    return ' '.join(phrases)
+
+
+def index_notes(entries):
+    """
+    Add (note_id, author_id, title, content) entries to the index,
+    replacing existing entries of the same notes.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {INDEX_TABLE} (rowid, title, content) VALUES (%s, %s, %s)',
+            [
+                (note_id, index_terms(author_id, title), index_terms(author_id, content))
+                for note_id, author_id, title, content in entries
+            ],
+        )
+
+
+def unindex_notes(note_ids):
+    """
+    Remove the entries of the given notes from the index.
+    """
+    note_ids = list(note_ids)
+    if not note_ids or not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {INDEX_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(note_ids))})',
+            note_ids,
+        )
+
+
+def clear_index():
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE}')
+
+
+def optimize_index():
+    """
+    Merge the index b-trees, which makes queries faster after a rebuild.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}) VALUES ('optimize')")
+
+
+def search_notes(author_id, query, fields, limit, offset=0):
+    """
+    The author's notes matching query, best first, with the given fields
+    loaded. Raises ValueError for an empty query.
+    """
+    match = build_match(author_id, query)
+    columns = ', '.join(f'n.{field}' for field in fields)
+    return list(Note.objects.raw(
+        f"""
+        SELECT {columns}
+        FROM (
+            SELECT rowid, rank FROM {INDEX_TABLE}
+            WHERE {INDEX_TABLE} MATCH %s
+            ORDER BY rank
+            LIMIT %s OFFSET %s
+        ) s
+        JOIN {Note._meta.db_table} n ON n.id = s.rowid
+        WHERE n.author_id = %s
+        ORDER BY s.rank
+        """,
+        [match, limit, offset, author_id],
+    ))
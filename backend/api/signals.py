@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from . import metrics, qr
+from .user_cache import get_user_cache
+
+
+@receiver(post_save, sender=TOTPDevice)
+def totp_device_saved(sender, instance, created, **kwargs):
+    """
+    Drop cached QR codes once a device is confirmed, and optionally
+    pre-render the QR code for newly created devices.
+    """
+    if instance.confirmed:
+        qr.get_cache().invalidate(instance.pk)
+    elif created and getattr(settings, 'MFA_QR_PRERENDER', False):
+        fmt = getattr(settings, 'MFA_QR_DEFAULT_FORMAT', 'png')
+        transaction.on_commit(lambda: qr.get_qr_code(instance, instance.user.username, fmt))
+
+
+@receiver(post_delete, sender=TOTPDevice)
+def totp_device_deleted(sender, instance, **kwargs):
+    """
+    Drop cached QR codes when MFA is reset for a user.
+    """
+    qr.get_cache().invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """
+    Drop the cached user so JWT authentication sees deactivation and
+    other changes immediately (in this process).
+    """
+    get_user_cache().invalidate(instance.pk)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply SQLITE_PRAGMAS (the sqlite-wal DB_PROFILE) to new connections.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    """
+    Count the queries of each request for the metrics (METRICS_ENABLED).
+    """
+    if metrics.is_enabled() and metrics.query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.query_wrapper)
@@ -0,0 +1,59 @@
+"""
+Process start-up: what is loaded when, and warming a worker up front.
+
+django.setup() only loads what every process needs: models, signals and
+the small helper modules they use. DRF, simplejwt and the views are
+loaded with the URLconf, and qrcode and Pillow when the first QR code is
+rendered (see qr.load_renderer), so management commands and scripts such
+as reset_mfa.py do not pay for them.
+
+A server process then pays for them on its first requests. preload()
+loads them all at once instead, together with the per-process state that
+does not depend on the database. config/wsgi.py and config/asgi.py call it
+when APP_PRELOAD is set, so a pre-forking server that loads the
+application in its parent (gunicorn --preload) does the work once and its
+workers start ready, sharing those pages copy-on-write.
+
+`manage.py profile_startup` reports the import time and the time to first
+request of a new process, with and without preloading.
+"""
+import asyncio
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.db import connections
+from django.urls import get_resolver
+from django.utils.module_loading import import_string
+
+
+def preload():
+    """
+    Import the URLconf, views and lazily loaded dependencies, and build
+    per-process state, without touching the database.
+    """
+    # Resolving and reversing URLs imports every view module
+    get_resolver().reverse_dict
+
+    from rest_framework.settings import api_settings as drf_settings
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+    from rest_framework_simplejwt.state import token_backend  # noqa: F401
+
+    # DRF and simplejwt import their configured classes on first access
+    for name in ('DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_PERMISSION_CLASSES',
+                 'DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES'):
+        getattr(drf_settings, name)
+    for name in ('AUTH_TOKEN_CLASSES', 'TOKEN_USER_CLASS'):
+        getattr(jwt_settings, name)
+    import_string(settings.SIMPLE_JWT['TOKEN_REFRESH_SERIALIZER'])
+
+    from . import qr
+    qr.load_renderer()
+    get_hasher()
+
+    # Nothing opened above should be inherited by forked workers. A server
+    # importing the application inside its event loop (uvicorn) does not
+    # fork from here, and Django refuses to close connections in async code.
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        connections.close_all()
@@ -0,0 +1,240 @@
+"""
+Note content storage: inline in the Note row, or in a file under NOTES_DIR.
+
+Contents of at most NOTES_INLINE_MAX_SIZE bytes (UTF-8) are kept in the
+Note.content column, with an empty Note.file_path, so creating, reading
+and deleting them costs no file system call. Larger contents go to a file
+and Note.content stays NULL. store() picks the tier for new notes, and
+open(), read(), ensure() and delete() accept either kind of note;
+`manage.py migrate_note_tiers` moves existing notes when the threshold
+changes.
+
+Note files are written atomically (temporary file + rename) into a sharded
+directory tree, NOTES_DIR/<ab>/<cd>/<name>.txt, where <ab>/<cd> are the first
+hex digits of the name. This keeps directories small at millions of notes,
+and a reader never sees a half-written file.
+
+With NOTES_DEDUPLICATE enabled the name is the SHA-256 of the content, so
+identical notes share one blob. The notes referencing a blob are counted
+through the indexed Note.file_path column, and a blob is only unlinked once
+no note references it.
+
+With NOTES_COMPRESSION set (e.g. 'gzip'), contents of at least
+NOTES_COMPRESS_MIN_SIZE bytes are stored compressed, with the codec's
+suffix on the file name (see compression.py). Smaller notes stay plain
+text, where compression would save little or even grow them.
+
+Paths stored by older versions (flat NOTES_DIR/<user>_<time>_<title>.txt)
+resolve through the same MEDIA_URL-relative lookup and keep working.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .compression import codec_for_path, get_codec
+from .models import Note
+
+
+class NoteStorage:
+    """
+    Sharded, optionally content-addressed file storage for notes.
+    """
+
+    def __init__(self, root, media_root, media_url, deduplicate=False, codec=None, compress_min_size=0,
+                 inline_max_size=0):
+        self.root = os.fspath(root)
+        self.media_root = os.fspath(media_root)
+        self.media_url = media_url
+        self.deduplicate = deduplicate
+        self.codec = codec
+        self.compress_min_size = compress_min_size
+        self.inline_max_size = inline_max_size
+
+    def path(self, file_path):
+        """
+        Resolve a stored Note.file_path (e.g. '/media/notes/ab/cd/<name>.txt')
+        to an absolute path under MEDIA_ROOT.
+        """
+        path = os.path.normpath(os.path.join(self.media_root, file_path.removeprefix(self.media_url)))
+        if os.path.commonpath([path, self.media_root]) != self.media_root:
+            raise FileNotFoundError(file_path)
+        return path
+
+    def name_for(self, data):
+        if self.deduplicate:
+            return hashlib.sha256(data).hexdigest()
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_content_addressed(file_path):
+        """
+        Blobs named by their SHA-256 may be shared by several notes, even if
+        deduplication has been switched off since they were written.
+        """
+        name = os.path.basename(file_path).split('.')[0]
+        return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+    def store(self, content):
+        """
+        Store note content in the tier its size calls for. Returns the
+        relative path to keep on the Note, or '' if the content is to be
+        kept inline in Note.content.
+        """
+        if len(content.encode('utf-8')) <= self.inline_max_size:
+            return ''
+        return self.save(content)
+
+    def save(self, content):
+        """
+        Store note content in a file and return the relative path to keep
+        on the Note.
+        """
+        data = content.encode('utf-8')
+        name = self.name_for(data)
+        directory = os.path.join(self.root, name[:2], name[2:4])
+        codec = self.codec if self.codec and len(data) >= self.compress_min_size else None
+        path = os.path.join(directory, f'{name}.txt{codec.suffix if codec else ""}')
+        if not (self.deduplicate and os.path.exists(path)):
+            self._write_atomic(directory, path, codec.compress(data) if codec else data)
+        return self.media_url + os.path.relpath(path, self.media_root).replace(os.sep, '/')
+
+    def open(self, file_path, content=None):
+        """
+        Open a stored note as a binary stream of its (decompressed) content.
+        content is the Note.content of an inline note (empty file_path).
+        """
+        if not file_path:
+            return io.BytesIO(content.encode('utf-8'))
+        codec = codec_for_path(file_path)
+        path = self.path(file_path)
+        return codec.open(path) if codec else open(path, 'rb')
+
+    def read(self, file_path, content=None):
+        """
+        Return the content of a stored note.
+        """
+        if not file_path:
+            return content
+        with self.open(file_path) as f:
+            return f.read().decode('utf-8')
+
+    def size(self, file_path):
+        """
+        Size of the (decompressed) content of a note file.
+        """
+        codec = codec_for_path(file_path)
+        path = self.path(file_path)
+        return codec.decompressed_size(path) if codec else os.path.getsize(path)
+
+    def ensure(self, file_path, content):
+        """
+        Re-create a deduplicated blob if a concurrent delete unlinked it
+        between save() and the insert of the Note referencing it.
+        """
+        if self.deduplicate and file_path:
+            path = self.path(file_path)
+            if not os.path.exists(path):
+                data = content.encode('utf-8')
+                codec = codec_for_path(file_path)
+                self._write_atomic(os.path.dirname(path), path, codec.compress(data) if codec else data)
+
+    def delete(self, file_path):
+        """
+        Delete the file of a note whose row was already deleted. Deduplicated
+        blobs are kept while other notes still reference them.
+        """
+        if not file_path:
+            return
+        if self.is_content_addressed(file_path) and Note.objects.filter(file_path=file_path).exists():
+            return
+        self._unlink(file_path)
+
+    def store_many(self, contents):
+        """
+        Store several note contents, files in parallel on the batch thread
+        pool. Returns, in order, the relative path ('' for inline content)
+        or the exception for each content.
+        """
+        return list(get_batch_executor().map(self._store_or_error, contents))
+
+    def ensure_many(self, file_paths, contents):
+        if self.deduplicate:
+            list(get_batch_executor().map(self.ensure, file_paths, contents))
+
+    def delete_many(self, file_paths):
+        """
+        Delete the files of notes whose rows were already deleted, with one
+        reference query for all deduplicated blobs and parallel unlinks.
+        """
+        file_paths = set(file_paths) - {''}
+        shared = [file_path for file_path in file_paths if self.is_content_addressed(file_path)]
+        if shared:
+            file_paths -= set(Note.objects.filter(file_path__in=shared).values_list('file_path', flat=True))
+        list(get_batch_executor().map(self._unlink, file_paths))
+
+    def _store_or_error(self, content):
+        try:
+            return self.store(content)
+        except Exception as e:
+            return e
+
+    def _unlink(self, file_path):
+        try:
+            os.remove(self.path(file_path))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Log error but continue, the database row is already gone
+            print(f"Warning: Failed to delete file {file_path}: {e}")
+
+    def _write_atomic(self, directory, path, data):
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+_storage = None
+_batch_executor = None
+
+
+def get_note_storage():
+    global _storage
+    if _storage is None:
+        _storage = NoteStorage(
+            settings.NOTES_DIR,
+            settings.MEDIA_ROOT,
+            settings.MEDIA_URL,
+            deduplicate=getattr(settings, 'NOTES_DEDUPLICATE', False),
+            codec=get_codec(getattr(settings, 'NOTES_COMPRESSION', None)),
+            compress_min_size=getattr(settings, 'NOTES_COMPRESS_MIN_SIZE', 1024),
+            inline_max_size=getattr(settings, 'NOTES_INLINE_MAX_SIZE', 0),
+        )
+    return _storage
+
+
+def get_batch_executor():
+    """
+    Bounded thread pool for the file writes and unlinks of batch requests.
+    """
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'NOTES_BATCH_WORKERS', 8),
+            thread_name_prefix='notes-batch',
+        )
+    return _batch_executor
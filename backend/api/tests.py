@@ -0,0 +1,239 @@
+import atexit
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django_otp.oath import TOTP
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from api import otp
+from api.challenge import CHALLENGE_MAX_AGE, CHALLENGE_SALT, Challenge, challenge_devices, create_challenge, read_challenge
+from api.models import RevokedToken
+from api.revocation import RevocationList
+
+
+def totp_for(device, at=None):
+    totp = TOTP(device.bin_key, device.step, device.t0, device.digits, device.drift)
+    if at is not None:
+        totp.time = at
+    return totp
+
+
+def legacy_token(user_id, timestamp):
+    return hashlib.sha256(f'{user_id}:{timestamp}:{settings.SECRET_KEY}'.encode()).hexdigest()[:32]
+
+
+@override_settings(OTP_COALESCE_WRITES=True, OTP_FLUSH_INTERVAL=3600, OTP_FLUSH_BATCH=1000)
+class CoalescingVerifierTests(TransactionTestCase):
+    """
+    Replay protection and write-back of the cache-backed TOTP verifier.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        otp._verifier = None
+        user = User.objects.create_user('alice', password='pw-123456')
+        self.device = TOTPDevice.objects.create(user=user, name='my-mfa-app', confirmed=True)
+
+    def tearDown(self):
+        if otp._verifier is not None:
+            # Its pending state refers to the test database
+            atexit.unregister(otp._verifier.flush)
+        otp._verifier = None
+        caches['default'].clear()
+
+    def load_device(self):
+        return TOTPDevice.objects.get(pk=self.device.pk)
+
+    def test_concurrent_verifications_of_one_code_accept_it_once(self):
+        threads = 8
+        token = totp_for(self.device).token()
+        devices = [self.load_device() for _ in range(threads)]
+        barrier = threading.Barrier(threads, timeout=10)
+        checked = threading.Barrier(threads, timeout=10)
+        results = []
+        lock = threading.Lock()
+        check_code = TOTP.verify
+
+        def verify_code(totp, *args, **kwargs):
+            # Every thread has read the cached state and checked the code
+            # before any of them claims the time step
+            valid = check_code(totp, *args, **kwargs)
+            checked.wait()
+            return valid
+
+        def verify(device):
+            try:
+                barrier.wait()
+                verified = otp.verify_token(device, token)
+                with lock:
+                    results.append(verified)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=verify, args=(device,)) for device in devices]
+        with mock.patch.object(TOTP, 'verify', verify_code):
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        self.assertEqual(len(results), threads)
+        self.assertEqual(results.count(True), 1)
+
+    def test_code_of_an_earlier_step_is_rejected_after_a_later_one(self):
+        now = time.time()
+        start = now - now % self.device.step
+        earlier, later = totp_for(self.device, start), totp_for(self.device, start + self.device.step)
+
+        with mock.patch('api.otp.time.time', return_value=start):
+            self.assertTrue(otp.verify_token(self.load_device(), earlier.token()))
+        with mock.patch('api.otp.time.time', return_value=start + self.device.step):
+            self.assertTrue(otp.verify_token(self.load_device(), later.token()))
+            self.assertFalse(otp.verify_token(self.load_device(), earlier.token()))
+
+    def test_unused_code_older_than_the_accepted_step_is_rejected(self):
+        now = time.time()
+        start = now - now % self.device.step
+        earlier, later = totp_for(self.device, start), totp_for(self.device, start + self.device.step)
+
+        with mock.patch('api.otp.time.time', return_value=start + self.device.step):
+            self.assertTrue(otp.verify_token(self.load_device(), later.token()))
+            # Within the tolerance window, but older than the accepted step;
+            # the row is not flushed yet, so only the cached last_t knows that
+            self.assertFalse(otp.verify_token(self.load_device(), earlier.token()))
+
+    def test_flush_writes_the_device_state(self):
+        now = time.time()
+        start = now - now % self.device.step
+        totp = totp_for(self.device, start)
+
+        with mock.patch('api.otp.time.time', return_value=start):
+            self.assertTrue(otp.verify_token(self.load_device(), totp.token()))
+            self.assertFalse(otp.verify_token(self.load_device(), totp.token()))
+        device = self.load_device()
+        self.assertEqual((device.last_t, device.throttling_failure_count), (-1, 0))
+
+        otp.get_verifier().flush()
+        device = self.load_device()
+        self.assertEqual(device.last_t, totp.t())
+        self.assertEqual(device.throttling_failure_count, 1)
+        self.assertIsNotNone(device.throttling_failure_timestamp)
+
+
+class RevocationListTests(TestCase):
+    """
+    Incremental sync of the revoked-token Bloom filter.
+    """
+
+    def setUp(self):
+        self.expires_at = timezone.now() + timedelta(days=1)
+        self.revocations = RevocationList(1000, 0.001, sync_interval=0, prune_interval=3600)
+
+    def test_row_committed_after_a_higher_id_is_synced(self):
+        RevokedToken.objects.create(id=10, jti='later-id', expires_at=self.expires_at)
+        self.assertTrue(self.revocations.is_revoked('later-id'))
+        # A transaction that was given id 5 earlier commits only now
+        RevokedToken.objects.create(id=5, jti='committed-late', expires_at=self.expires_at)
+        self.assertTrue(self.revocations.is_revoked('committed-late'))
+
+    def test_row_outside_the_overlap_is_synced_by_the_next_rebuild(self):
+        RevokedToken.objects.create(id=10, jti='later-id', expires_at=self.expires_at)
+        self.assertTrue(self.revocations.is_revoked('later-id'))
+        RevokedToken.objects.create(id=5, jti='committed-late', expires_at=self.expires_at)
+        # revoked_at is set at INSERT; this commit came long after it
+        RevokedToken.objects.filter(id=5).update(revoked_at=timezone.now() - timedelta(minutes=10))
+        self.assertFalse(self.revocations.is_revoked('committed-late'))
+        self.revocations._pruned_at = 0
+        self.assertTrue(self.revocations.is_revoked('committed-late'))
+
+
+class ChallengeTests(TestCase):
+    """
+    Signed and legacy MFA challenge tokens.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('alice', password='pw-123456')
+        self.device = TOTPDevice.objects.create(user=self.user, name='my-mfa-app', confirmed=True)
+        self.other = User.objects.create_user('bob', password='pw-123456')
+        self.other_device = TOTPDevice.objects.create(user=self.other, name='my-mfa-app', confirmed=True)
+
+    def test_signed_token_names_the_user_and_device(self):
+        temp_token, _ = create_challenge(self.user.id, self.device.id)
+        self.assertEqual(read_challenge(temp_token), Challenge(self.user.id, self.device.id))
+        self.assertEqual(read_challenge(temp_token, str(self.user.id)), Challenge(self.user.id, self.device.id))
+        self.assertIsNone(read_challenge(temp_token, str(self.other.id)))
+        self.assertIsNone(read_challenge(12345))
+
+    def test_expired_signed_token_is_rejected(self):
+        now = time.time()
+        with mock.patch('django.core.signing.time.time', return_value=now - CHALLENGE_MAX_AGE - 1):
+            expired, _ = create_challenge(self.user.id, self.device.id)
+        with mock.patch('django.core.signing.time.time', return_value=now - CHALLENGE_MAX_AGE + 5):
+            fresh, _ = create_challenge(self.user.id, self.device.id)
+        self.assertIsNone(read_challenge(expired))
+        self.assertEqual(read_challenge(fresh), Challenge(self.user.id, self.device.id))
+
+    def test_tampered_signed_token_is_rejected(self):
+        temp_token, _ = create_challenge(self.user.id, self.device.id)
+        value, stamp, signature = temp_token.split(':')
+        forged_value = f'{self.other.id}.{self.other_device.id}:{stamp}:{signature}'
+        forged_signature = f'{value}:{stamp}:{signature[:-1]}{"A" if signature[-1] != "A" else "B"}'
+        for token in (forged_value, forged_signature, temp_token + 'x', f'{value}:{signature}'):
+            self.assertIsNone(read_challenge(token), token)
+
+    def test_token_signed_with_another_salt_is_rejected(self):
+        value = f'{self.user.id}.{self.device.id}'
+        self.assertIsNotNone(read_challenge(signing.TimestampSigner(salt=CHALLENGE_SALT).sign(value)))
+        self.assertIsNone(read_challenge(signing.TimestampSigner(salt='api.other').sign(value)))
+        self.assertIsNone(read_challenge(signing.TimestampSigner().sign(value)))
+
+    def test_device_of_another_user_is_not_found(self):
+        temp_token, _ = create_challenge(self.user.id, self.other_device.id)
+        challenge = read_challenge(temp_token)
+        self.assertFalse(challenge_devices(challenge).exists())
+
+        response = Client().post('/api/mfa/verify/', {
+            'temp_token': temp_token, 'token': totp_for(self.other_device).token(),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('access', response.json())
+
+    def test_token_without_a_device_finds_the_users_devices(self):
+        user = User.objects.create_user('carol', password='pw-123456')
+        temp_token, _ = create_challenge(user.id)
+        challenge = read_challenge(temp_token)
+        self.assertEqual(challenge, Challenge(user.id, None))
+        self.assertFalse(challenge_devices(challenge).exists())
+
+        # The device created by mfa/setup is found by the same token
+        response = Client().get('/api/mfa/setup/', {'temp_token': temp_token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(challenge_devices(challenge).values_list('user_id', flat=True)), [user.id])
+
+    def test_legacy_token_needs_its_user_id_and_timestamp(self):
+        timestamp = int(time.time())
+        temp_token = legacy_token(self.user.id, timestamp)
+        self.assertEqual(read_challenge(temp_token, str(self.user.id), str(timestamp)), Challenge(self.user.id, None))
+        self.assertIsNone(read_challenge(temp_token, str(self.other.id), str(timestamp)))
+        self.assertIsNone(read_challenge(temp_token, str(self.user.id), str(timestamp - 1)))
+        with self.assertRaises(ValueError):
+            read_challenge(temp_token)
+        with self.assertRaises(ValueError):
+            read_challenge(temp_token, 'alice', str(timestamp))
+
+    def test_expired_legacy_token_is_rejected(self):
+        timestamp = int(time.time()) - CHALLENGE_MAX_AGE - 1
+        temp_token = legacy_token(self.user.id, timestamp)
+        self.assertIsNone(read_challenge(temp_token, str(self.user.id), str(timestamp)))
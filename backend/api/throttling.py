@@ -0,0 +1,196 @@
+"""
+Brute-force admission control for the login and MFA endpoints.
+
+Attempts are counted per username (or user id for TOTP codes) and per
+client IP in a sliding window, and rejected with 429 before any password
+hash or TOTP check runs, so a credential-stuffing burst costs a counter
+update instead of a PBKDF2 hash.
+
+The window is approximated from two fixed buckets, the current count plus
+the previous bucket's count weighted by how much of it still overlaps the
+window, which needs O(1) state per key. Rejected attempts count as well,
+so a client that keeps hammering stays locked out. Counters live in process memory
+by default; set AUTH_RATE_LIMIT_CACHE to a cache alias to share them
+between processes. Limits are configured by AUTH_RATE_LIMITS in settings.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LocalCounter:
+    """
+    In-process bucket counters. Keeps at most max_keys keys, evicting the
+    least recently used ones.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def incr(self, key, bucket, timeout):
+        """
+        Count an attempt in the bucket. Returns (current, previous) counts.
+        """
+        with self._lock:
+            entry = self._counts.pop(key, None)
+            if entry is None or entry[0] < bucket - 1:
+                entry = [bucket, 0, 0]
+            elif entry[0] == bucket - 1:
+                entry = [bucket, 0, entry[1]]
+            entry[1] += 1
+            self._counts[key] = entry
+            if len(self._counts) > self.max_keys:
+                self._counts.popitem(last=False)
+            return entry[1], entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+class CacheCounter:
+    """
+    Bucket counters in a Django cache, shared by every process using it.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def incr(self, key, bucket, timeout):
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        current_key = f'auth-rl:{digest}:{bucket}'
+        previous_key = f'auth-rl:{digest}:{bucket - 1}'
+        self.cache.add(current_key, 0, timeout=timeout)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(current_key, 1, timeout=timeout)
+            current = 1
+        return current, self.cache.get(previous_key, 0)
+
+    def clear(self):
+        pass
+
+
+class SlidingWindowLimiter:
+    """
+    Allows at most limit attempts per key within window seconds.
+    """
+
+    def __init__(self, scope, limit, window, counter):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.counter = counter
+        self.allowed = 0
+        self.rejected = 0
+
+    def hit(self, key, now=None):
+        """
+        Count an attempt for key. Returns 0 if it is allowed, otherwise the
+        number of seconds after which the client may retry.
+        """
+        now = time.time() if now is None else now
+        bucket, offset = divmod(now, self.window)
+        bucket = int(bucket)
+        current, previous = self.counter.incr(f'{self.scope}:{key}', bucket, timeout=2 * self.window)
+
+        overlap = 1 - offset / self.window
+        if previous * overlap + current <= self.limit:
+            self.allowed += 1
+            return 0
+        self.rejected += 1
+        if current > self.limit or not previous:
+            return math.ceil(self.window - offset)
+        # Wait until the previous bucket's weight has dropped enough
+        overlap_needed = (self.limit - current) / previous
+        return max(1, math.ceil((overlap - overlap_needed) * self.window))
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'window': self.window,
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+
+_limiters = None
+_limiters_lock = threading.Lock()
+
+
+def get_limiters():
+    """
+    The limiters configured by AUTH_RATE_LIMITS, keyed by scope.
+    """
+    global _limiters
+    if _limiters is None:
+        with _limiters_lock:
+            if _limiters is None:
+                alias = getattr(settings, 'AUTH_RATE_LIMIT_CACHE', None)
+                counter = CacheCounter(alias) if alias else LocalCounter()
+                _limiters = {
+                    scope: SlidingWindowLimiter(scope, limit, window, counter)
+                    for scope, (limit, window) in settings.AUTH_RATE_LIMITS.items()
+                }
+    return _limiters
+
+
+def reset_limiters():
+    """
+    Drop all in-process counters and statistics.
+    """
+    global _limiters
+    with _limiters_lock:
+        if _limiters:
+            next(iter(_limiters.values())).counter.clear()
+        _limiters = None
+
+
+def client_ip(request):
+    """
+    Client address, taken from X-Forwarded-For when the deployment sets
+    AUTH_RATE_LIMIT_TRUSTED_PROXIES to the number of proxies in front of it.
+    """
+    proxies = getattr(settings, 'AUTH_RATE_LIMIT_TRUSTED_PROXIES', 0)
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return addresses[max(0, len(addresses) - proxies)]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def check_attempt(request, scope, subject):
+    """
+    Count an attempt against the '<scope>_user' and '<scope>_ip' limiters.
+    Returns 0 if it may proceed, otherwise the Retry-After in seconds.
+    """
+    if not getattr(settings, 'AUTH_RATE_LIMIT_ENABLED', True):
+        return 0
+    limiters = get_limiters()
+    retry_after = 0
+    for name, key in ((f'{scope}_user', str(subject).casefold()), (f'{scope}_ip', client_ip(request))):
+        limiter = limiters.get(name)
+        if limiter is not None:
+            retry_after = max(retry_after, limiter.hit(key))
+    return retry_after
+
+
+def check_login(request, username):
+    return check_attempt(request, 'login', username)
+
+
+def check_mfa(request, user_id):
+    return check_attempt(request, 'mfa', user_id)
+
+
+def limiter_stats():
+    return {scope: limiter.stats() for scope, limiter in get_limiters().items()}
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
 from . import views
 
+if settings.API_ASYNC_VIEWS:
+    from . import async_views as views  # noqa: F811
+
 urlpatterns = [
     path('login/', views.login, name='login'),
     path('logout/', views.logout, name='logout'),
@@ -9,11 +13,17 @@ urlpatterns = [
     path('mfa/verify/', views.verify_mfa, name='verify_mfa'),
     path('mfa/setup/', views.mfa_setup, name='mfa_setup'),
     path('mfa/confirm/', views.mfa_confirm, name='mfa_confirm'),
+    path('auth/rate-limits/', views.auth_rate_limits, name='auth_rate_limits'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('welcome/', views.welcome, name='welcome'),
     path('lucky-number/', views.lucky_number, name='lucky_number'),
     path('quote-of-the-day/', views.quote_of_the_day, name='quote_of_the_day'),
     path('notes/', views.notes_list, name='notes_list'),
+    path('notes/search/', views.notes_search, name='notes_search'),
     path('notes/create/', views.notes_create, name='notes_create'),
+    path('notes/batch/create/', views.notes_batch_create, name='notes_batch_create'),
+    path('notes/batch/delete/', views.notes_batch_delete, name='notes_batch_delete'),
+    path('notes/export/', views.notes_export, name='notes_export'),
     path('notes/<int:note_id>/download/', views.notes_download, name='notes_download'),
     path('notes/<int:note_id>/delete/', views.notes_delete, name='notes_delete'),
 ]
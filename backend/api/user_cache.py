@@ -0,0 +1,80 @@
+"""
+Per-process cache of the users resolved by CachedJWTAuthentication.
+
+Kept apart from authentication.py, which loads DRF and simplejwt, so that
+signals.py can invalidate entries without importing them in management
+commands and scripts.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class UserCache:
+    """
+    Thread-safe LRU cache of active users by id, with a TTL.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            # Each request gets its own copy of the cached instance
+            return copy.copy(entry[1])
+
+    def set(self, user_id, user, version):
+        """
+        Cache a user loaded while the cache was at the given version; the
+        entry is skipped if an invalidation happened in the meantime.
+        """
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._version += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+
+_cache = None
+
+
+def get_user_cache():
+    global _cache
+    if _cache is None:
+        _cache = UserCache(
+            getattr(settings, 'JWT_USER_CACHE_SIZE', 1024),
+            getattr(settings, 'JWT_USER_CACHE_TTL', 60),
+        )
+    return _cache
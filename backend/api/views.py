@@ -1,23 +1,35 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django_otp.plugins.otp_totp.models import TOTPDevice
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenRefreshView
+from django.http import HttpResponse, HttpResponseBase, JsonResponse, StreamingHttpResponse
+from .authentication import resolve_user
+from .batch import batch_summary, create_notes, delete_notes, parse_batch
+from .challenge import challenge_devices, create_challenge, read_challenge
+from .conditional import day_validators, make_etag, not_modified, notes_etag, set_validators, setup_etag
+from .downloads import download_response, prepare_download
+from .export import EXPORTERS, FORMATS as EXPORT_FORMATS, set_export_headers
+from .hashing import HashingUnavailable, authenticate_credentials
 from .models import Note
-import qrcode
-from io import BytesIO
-import base64
-import urllib.parse
-import os
-from datetime import datetime
-import hashlib
-import time
+from .notes import (
+    create_note, delete_note, find_notes, note_values, notes_page, notes_page_queryset,
+    parse_list_params, parse_preview, parse_search_params, serialize_note,
+)
+from .otp import verify_token
+from .revocation import get_revocations, token_expiry
+from .search import is_available as search_available
+from .storage import get_note_storage
+from .throttling import check_login, check_mfa, limiter_stats
+from . import metrics, qr
 
 
 def get_tokens_for_user(user):
@@ -25,12 +37,27 @@ def get_tokens_for_user(user):
     Generate JWT tokens for a user.
     """
     refresh = RefreshToken.for_user(user)
+    # Claims for the stateless authentication mode (JWT_AUTH_STATELESS)
+    refresh['username'] = user.username
+    refresh['is_staff'] = user.is_staff
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
     }
 
 
+def too_many_attempts(retry_after):
+    """
+    429 response for attempts rejected by the brute-force limiter.
+    """
+    response = Response(
+        {'error': 'Too many attempts. Please try again later.', 'retry_after': retry_after},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -49,19 +76,30 @@ def login(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    user = authenticate(username=username, password=password)
+    # Reject excess attempts before paying for the password hash
+    retry_after = check_login(request, username)
+    if retry_after:
+        return too_many_attempts(retry_after)
+    
+    try:
+        user = authenticate_credentials(username, password, request)
+    except HashingUnavailable:
+        response = Response(
+            {'error': 'Server is busy. Please try again later.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = '1'
+        return response
     
     if user is not None:
-        # Check if user has MFA enabled
-        has_mfa = TOTPDevice.objects.filter(user=user, confirmed=True).exists()
+        # One query tells whether MFA is enabled and which device the
+        # challenge should point to
+        device = TOTPDevice.objects.filter(user=user).order_by('-confirmed').values('id', 'confirmed').first()
+        has_mfa = device is not None and device['confirmed']
+        temp_token, timestamp = create_challenge(user.id, device['id'] if device else None)
         
         if has_mfa:
-            # Generate a temporary token for MFA verification
-            # This is a simple hash of user_id + timestamp, valid for 5 minutes
-            timestamp = int(time.time())
-            temp_token_data = f"{user.id}:{timestamp}:{settings.SECRET_KEY}"
-            temp_token = hashlib.sha256(temp_token_data.encode()).hexdigest()[:32]
-            
+            # Temporary token for MFA verification
             return Response({
                 'requires_mfa': True,
                 'message': 'MFA verification required',
@@ -70,11 +108,7 @@ def login(request):
                 'timestamp': timestamp
             }, status=status.HTTP_200_OK)
         else:
-            # Generate a temporary token for MFA setup
-            timestamp = int(time.time())
-            temp_token_data = f"{user.id}:{timestamp}:{settings.SECRET_KEY}"
-            temp_token = hashlib.sha256(temp_token_data.encode()).hexdigest()[:32]
-            
+            # Temporary token for MFA setup
             return Response({
                 'requires_mfa_setup': True,
                 'message': 'MFA setup required',
@@ -89,20 +123,6 @@ def login(request):
         )
 
 
-def verify_temp_token(temp_token, user_id, timestamp):
-    """
-    Verify the temporary token used for MFA flow.
-    Token is valid for 5 minutes.
-    """
-    current_time = int(time.time())
-    if current_time - timestamp > 300:  # 5 minutes
-        return False
-    
-    temp_token_data = f"{user_id}:{timestamp}:{settings.SECRET_KEY}"
-    expected_token = hashlib.sha256(temp_token_data.encode()).hexdigest()[:32]
-    return temp_token == expected_token
-
-
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -113,36 +133,43 @@ def verify_mfa(request):
     """
     token = request.data.get('token')
     temp_token = request.data.get('temp_token')
-    user_id = request.data.get('user_id')
-    timestamp = request.data.get('timestamp')
     
-    if not token or not temp_token or not user_id or not timestamp:
+    if not token or not temp_token:
         return Response(
-            {'error': 'Token, temp_token, user_id, and timestamp are required'},
+            {'error': 'Token and temp_token are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(temp_token, str):
+        return Response(
+            {'error': 'temp_token must be a string'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
     # Verify temporary token
     try:
-        user_id_int = int(user_id)
-        timestamp_int = int(timestamp)
-    except (ValueError, TypeError):
+        challenge = read_challenge(temp_token, request.data.get('user_id'), request.data.get('timestamp'))
+    except ValueError as e:
         return Response(
-            {'error': 'Invalid user_id or timestamp format'},
+            {'error': str(e)},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    if not verify_temp_token(temp_token, user_id_int, timestamp_int):
+    if challenge is None:
         return Response(
             {'error': 'Invalid or expired temporary token'},
             status=status.HTTP_401_UNAUTHORIZED
         )
     
+    retry_after = check_mfa(request, challenge.user_id)
+    if retry_after:
+        return too_many_attempts(retry_after)
+    
     try:
-        user = User.objects.get(id=user_id_int)
-        device = TOTPDevice.objects.get(user=user, confirmed=True)
+        # Device and user in one query
+        device = challenge_devices(challenge, confirmed=True).get()
+        user = device.user
         
-        if device.verify_token(token):
+        if verify_token(device, token):
             # Generate JWT tokens
             tokens = get_tokens_for_user(user)
             return Response({
@@ -154,7 +181,7 @@ def verify_mfa(request):
                 {'error': 'Invalid MFA token'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-    except (User.DoesNotExist, TOTPDevice.DoesNotExist):
+    except TOTPDevice.DoesNotExist:
         return Response(
             {'error': 'MFA device not found'},
             status=status.HTTP_404_NOT_FOUND
@@ -166,44 +193,59 @@ def verify_mfa(request):
 def mfa_setup(request):
     """
     Get or create MFA device and return QR code for setup.
-    Accepts temp_token, user_id, and timestamp for initial setup.
+    Accepts the temp_token returned by login for initial setup.
+    The optional qr_format query parameter selects png, svg or uri output.
     """
+    device = None
     if request.user.is_authenticated:
-        user = request.user
+        user = resolve_user(request.user)
     else:
         # Get from query parameters (for initial setup)
         temp_token = request.GET.get('temp_token')
-        user_id = request.GET.get('user_id')
-        timestamp = request.GET.get('timestamp')
         
-        if not temp_token or not user_id or not timestamp:
+        if not temp_token:
             return Response(
-                {'error': 'temp_token, user_id, and timestamp are required'},
+                {'error': 'temp_token is required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Verify temporary token
-        if not verify_temp_token(temp_token, int(user_id), int(timestamp)):
+        try:
+            challenge = read_challenge(temp_token, request.GET.get('user_id'), request.GET.get('timestamp'))
+        except ValueError as e:
             return Response(
-                {'error': 'Invalid or expired temporary token. Please login again.'},
-                status=status.HTTP_401_UNAUTHORIZED
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            user = User.objects.get(id=int(user_id))
-        except (User.DoesNotExist, ValueError):
+        if challenge is None:
             return Response(
-                {'error': 'User not found'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Invalid or expired temporary token. Please login again.'},
+                status=status.HTTP_401_UNAUTHORIZED
             )
+        
+        # A challenge naming a device resolves device and user in one query
+        if challenge.device_id is not None:
+            device = challenge_devices(challenge).first()
+        if device is not None:
+            user = device.user
+        else:
+            try:
+                user = User.objects.get(id=challenge.user_id)
+            except User.DoesNotExist:
+                return Response(
+                    {'error': 'User not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
     
     # Create custom device name: "my-mfa-app + username"
     device_name = f"my-mfa-app-{user.username}"
     
-    device, created = TOTPDevice.objects.get_or_create(
-        user=user,
-        defaults={'name': device_name, 'confirmed': False}
-    )
+    if device is None:
+        device, created = TOTPDevice.objects.get_or_create(
+            user=user,
+            defaults={'name': device_name, 'confirmed': False}
+        )
     
     # Update device name if it was created with old name
     if device.name != device_name:
@@ -211,38 +253,39 @@ def mfa_setup(request):
         device.save()
     
     if not device.confirmed:
-        base_config_url = device.config_url
-        
-        # Parse and customize the config URL
-        # Extract secret from the original URL
-        parsed = urllib.parse.urlparse(base_config_url)
-        query_params = urllib.parse.parse_qs(parsed.query)
-        secret = query_params.get('secret', [device.key])[0]
-        
-        # Create custom config URL with "my-mfa-app" as issuer and username as account name
-        issuer = "my-mfa-app"
-        account_name = user.username
-        config_url = f"otpauth://totp/{issuer}:{account_name}?secret={secret}&issuer={issuer}"
+        # "png" (default), "svg" for a much smaller image, or "uri" to only
+        # return the otpauth:// URL and let the client render the code.
+        qr_format = request.GET.get('qr_format', settings.MFA_QR_DEFAULT_FORMAT)
+        if qr_format not in qr.FORMATS:
+            return Response(
+                {'error': f'qr_format must be one of: {", ".join(qr.FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(config_url)
-        qr.make(fit=True)
+        # A client that already has this device's code gets a 304
+        # without the QR code being rendered or looked up
+        etag = setup_etag(device, qr.build_config_url(device, user.username), qr_format)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
         
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        qr_code_data = base64.b64encode(buffer.getvalue()).decode()
+        config_url, qr_code = qr.get_qr_code(device, user.username, qr_format)
         
-        return Response({
-            'qr_code': f'data:image/png;base64,{qr_code_data}',
+        return set_validators(Response({
+            'qr_code': qr_code,
+            'otpauth_url': config_url,
             'secret': device.key,
             'setup_required': True
-        }, status=status.HTTP_200_OK)
+        }, status=status.HTTP_200_OK), etag)
     else:
-        return Response({
+        etag = setup_etag(device)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_validators(Response({
             'setup_required': False,
             'message': 'MFA is already set up'
-        }, status=status.HTTP_200_OK)
+        }, status=status.HTTP_200_OK), etag)
 
 
 @csrf_exempt
@@ -251,37 +294,43 @@ def mfa_setup(request):
 def mfa_confirm(request):
     """
     Confirm MFA setup by verifying the token.
-    Accepts temp_token, user_id, and timestamp for initial setup.
+    Accepts the temp_token returned by login for initial setup.
     Returns JWT tokens upon successful confirmation.
     """
     token = request.data.get('token')
     temp_token = request.data.get('temp_token')
-    user_id = request.data.get('user_id')
-    timestamp = request.data.get('timestamp')
     
     if request.user.is_authenticated:
-        user = request.user
+        user = resolve_user(request.user)
+        devices = TOTPDevice.objects.filter(user=user)
     else:
-        if not temp_token or not user_id or not timestamp:
+        user = None
+        if not temp_token:
+            return Response(
+                {'error': 'temp_token is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not isinstance(temp_token, str):
             return Response(
-                {'error': 'temp_token, user_id, and timestamp are required'},
+                {'error': 'temp_token must be a string'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Verify temporary token
-        if not verify_temp_token(temp_token, int(user_id), int(timestamp)):
+        try:
+            challenge = read_challenge(temp_token, request.data.get('user_id'), request.data.get('timestamp'))
+        except ValueError as e:
             return Response(
-                {'error': 'Invalid or expired temporary token. Please login again.'},
-                status=status.HTTP_401_UNAUTHORIZED
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            user = User.objects.get(id=int(user_id))
-        except (User.DoesNotExist, ValueError):
+        if challenge is None:
             return Response(
-                {'error': 'User not found'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Invalid or expired temporary token. Please login again.'},
+                status=status.HTTP_401_UNAUTHORIZED
             )
+        devices = challenge_devices(challenge)
     
     if not token:
         return Response(
@@ -289,10 +338,16 @@ def mfa_confirm(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    retry_after = check_mfa(request, user.id if user else challenge.user_id)
+    if retry_after:
+        return too_many_attempts(retry_after)
+    
     try:
-        device = TOTPDevice.objects.get(user=user, confirmed=False)
+        # Device and user in one query
+        device = devices.get(confirmed=False)
+        user = user or device.user
         
-        if device.verify_token(token):
+        if verify_token(device, token):
             device.confirmed = True
             device.save()
             
@@ -314,15 +369,57 @@ def mfa_confirm(request):
         )
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def auth_rate_limits(request):
+    """
+    Allowed and rejected attempt counters of the brute-force limiter
+    (per process unless AUTH_RATE_LIMIT_CACHE is set). Staff only.
+    """
+    return Response({
+        'enabled': settings.AUTH_RATE_LIMIT_ENABLED,
+        'limits': limiter_stats(),
+    }, status=status.HTTP_200_OK)
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics of all worker processes (see api/metrics.py), for
+    internal clients only: a bearer METRICS_TOKEN, or addresses in
+    METRICS_ALLOWED_NETWORKS if set.
+    """
+    if not metrics.is_enabled():
+        return JsonResponse({'error': 'Metrics are disabled'}, status=404)
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405, headers={'Allow': 'GET'})
+    if not metrics.is_allowed(request):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout(request):
     """
-    Logout endpoint. With JWT, logout is handled client-side by removing tokens.
-    Optionally, we can blacklist the refresh token here.
+    Logout endpoint. The client removes its tokens; if it sends its refresh
+    token, that token is revoked so it can no longer be used.
+    Access tokens stay valid until they expire.
     """
-    # In a production app, you might want to blacklist the refresh token
-    # For now, we'll just return success - client should remove tokens
+    refresh = request.data.get('refresh')
+    if refresh:
+        try:
+            token = RefreshToken(refresh)
+        except TokenError:
+            # Already expired or invalid: nothing left to revoke
+            token = None
+        if token is not None:
+            if str(token.get(api_settings.USER_ID_CLAIM)) != str(request.user.pk):
+                return Response({'error': 'Refresh token does not belong to this user'}, status=status.HTTP_400_BAD_REQUEST)
+            get_revocations().revoke(token[api_settings.JTI_CLAIM], token_expiry(token))
+
     return Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
 
 
@@ -332,7 +429,11 @@ def welcome(request):
     """
     Welcome endpoint that returns success message for authenticated users.
     """
-    return Response({'message': 'Success!'}, status=status.HTTP_200_OK)
+    etag = make_etag('welcome')
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    return set_validators(Response({'message': 'Success!'}, status=status.HTTP_200_OK), etag)
 
 
 @api_view(['GET'])
@@ -350,9 +451,14 @@ def lucky_number(request):
 @permission_classes([IsAuthenticated])
 def quote_of_the_day(request):
     """
-    Return a random quote from a collection of quotes.
+    Return the quote of the day from a collection of quotes. The quote only
+    changes at midnight, so clients may cache it until then.
     """
-    import random
+    today = timezone.localdate()
+    etag, last_modified, max_age = day_validators(today)
+    response = not_modified(request, etag, last_modified, max_age)
+    if response is not None:
+        return response
     quotes = [
         "The only way to do great work is to love what you do. - Steve Jobs",
         "Innovation distinguishes between a leader and a follower. - Steve Jobs",
@@ -365,28 +471,68 @@ def quote_of_the_day(request):
         "If you are working on something exciting that you really care about, you don't have to be pushed. The vision pulls you. - Steve Jobs",
         "People who are crazy enough to think they can change the world, are the ones who do. - Rob Siltanen"
     ]
-    quote = random.choice(quotes)
-    return Response({'quote': quote}, status=status.HTTP_200_OK)
+    quote = quotes[today.toordinal() % len(quotes)]
+    return set_validators(Response({'quote': quote}, status=status.HTTP_200_OK), etag, last_modified, max_age)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def notes_list(request):
     """
-    Get all notes for the authenticated user.
+    Get the notes of the authenticated user, newest first, one page at a time.
+    Pass the returned next_cursor as ?cursor= to get the following page, and
+    ?limit= to change the page size. ?version=1 returns all notes unpaginated.
+    ?preview=1 adds the start of the content of notes stored inline.
+    """
+    try:
+        version, cursor, limit = parse_list_params(request.GET)
+    except ValueError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    notes = Note.objects.filter(author_id=request.user.id)
+    preview = parse_preview(request.GET)
+    if version == '1':
+        rows = list(note_values(notes, preview))
+    else:
+        rows = list(notes_page_queryset(notes, cursor, limit, preview))
+    etag = notes_etag(request.user.id, rows, request.META.get('QUERY_STRING', ''))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    
+    if version == '1':
+        notes_data = [serialize_note(row) for row in rows]
+        return set_validators(Response({'notes': notes_data}, status=status.HTTP_200_OK), etag)
+    return set_validators(Response(notes_page(rows, limit), status=status.HTTP_200_OK), etag)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notes_search(request):
+    """
+    Full-text search of the authenticated user's notes, best match first.
+    ?q= holds the words to find (all must match, 'word*' matches a prefix);
+    ?limit= and ?offset= page through the results.
     """
-    notes = Note.objects.filter(author=request.user)
-    notes_data = []
-    for note in notes:
-        notes_data.append({
-            'id': note.id,
-            'title': note.title,
-            'file_url': f'/api/notes/{note.id}/download/',  # Use API endpoint instead of direct file URL
-            'file_path': note.file_path,
-            'created_at': note.created_at.isoformat(),
-            'updated_at': note.updated_at.isoformat(),
-        })
-    return Response({'notes': notes_data}, status=status.HTTP_200_OK)
+    if not search_available():
+        return Response(
+            {'error': 'Search is not available on this database'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    
+    try:
+        query, limit, offset = parse_search_params(request.GET)
+        results = find_notes(request.user.id, query, limit, offset)
+    except ValueError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response(results, status=status.HTTP_200_OK)
 
 
 @csrf_exempt
@@ -394,7 +540,7 @@ def notes_list(request):
 @permission_classes([IsAuthenticated])
 def notes_create(request):
     """
-    Create a new note and save it as a txt file.
+    Create a new note, stored inline or as a txt file depending on its size.
     """
     title = request.data.get('title', '').strip()
     content = request.data.get('content', '').strip()
@@ -411,35 +557,19 @@ def notes_create(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Ensure notes directory exists
-    notes_dir = settings.NOTES_DIR
-    os.makedirs(notes_dir, exist_ok=True)
-    
-    # Create unique filename
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-    safe_title = safe_title.replace(' ', '_')[:50]
-    filename = f"{request.user.id}_{timestamp}_{safe_title}.txt"
-    file_path = os.path.join(notes_dir, filename)
-    
-    # Save content to file
+    # Save content to a file, unless it is small enough to be stored inline
+    storage = get_note_storage()
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        relative_path = storage.store(content)
     except Exception as e:
         return Response(
             {'error': f'Failed to save file: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
     
-    # Create note record in database
-    # Store relative path for the file
-    relative_path = f'/media/notes/{filename}'
-    note = Note.objects.create(
-        author=request.user,
-        title=title,
-        file_path=relative_path
-    )
+    # Create note record in database, and index it for search
+    note = create_note(request.user.id, title, relative_path, content)
+    storage.ensure(relative_path, content)
     
     # Return API endpoint URL for downloading
     file_url = f'/api/notes/{note.id}/download/'
@@ -453,46 +583,108 @@ def notes_create(request):
     }, status=status.HTTP_201_CREATED)
 
 
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def notes_batch_create(request):
+    """
+    Create many notes in one request: {"notes": [{"title", "content"}, ...]}.
+    Returns a result per note; invalid notes do not fail the others.
+    """
+    try:
+        items = parse_batch(request.data, 'notes')
+    except ValueError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        results = create_notes(request.user, items)
+    except Exception as e:
+        return Response(
+            {'error': f'Failed to create notes: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    summary = batch_summary(results, 'created')
+    response_status = status.HTTP_201_CREATED if summary['created'] else status.HTTP_400_BAD_REQUEST
+    return Response(summary, status=response_status)
+
+
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def notes_batch_delete(request):
+    """
+    Delete many notes in one request: {"ids": [1, 2, ...]}.
+    Returns a result per id; unknown ids are reported as not found.
+    """
+    try:
+        ids = parse_batch(request.data, 'ids')
+        results = delete_notes(request.user, ids)
+    except ValueError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response(batch_summary(results, 'deleted'), status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def notes_download(request, note_id):
     """
     Download a note file. Only the author can download their own notes.
+    Supports ETag/Last-Modified revalidation and single byte-range requests.
     """
     try:
-        note = Note.objects.get(id=note_id, author=request.user)
+        note = Note.objects.get(id=note_id, author_id=request.user.id)
     except Note.DoesNotExist:
         return Response(
             {'error': 'Note not found'},
             status=status.HTTP_404_NOT_FOUND
         )
     
-    # Get the actual file path
-    file_path = os.path.join(settings.MEDIA_ROOT, note.file_path.lstrip('/media/'))
-    
-    if not os.path.exists(file_path):
+    # Stream the file, honouring conditional and Range headers
+    try:
+        download = prepare_download(request, note)
+    except FileNotFoundError:
         return Response(
             {'error': 'File not found'},
             status=status.HTTP_404_NOT_FOUND
         )
-    
-    # Read and serve the file
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        from django.http import HttpResponse
-        
-        # Sanitize filename for Content-Disposition header
-        safe_filename = urllib.parse.quote(note.title.replace('/', '_').replace('\\', '_'))
-        response = HttpResponse(content, content_type='text/plain; charset=utf-8')
-        response['Content-Disposition'] = f'attachment; filename="{safe_filename}.txt"'
-        return response
     except Exception as e:
         return Response(
             {'error': f'Failed to read file: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+    
+    if isinstance(download, HttpResponseBase):
+        return download
+    return download_response(download)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notes_export(request):
+    """
+    Stream all notes of the authenticated user with their content, as NDJSON
+    (?type=ndjson, the default) or as a zip archive (?type=zip).
+    """
+    export_format = request.GET.get('type', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return Response(
+            {'error': f'type must be one of: {", ".join(EXPORT_FORMATS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    response = StreamingHttpResponse(
+        EXPORTERS[export_format](request.user.id),
+        content_type=EXPORT_FORMATS[export_format]
+    )
+    return set_export_headers(response, request.user.username, export_format)
 
 
 @api_view(['DELETE'])
@@ -502,23 +694,15 @@ def notes_delete(request, note_id):
     Delete a note and its associated txt file.
     """
     try:
-        note = Note.objects.get(id=note_id, author=request.user)
+        note = Note.objects.get(id=note_id, author_id=request.user.id)
     except Note.DoesNotExist:
         return Response(
             {'error': 'Note not found'},
             status=status.HTTP_404_NOT_FOUND
         )
     
-    # Delete the file
-    file_path = os.path.join(settings.MEDIA_ROOT, note.file_path.lstrip('/media/'))
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            # Log error but continue with database deletion
-            print(f"Warning: Failed to delete file {file_path}: {e}")
-    
-    # Delete the note record
-    note.delete()
+    # Delete the note record, then its file once nothing references it
+    delete_note(note)
+    get_note_storage().delete(note.file_path)
     
     return Response({'message': 'Note deleted successfully'}, status=status.HTTP_200_OK)
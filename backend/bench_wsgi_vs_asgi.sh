@@ -0,0 +1,48 @@
+#!/bin/sh
+# Compare the WSGI and ASGI deployments under mixed load: the regular
+# benchmark flows plus slow clients trickling request bodies. The login
+# rate limiter is disabled on both servers.
+#
+# Usage: ./bench_wsgi_vs_asgi.sh [extra benchmark options]
+# Environment:
+#   SLOW_CLIENTS  number of slow clients (default 50)
+#   WSGI_SERVER   command serving config.wsgi on $WSGI_PORT (default: runserver)
+#   ASGI_SERVER   command serving config.asgi on $ASGI_PORT (default: uvicorn)
+set -e
+cd "$(dirname "$0")"
+
+WSGI_PORT=${WSGI_PORT:-8101}
+ASGI_PORT=${ASGI_PORT:-8102}
+SLOW_CLIENTS=${SLOW_CLIENTS:-50}
+WSGI_SERVER=${WSGI_SERVER:-"python manage.py runserver --noreload 127.0.0.1:$WSGI_PORT"}
+ASGI_SERVER=${ASGI_SERVER:-"uvicorn config.asgi:application --host 127.0.0.1 --port $ASGI_PORT --log-level warning"}
+
+wait_for_port() {
+    for _ in $(seq 50); do
+        python -c "import socket; socket.create_connection(('127.0.0.1', $1), 1)" 2>/dev/null && return 0
+        sleep 0.2
+    done
+    echo "Server on port $1 did not start" >&2
+    return 1
+}
+
+run_benchmark() {
+    # $1: label, $2: port
+    PID=$3
+    wait_for_port "$2"
+    python manage.py benchmark --url "http://127.0.0.1:$2" --slow-clients "$SLOW_CLIENTS" \
+        --label "$1" --output "bench_$1.json" $EXTRA_ARGS || true
+    kill "$PID" 2>/dev/null || true
+    wait "$PID" 2>/dev/null || true
+}
+
+EXTRA_ARGS="$*"
+
+echo "== WSGI: $WSGI_SERVER"
+AUTH_RATE_LIMIT_ENABLED=0 API_ASYNC_VIEWS=0 sh -c "exec $WSGI_SERVER" &
+run_benchmark wsgi "$WSGI_PORT" $!
+
+echo "== ASGI: $ASGI_SERVER"
+EXTRA_ARGS="$EXTRA_ARGS --compare bench_wsgi.json"
+AUTH_RATE_LIMIT_ENABLED=0 API_ASYNC_VIEWS=1 sh -c "exec $ASGI_SERVER" &
+run_benchmark asgi "$ASGI_PORT" $!
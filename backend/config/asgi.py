@@ -0,0 +1,31 @@
+"""
+ASGI config for config project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+With API_ASYNC_VIEWS=1 the auth and notes endpoints are served by the async
+views in api/async_views.py, e.g.:
+
+    API_ASYNC_VIEWS=1 uvicorn config.asgi:application --host 0.0.0.0 --port 8000
+
+The variable must be set in the environment of the server: this module
+cannot set it, since a server may load the settings before importing it
+(gunicorn.conf.py does). `manage.py serve --asgi` sets it.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.APP_PRELOAD:
+    from api.startup import preload  # noqa: E402
+
+    preload()
@@ -2,8 +2,12 @@
 Django settings for config project.
 """
 
+import os
+import tempfile
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
@@ -24,25 +28,53 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'rest_framework_simplejwt',
+    # rest_framework_simplejwt is not an app here: it only adds translations,
+    # and its package import (pkg_resources) would slow down every command
     'corsheaders',
     'django_otp',
     'django_otp.plugins.otp_totp',
     'api',
 ]
 
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
+# With API_LEAN_MIDDLEWARE, /api/ requests (JWT authenticated, CSRF exempt)
+# skip the session/CSRF/auth/OTP/messages stack, which then only runs for
+# the admin (see api.middleware.SiteMiddleware)
+API_LEAN_MIDDLEWARE = os.environ.get('API_LEAN_MIDDLEWARE', '1') == '1'
+API_PATH_PREFIX = '/api/'
+
+SITE_MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'corsheaders.middleware.CorsMiddleware',
-    'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django_otp.middleware.OTPMiddleware',
+    'api.middleware.OTPMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if API_LEAN_MIDDLEWARE:
+    MIDDLEWARE = [
+        'api.middleware.MetricsMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'corsheaders.middleware.CorsMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'api.middleware.SiteMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ]
+    # The admin's session, auth and messages middleware are in SITE_MIDDLEWARE
+    SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
+else:
+    MIDDLEWARE = [
+        'api.middleware.MetricsMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'corsheaders.middleware.CorsMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'api.middleware.OTPMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ]
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -62,14 +94,78 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
-
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+ASGI_APPLICATION = 'config.asgi.application'
+
+# `manage.py serve`: gunicorn with a pre-forked worker pool (see gunicorn.conf.py)
+SERVE_BIND = os.environ.get('SERVE_BIND', '0.0.0.0:8000')
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', '0'))  # 0 = 2 per available CPU + 1
+SERVE_THREADS = int(os.environ.get('SERVE_THREADS', '1'))  # request threads per worker, see gunicorn.conf.py
+SERVE_PRELOAD = os.environ.get('SERVE_PRELOAD', '1') == '1'  # load the app once, before forking
+SERVE_MAX_REQUESTS = int(os.environ.get('SERVE_MAX_REQUESTS', '5000'))  # recycle a worker after this many (0 = never)
+SERVE_TIMEOUT = 30  # seconds before a stuck worker is killed and replaced
+SERVE_GRACEFUL_TIMEOUT = 30  # seconds given to in-flight requests on reload and shutdown
+SERVE_KEEPALIVE = 5  # seconds
+SERVE_PIDFILE = os.environ.get('SERVE_PIDFILE', '')  # for `kill -HUP $(cat pidfile)`
+SERVE_ACCESS_LOG = os.environ.get('SERVE_ACCESS_LOG', '0') == '1'
+
+# Load the views and their dependencies when the WSGI/ASGI application is
+# loaded instead of on the first requests (see api/startup.py)
+APP_PRELOAD = os.environ.get('APP_PRELOAD', '1') == '1'
+
+# Serve the auth and notes endpoints with the async views (set by `serve --asgi`)
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', '0') == '1'
+
+
+# Database profile, selected with DB_PROFILE:
+#   sqlite      plain SQLite, for development (default)
+#   sqlite-wal  SQLite tuned for concurrent requests: WAL journal,
+#               synchronous=NORMAL, busy timeout, mmap and persistent connections
+#   postgres    PostgreSQL from the POSTGRES_* variables (requires psycopg),
+#               with persistent connections
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '600'))  # seconds a connection is reused
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'mfa'),
+            'USER': os.environ.get('POSTGRES_USER', 'mfa'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+elif DB_PROFILE in ('sqlite', 'sqlite-wal'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+else:
+    raise ImproperlyConfigured(f'Unknown DB_PROFILE: {DB_PROFILE}')
+
+# PRAGMAs run on every new SQLite connection (see api/signals.py)
+SQLITE_PRAGMAS = {}
+if DB_PROFILE == 'sqlite-wal':
+    DATABASES['default'].update({
+        # Seconds a statement waits for a lock before "database is locked"
+        'OPTIONS': {'timeout': 20},
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    })
+    SQLITE_PRAGMAS = {
+        # Readers no longer block the writer, and the writer not readers
+        'journal_mode': 'WAL',
+        # Durable at checkpoints instead of every commit; safe with WAL
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # KiB
+        'temp_store': 'MEMORY',
     }
-}
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -106,6 +202,87 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 NOTES_DIR = MEDIA_ROOT / 'notes'
+# Store identical note contents once, named by their SHA-256
+NOTES_DEDUPLICATE = os.environ.get('NOTES_DEDUPLICATE', '0') == '1'
+# Compress note files of at least NOTES_COMPRESS_MIN_SIZE bytes ('' disables)
+NOTES_COMPRESSION = os.environ.get('NOTES_COMPRESSION', 'gzip')
+NOTES_COMPRESS_MIN_SIZE = 1024
+# Store notes of at most this many bytes in the Note row instead of a file (0 disables).
+# After changing it, `manage.py migrate_note_tiers` moves existing notes.
+NOTES_INLINE_MAX_SIZE = int(os.environ.get('NOTES_INLINE_MAX_SIZE', '1024'))
+
+# Notes list pagination
+NOTES_PAGE_SIZE = 50
+NOTES_MAX_PAGE_SIZE = 200
+NOTES_PREVIEW_LENGTH = 200  # characters of content in notes/?preview=1
+
+# Batch notes endpoints
+NOTES_BATCH_MAX_ITEMS = 1000  # notes or ids accepted per batch request
+NOTES_BATCH_WORKERS = 8  # threads writing/unlinking note files of a batch
+NOTES_EXPORT_CHUNK_SIZE = 2000  # rows fetched at a time by notes/export
+
+# Caches. Set REDIS_URL (requires the redis package) to share the cache,
+# and with it the auth rate limit counters, between processes and hosts.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Brute-force admission control for login and MFA code attempts
+AUTH_RATE_LIMIT_ENABLED = os.environ.get('AUTH_RATE_LIMIT_ENABLED', '1') == '1'
+AUTH_RATE_LIMIT_CACHE = 'default' if os.environ.get('REDIS_URL') else None  # None = per-process counters
+AUTH_RATE_LIMIT_TRUSTED_PROXIES = 0  # proxies whose X-Forwarded-For entry is trusted
+AUTH_RATE_LIMITS = {
+    # scope: (attempts, window in seconds)
+    'login_user': (10, 60),
+    'login_ip': (30, 60),
+    'mfa_user': (10, 60),
+    'mfa_ip': (30, 60),
+}
+
+# Password verification in a separate process pool (0 = in the request thread).
+# Logins waiting longer than the timeout for a queue slot get a 503.
+# Logins still go through AUTHENTICATION_BACKENDS and send user_login_failed.
+PASSWORD_HASH_POOL_SIZE = int(os.environ.get('PASSWORD_HASH_POOL_SIZE', '0'))
+PASSWORD_HASH_POOL_QUEUE = 32  # checks waiting for a free process
+PASSWORD_HASH_POOL_TIMEOUT = 5  # seconds
+
+# TOTP verification keeps replay-protection and throttling state in the cache
+# and writes it to the database in batches. Several processes must share the
+# cache (REDIS_URL) for replay protection to hold across them.
+OTP_COALESCE_WRITES = os.environ.get('OTP_COALESCE_WRITES', '1' if os.environ.get('REDIS_URL') else '0') == '1'
+OTP_STATE_CACHE = 'default'
+OTP_FLUSH_INTERVAL = 5  # seconds between batched device writes
+OTP_FLUSH_BATCH = 100  # pending devices that trigger a write
+
+# MFA enrollment QR codes
+MFA_QR_CACHE_SIZE = 512  # rendered QR codes kept in memory per process
+MFA_QR_DEFAULT_FORMAT = 'png'  # 'png', 'svg' or 'uri' (otpauth:// URL only)
+MFA_QR_PRERENDER = False  # render the QR code as soon as a device is created
+
+# Prometheus metrics at /api/metrics/ (see api/metrics.py). Each worker
+# process writes its values to METRICS_DIR, which all workers of a
+# deployment must share and which should be emptied when it restarts.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'simple-mfa-metrics'))
+METRICS_FLUSH_INTERVAL = 5  # seconds between snapshots of a process
+# Scrapers authenticate with 'Authorization: Bearer <METRICS_TOKEN>'. Client
+# networks allowed without the token must be listed explicitly (comma-separated,
+# e.g. '127.0.0.0/8,::1/128'): behind a reverse proxy on the same host every
+# request comes from loopback unless AUTH_RATE_LIMIT_TRUSTED_PROXIES is set.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_NETWORKS = [
+    network.strip() for network in os.environ.get('METRICS_ALLOWED_NETWORKS', '').split(',') if network.strip()
+]
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -114,20 +291,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
 
+# JWT user resolution: cache users per process, or trust the token claims
+# without any lookup in stateless mode
+JWT_AUTH_STATELESS = os.environ.get('JWT_AUTH_STATELESS', '0') == '1'
+JWT_USER_CACHE_SIZE = 1024
+JWT_USER_CACHE_TTL = 60  # seconds, 0 disables the cache
+
+# Refresh token revocation (logout and rotation): revoked JTIs are stored
+# until they expire, with a per-process Bloom filter in front of the table
+TOKEN_REVOKE_AFTER_ROTATION = True
+TOKEN_REVOCATION_BLOOM_CAPACITY = 100000
+TOKEN_REVOCATION_BLOOM_ERROR_RATE = 0.001
+TOKEN_REVOCATION_SYNC_INTERVAL = 5  # seconds, picks up revocations of other processes
+# Each sync also re-reads rows revoked this many seconds before the previous one,
+# for transactions that commit after a row with a higher id was synced
+TOKEN_REVOCATION_SYNC_OVERLAP = 60
+TOKEN_REVOCATION_PRUNE_INTERVAL = 3600  # seconds, drops expired rows and rebuilds the filter
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
-    'BLACKLIST_AFTER_ROTATION': False,  # Set to True if you install djangorestframework-simplejwt[blacklist]
+    'BLACKLIST_AFTER_ROTATION': False,  # Rotated tokens are revoked by api.revocation instead
+    'TOKEN_REFRESH_SERIALIZER': 'api.revocation.RevokingTokenRefreshSerializer',
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
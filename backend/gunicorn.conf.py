@@ -0,0 +1,68 @@
+"""
+Gunicorn configuration used by `python manage.py serve`, also picked up by
+a plain `gunicorn config.wsgi` run from this directory.
+
+Values come from the SERVE_* settings in config/settings.py:
+
+* 2 workers per available CPU + 1, each serving one request at a time,
+  or uvicorn workers serving config.asgi with the async views (`serve
+  --asgi`, which sets API_ASYNC_VIEWS=1 before these settings load). With
+  SERVE_THREADS > 1 gunicorn uses threaded workers instead, but a
+  recycled threaded worker resets the connections it accepted and had not
+  started on yet: keep one thread, or set SERVE_MAX_REQUESTS to 0;
+* the application is loaded and warmed up (APP_PRELOAD) once in the
+  master, and workers are forked from it ready to serve;
+* a worker is replaced after SERVE_MAX_REQUESTS requests (plus up to 10%);
+* `kill -HUP <master>` replaces the workers gracefully, `kill -TERM`
+  lets in-flight requests finish for up to SERVE_GRACEFUL_TIMEOUT seconds.
+  With SERVE_PRELOAD the master keeps the code it loaded: deploy new code
+  with a restart (or `kill -USR2` to start a new master alongside);
+* note downloads are FileResponses, which gunicorn sends with sendfile(),
+  and note exports report progress to the master (api/export.py), so a
+  long export does not get its worker killed after SERVE_TIMEOUT.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+from django.conf import settings  # noqa: E402
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = settings.SERVE_BIND
+workers = settings.SERVE_WORKERS or 2 * available_cpus() + 1
+worker_class = 'sync'
+threads = settings.SERVE_THREADS
+preload_app = settings.SERVE_PRELOAD
+max_requests = settings.SERVE_MAX_REQUESTS
+# Up to 10% more, so that workers are not all recycled at once
+max_requests_jitter = max_requests // 10
+timeout = settings.SERVE_TIMEOUT
+graceful_timeout = settings.SERVE_GRACEFUL_TIMEOUT
+keepalive = settings.SERVE_KEEPALIVE
+sendfile = True
+pidfile = settings.SERVE_PIDFILE or None
+accesslog = '-' if settings.SERVE_ACCESS_LOG else None
+
+
+def on_starting(server):
+    # Metrics totals start over with the server (see api/metrics.py)
+    from api import metrics
+    metrics.clear_snapshots()
+
+
+def post_worker_init(worker):
+    from api import export
+    export.set_heartbeat(worker.notify)
+
+
+def child_exit(server, worker):
+    # A recycled worker's totals are kept, without leaving its file behind
+    from api import metrics
+    metrics.retire_process(worker.pid)
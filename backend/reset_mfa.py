@@ -2,6 +2,9 @@
 """
 Script to reset MFA for admin user
 Run this to delete all MFA devices for admin: python reset_mfa.py
+
+For other users, or many at once, use the mfa_admin command:
+python manage.py mfa_admin reset --users alice,bob
 """
 import os
 import django
@@ -10,26 +13,15 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django_otp.plugins.otp_totp.models import TOTPDevice
 
-try:
-    user = User.objects.get(username='admin')
-    
-    devices = TOTPDevice.objects.filter(user=user)
-    device_count = devices.count()
-    
-    if device_count > 0:
-        print(f"Found {device_count} MFA device(s) for admin user:")
-        for device in devices:
-            print(f"  - ID: {device.id}, Name: {device.name}, Confirmed: {device.confirmed}")
-        
-        TOTPDevice.objects.filter(user=user).delete()
-        print(f"\n✓ Successfully deleted {device_count} MFA device(s).")
-        print("Admin will be required to set up MFA on next login.")
-    else:
-        print("No MFA devices found for admin user.")
-        print("MFA is already reset.")
-        
-except User.DoesNotExist:
+if not User.objects.filter(username='admin').exists():
     print("Error: Admin user not found!")
     print("Please create the admin user first using: python create_admin.py")
+elif not TOTPDevice.objects.filter(user__username='admin').exists():
+    print("No MFA devices found for admin user.")
+    print("MFA is already reset.")
+else:
+    call_command('mfa_admin', 'reset', '--users', 'admin', '--noinput', verbosity=2)
+    print("Admin will be required to set up MFA on next login.")
@@ -18,6 +18,29 @@ axios.interceptors.request.use(
   }
 )
 
+const REFRESH_URL = '/api/token/refresh/'
+
+// The refresh in progress, shared by every request that got a 401 meanwhile
+let refreshing = null
+
+// Refresh tokens are single-use: they are rotated and the old one is
+// revoked, so concurrent 401s must wait for one refresh instead of each
+// posting the same token
+function refreshTokens(refreshToken) {
+  if (!refreshing) {
+    refreshing = axios.post(REFRESH_URL, { refresh: refreshToken })
+      .then((response) => {
+        const { access, refresh } = response.data
+        auth.setTokens(access, refresh || refreshToken)
+        return access
+      })
+      .finally(() => {
+        refreshing = null
+      })
+  }
+  return refreshing
+}
+
 // Handle 401 errors and attempt token refresh
 axios.interceptors.response.use(
   (response) => response,
@@ -25,28 +48,36 @@ axios.interceptors.response.use(
     const originalRequest = error.config
 
     // If error is 401 and we haven't already tried to refresh
-    if (error.response?.status === 401 && !originalRequest._retry) {
+    const canRetry = originalRequest && !originalRequest._retry && originalRequest.url !== REFRESH_URL
+    if (error.response?.status === 401 && canRetry) {
       originalRequest._retry = true
 
-      try {
-        const refreshToken = auth.getRefreshToken()
-        if (refreshToken) {
-          const response = await axios.post('/api/token/refresh/', {
-            refresh: refreshToken
-          })
+      // The tokens were refreshed after this request was sent
+      const accessToken = auth.getAccessToken()
+      if (accessToken && originalRequest.headers.Authorization !== `Bearer ${accessToken}`) {
+        originalRequest.headers.Authorization = `Bearer ${accessToken}`
+        return axios(originalRequest)
+      }
 
-          const { access } = response.data
-          auth.setTokens(access, refreshToken)
+      const refreshToken = auth.getRefreshToken()
+      if (refreshToken) {
+        try {
+          const access = await refreshTokens(refreshToken)
 
           // Retry the original request with new token
           originalRequest.headers.Authorization = `Bearer ${access}`
           return axios(originalRequest)
+        } catch (refreshError) {
+          // Another tab may have rotated the token we posted in the meantime
+          if (auth.getRefreshToken() && auth.getRefreshToken() !== refreshToken) {
+            originalRequest.headers.Authorization = `Bearer ${auth.getAccessToken()}`
+            return axios(originalRequest)
+          }
+          // Refresh failed, clear tokens and redirect to login
+          auth.clearTokens()
+          router.push('/')
+          return Promise.reject(refreshError)
         }
-      } catch (refreshError) {
-        // Refresh failed, clear tokens and redirect to login
-        auth.clearTokens()
-        router.push('/')
-        return Promise.reject(refreshError)
       }
     }
 